@@ -16,8 +16,15 @@ from app.utils.exceptions import (
     APIException
 )
 from app.utils.helpers import JSONResponse
-from app.utils.redis_service import RedisClient
+from app.utils.redis_service import RedisClient, redis_pool, invalidation_listener, blocklist_cache, token_generations
+from app.utils.principal_cache import principal_cache, permission_epochs
+from app.utils.password_service import password_hasher, PasswordHasherBusy
+from app.utils.rate_limiter import rate_limiter
+from app.utils.label_service import label_renderer
+from app.utils.category_cache import category_tree_cache
+from app.cli import email_cli, stock_cli, qrcode_cli, items_cli, categories_cli, labels_cli
 from werkzeug.exceptions import HTTPException, InternalServerError
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +40,8 @@ def create_app(test_config=None):
     app.register_error_handler(APIException, handle_API_Exception)
     app.register_error_handler(InternalServerError, handle_internal_server_error)
     app.register_error_handler(DBAPIError, handle_DBAPI_disconnect)
+    app.register_error_handler(PasswordHasherBusy, handle_password_hasher_busy)
+    app.register_error_handler(redis.RedisError, handle_redis_error)
 
     # extensions
     configure_logger(app)
@@ -40,6 +49,19 @@ def create_app(test_config=None):
     migrate.init_app(app, db, directory=os.path.join(os.path.dirname(__file__), 'migrations'))
     jwt.init_app(app)
     cors.init_app(app)
+    redis_pool.init_app(app)
+    invalidation_listener.init_app(app)
+    blocklist_cache.init_app(app)
+    token_generations.init_app(app)
+    principal_cache.init_app(app)
+    permission_epochs.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    label_renderer.init_app(app)
+    category_tree_cache.init_app(app)
+    if app.config.get("RATELIMIT_TRUST_PROXY", False):
+        # remote_addr from the X-Forwarded-For entries added by the trusted proxies, the rest is set by the client
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config.get("RATELIMIT_PROXY_COUNT", 1))
 
     # API BLUEPRINTS
     app.register_blueprint(auth.auth_bp, url_prefix='/v1/auth')
@@ -49,6 +71,14 @@ def create_app(test_config=None):
     app.register_blueprint(storages.storages_bp, url_prefix='/v1/company/storages')
     app.register_blueprint(items.items_bp, url_prefix='/v1/company/items')
 
+    # CLI COMMANDS
+    app.cli.add_command(email_cli)
+    app.cli.add_command(stock_cli)
+    app.cli.add_command(qrcode_cli)
+    app.cli.add_command(items_cli)
+    app.cli.add_command(categories_cli)
+    app.cli.add_command(labels_cli)
+
     return app
 
 
@@ -58,6 +88,17 @@ def handle_DBAPI_disconnect(e):
     return resp.to_json()
 
 
+def handle_redis_error(e):
+    logger.error(f'RedisError: {e}')
+    resp = JSONResponse(message=str(e), payload={'error': 'redis-service'}, status_code=503, app_result='error')
+    return resp.to_json()
+
+
+def handle_password_hasher_busy(e):
+    resp = JSONResponse(message=str(e), payload={'error': 'password-hasher'}, status_code=503, app_result='error')
+    return resp.to_json()
+
+
 def handle_http_error(e):
     logger.info(f'HTTPError: {e} | path: {request.path}')
     resp = JSONResponse(message=str(e), status_code=e.code, app_result='error')
@@ -80,16 +121,12 @@ def handle_API_Exception(exception):  # exception == APIException
 #callbacks
 @jwt.token_in_blocklist_loader #check if a token is stored in the blocklist db.
 def check_if_token_revoked(jwt_header, jwt_payload):
-    jti = jwt_payload['jti']
-    r = RedisClient().set_client()
     logger.debug("check_if_token_revoked()")
     try:
-        token_in_redis = r.get(jti)
+        return RedisClient().is_jwt_revoked(jwt_payload)
     except redis.RedisError as re:
         abort(503, f"redis-service is down - {re}")
 
-    return token_in_redis is not None
-
 
 @jwt.revoked_token_loader
 @jwt.expired_token_loader
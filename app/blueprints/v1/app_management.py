@@ -33,7 +33,7 @@ def api_status_ckeck():
         error.append_parameter({"main-database": f"{e}"})
 
     try:
-        r = RedisClient().set_client()
+        r = RedisClient().get_client()
         r.ping()
     except RedisError as re:
         error.append_parameter({"redis-service": f"{re}"})
@@ -10,7 +10,6 @@ from app.models.main import (
 from sqlalchemy.exc import SQLAlchemyError
 from app.utils.exceptions import APIException
 # jwt
-from werkzeug.security import check_password_hash
 from flask_jwt_extended import create_access_token
 # utils
 from app.utils.helpers import (
@@ -18,9 +17,10 @@ from app.utils.helpers import (
 )
 from app.utils.email_service import send_verification_email
 from app.utils.route_decorators import (
-    json_required, verification_token_required, verified_token_required
+    json_required, verification_token_required, verified_token_required, rate_limited
 )
-from app.utils.redis_service import RedisClient
+from app.utils.redis_service import RedisClient, token_generations
+from app.utils.principal_cache import principal_cache, permission_epochs
 from app.utils.db_operations import handle_db_error
 
 auth_bp = Blueprint('auth_bp', __name__)
@@ -87,6 +87,8 @@ def signup(body, claims):  # from decorators functions
                 db.session.commit()
             except SQLAlchemyError as e:
                 handle_db_error(e)
+
+            principal_cache.invalidate_user(user.id)
             
             success, redis_error = RedisClient().add_jwt_to_blocklist(claims)  # bloquea verified-jwt
             if not success:
@@ -132,6 +134,7 @@ def signup(body, claims):  # from decorators functions
 
 @auth_bp.route('/login/user', methods=['POST'])  # normal login
 @json_required({"email": str, "password": str})
+@rate_limited("login")
 def login(body):  # body from json_required decorator
 
     email = StringHelpers(body["email"])
@@ -150,15 +153,21 @@ def login(body):  # body from json_required decorator
     if not user:
         raise APIException.from_error(EM({"email": f"email {email.value} not found"}).notFound)
 
-    if not check_password_hash(user._password_hash, pw.value):
+    if not user.check_password(pw.value):
         raise APIException.from_error(EM({"password": "password is invalid"}).wrong_password)
+    if db.session.is_modified(user):  # password hash updated to current parameters
+        try:
+            db.session.commit()
+        except SQLAlchemyError as e:
+            handle_db_error(e)
 
     if not user.is_enabled():
         raise APIException.from_error(EM({"email": "user hasn't completed registration proccess"}).unauthorized)
 
     additional_claims = {
         'user_access_token': True,
-        'user_id': user.id
+        'user_id': user.id,
+        **token_generations.get_claims(user.id)
     }
     payload = {
         'user': user.serialize_all(),
@@ -178,7 +187,9 @@ def login(body):  # body from json_required decorator
 
         additional_claims.update({
             'role_access_token': True,
-            'role_id': role.id
+            'role_id': role.id,
+            **permission_epochs.get_role_claims(role),
+            **token_generations.get_claims(user.id, role.company_id)
         })
         payload.update({
             'company': role.company.serialize_all(),
@@ -202,6 +213,7 @@ def login(body):  # body from json_required decorator
 
 @auth_bp.route('/email-validation', methods=['GET'])
 @json_required()
+@rate_limited("email-validation")
 def get_verification_code():
     """
     * PUBLIC ENDPOINT *
@@ -264,6 +276,8 @@ def check_verification_code(body, claims):
         except SQLAlchemyError as e:
             handle_db_error(e)
 
+        principal_cache.invalidate_user(user.id)
+
     success, redis_msg = RedisClient().add_jwt_to_blocklist(claims)  # invalida el uso del token una vez se haya validado del codigo
     if not success:
         raise APIException.from_error(EM(redis_msg).service_unavailable)
@@ -315,12 +329,17 @@ def password_change(body, claims):
     if not success:
         raise APIException.from_error(EM(redis_error).service_unavailable)
 
+    success, redis_error = token_generations.revoke_user(user.id)  # close all user's sessions
+    if not success:
+        raise APIException.from_error(EM(redis_error).service_unavailable)
+
     return JSONResponse(message="user's password has been updated").to_json()
 
 
 @auth_bp.route('/login/super-user', methods=['POST'])  # super-user login
 @json_required({"password": str})
 @verified_token_required()
+@rate_limited("login-super-user")
 def login_super_user(body, claims):
     """
     * VERIFIED TOKEN ONLY *
@@ -342,8 +361,13 @@ def login_super_user(body, claims):
     if not user.email_confirmed:
         raise APIException.from_error(EM({"email": "email not confirmed"}).unauthorized)
 
-    if not check_password_hash(user._password_hash, pw.value):
-        raise APIException()
+    if not user.check_password(pw.value):
+        raise APIException.from_error(EM({"password": "password is invalid"}).wrong_password)
+    if db.session.is_modified(user):  # password hash updated to current parameters
+        try:
+            db.session.commit()
+        except SQLAlchemyError as e:
+            handle_db_error(e)
 
     # *super-user_access-token
     access_token = create_access_token(
@@ -351,7 +375,8 @@ def login_super_user(body, claims):
         additional_claims={
             'user_access_token': True,
             'super_user': True,
-            'user_id': user.id
+            'user_id': user.id,
+            **token_generations.get_claims(user.id)
         }
     )
 
@@ -372,6 +397,7 @@ def login_super_user(body, claims):
 @auth_bp.route("/login/customer", methods=["POST"])
 @json_required({"code": int, "company_id": int})
 @verification_token_required()
+@rate_limited("login-customer")
 def login_customer(body, claims):
 
     company_id = body["company_id"]
@@ -397,7 +423,8 @@ def login_customer(body, claims):
             "user_access_token":True,
             "customer_access_token": True,
             "user_id":user.id,
-            "company_id": company.id
+            "company_id": company.id,
+            **token_generations.get_claims(user.id)
         }
     )
 
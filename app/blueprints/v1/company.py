@@ -1,9 +1,14 @@
 from crypt import methods
-from flask import Blueprint, request
+import csv
+import io
+import json
+from datetime import datetime
+from flask import Blueprint, request, current_app, Response, stream_with_context, send_file
 from app.models.global_models import RoleFunction
 
 #extensions
-from app.models.main import AttributeValue, Company, QRCode, User, Role, Provider, Category, Attribute
+from app.models.main import AttributeValue, Company, Correlative, QRCode, User, Role, Provider, Category, Attribute, \
+    CategoryEffectiveAttribute, CategoryClosure, Item
 from app.extensions import db
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy import func
@@ -11,11 +16,17 @@ from sqlalchemy import func
 #utils
 from app.utils.exceptions import APIException
 from app.utils.helpers import (
-    ErrorMessages as EM, IntegerHelpers, JSONResponse, QueryParams, StringHelpers, Validations
+    ErrorMessages as EM, IntegerHelpers, JSONResponse, QueryParams, QR_factory, StringHelpers, Validations
 )
 from app.utils.route_decorators import json_required, role_required
-from app.utils.db_operations import Unaccent, handle_db_error, update_row_content
-from app.utils.email_service import send_user_invitation
+from app.utils.db_operations import (
+    Unaccent, handle_db_error, update_row_content, paginate, get_keyset_filter, encode_keyset_cursor
+)
+from app.utils.email_service import send_user_invitation, send_user_invitations
+from app.utils.principal_cache import principal_cache, permission_epochs
+from app.utils.redis_service import token_generations
+from app.utils.label_service import label_renderer
+from app.utils.category_cache import category_tree_cache
 
 
 company_bp = Blueprint('company_bp', __name__)
@@ -42,11 +53,13 @@ def update_company(role, body):
         raise APIException.from_error(EM(invalids).bad_request)
 
     try:
-        Company.query.filter(Company.id == role.company.id).update(to_update)
+        Company.query.filter(Company.id == role.company_id).update(to_update)
         db.session.commit()
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    principal_cache.invalidate_company(role.company_id)
+
     return JSONResponse(message=f'Company updated').to_json()
 
 
@@ -65,7 +78,7 @@ def get_company_users(role):
     status = qp.get_first_value("status")
     page, limit = qp.get_pagination_params()
 
-    main_q = db.session.query(Role).join(Role.user).filter(Role.company_id == role.company.id)
+    main_q = db.session.query(Role).join(Role.user).filter(Role.company_id == role.company_id)
     
     if status:
         if status == "active":
@@ -104,7 +117,7 @@ def invite_user(role, body):
     if not new_role_function:
         raise APIException.from_error(EM({"role_id": f"id-{role_id} not found"}).notFound)
 
-    if role.role_function.level > new_role_function.level:
+    if role.level > new_role_function.level:
         raise APIException.from_error(EM({"role_level": "greater authorization level is required"}).unauthorized)
 
     user = User.get_user_by_email(email.email_normalized)
@@ -115,10 +128,8 @@ def invite_user(role, body):
             raise APIException.from_error(EM(mail_msg).service_unavailable)
 
         try:
-            new_user = User(
-                email=email.email_normalized,
-                password = StringHelpers.random_password()
-            )
+            new_user = User(email=email.email_normalized)
+            new_user.set_unusable_password()
             new_role = Role(
                 user = new_user,
                 company_id = role.company_id,
@@ -158,6 +169,116 @@ def invite_user(role, body):
     return JSONResponse('existing user invited').to_json()
 
 
+@company_bp.route('/users/bulk', methods=['POST'])
+@json_required()
+@role_required(level=1)
+def bulk_invite_users(role, body):
+    """
+    invite several users in a single request.
+    required in body, one of:
+        "users": [{"email": <str>, "role_code": <str>}, ...] -> role_id:<int> is also accepted
+        "csv": <str> -> lines with format: email,role_code (header line is optional)
+
+    returns a report with the result of each row.
+    """
+    rows = body.get("users", None)
+    if rows is None and isinstance(body.get("csv", None), str):
+        rows = []
+        for line in csv.reader(io.StringIO(body["csv"])):
+            if not line or (not rows and line[0].strip().lower() == "email"):
+                continue
+            rows.append({"email": line[0], "role_code": line[1].strip() if len(line) > 1 else None})
+
+    if not isinstance(rows, list) or not rows:
+        raise APIException.from_error(EM({"users": "a list of users or a csv string is required"}).bad_request)
+
+    max_rows = current_app.config.get("BULK_INVITE_MAX_ROWS", 500)
+    if len(rows) > max_rows:
+        raise APIException.from_error(EM({"users": f"{max_rows} rows max. per request"}).bad_request)
+
+    role_functions = db.session.query(RoleFunction).all()
+    functions_by_id = {rf.id: rf for rf in role_functions}
+    functions_by_code = {rf.code: rf for rf in role_functions}
+
+    report = []
+    to_invite = {}  # email -> (row, role_function)
+    for i, row in enumerate(rows):
+        result = {"row": i, "email": row.get("email", None) if isinstance(row, dict) else None}
+        report.append(result)
+        if not isinstance(row, dict):
+            result.update({"result": "error", "detail": "invalid row format"})
+            continue
+
+        email = StringHelpers(row.get("email", None))
+        valid, msg = email.is_valid_email()
+        if not valid:
+            result.update({"result": "error", "detail": msg})
+            continue
+
+        rf = functions_by_code.get(row.get("role_code", None), None) or functions_by_id.get(row.get("role_id", None), None)
+        if rf is None:
+            result.update({"result": "error", "detail": "role not found"})
+            continue
+
+        if role.level > rf.level:
+            result.update({"result": "error", "detail": "greater authorization level is required"})
+            continue
+
+        result["email"] = email.email_normalized
+        if email.email_normalized in to_invite:
+            result.update({"result": "error", "detail": "email is duplicated in request"})
+            continue
+
+        to_invite[email.email_normalized] = (result, rf)
+
+    existing_users = {u.email: u for u in db.session.query(User).filter(User._email.in_(list(to_invite.keys()))).all()} \
+        if to_invite else {}
+    listed = {r[0] for r in db.session.query(Role.user_id).\
+        filter(Role.company_id == role.company_id, Role.user_id.in_([u.id for u in existing_users.values()])).all()} \
+        if existing_users else set()
+
+    for email, (result, rf) in list(to_invite.items()):
+        user = existing_users.get(email, None)
+        if user is not None and user.id in listed:
+            result.update({"result": "error", "detail": "user is already listed in current company"})
+            del to_invite[email]
+
+    users_limit = role.plan_limits.get("users", None)
+    if users_limit is not None:
+        current_users = db.session.query(func.count(Role.id)).filter(Role.company_id == role.company_id).scalar()
+        available = max(users_limit - current_users, 0)
+        for email, (result, rf) in list(to_invite.items())[available:]:
+            result.update({"result": "error", "detail": f"plan limit of {users_limit} users reached"})
+            del to_invite[email]
+
+    invitations = []
+    try:
+        for email, (result, rf) in to_invite.items():
+            user = existing_users.get(email, None)
+            if user is None:
+                user = User(email=email)
+                user.set_unusable_password()
+                db.session.add(user)
+            db.session.add(Role(user=user, company_id=role.company_id, role_function=rf))
+            invitations.append((email, user.fname or None))
+            result.update({"result": "invited", "existing_user": email in existing_users})
+
+        db.session.commit()
+    except SQLAlchemyError as e:
+        handle_db_error(e)
+
+    sent, mail_msg = send_user_invitations(invitations, company_name=role.company.name)
+    if not sent:
+        for result, rf in to_invite.values():
+            result.update({"detail": "invitation email could not be sent"})
+
+    return JSONResponse(
+        message=f"{len(invitations)} of {len(rows)} users invited",
+        payload={"report": report},
+        status_code=201 if invitations else 200
+    ).to_json()
+
+
 @company_bp.route('/users/<int:user_id>', methods=['PUT'])
 @json_required({'role_id':int, 'is_active':bool})
 @role_required(level=1)
@@ -173,10 +294,10 @@ def update_user_company_relation(role, body, user_id):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
 
-    if role_id == role.user.id:
+    if role_id == role.user_id:
         raise APIException.from_error(EM({"role_id": "can't update self-user role"}).conflict)
 
-    target_role = Role.get_relation_user_company(user_id, role.company.id)
+    target_role = Role.get_relation_user_company(user_id, role.company_id)
     if not target_role:
         raise APIException.from_error(EM({"user_id": f"id-{user_id} not found"}).notFound)
     
@@ -184,16 +305,20 @@ def update_user_company_relation(role, body, user_id):
     if not new_rolefunction:
         raise APIException.from_error(EM({"role_id": "not found"}).notFound)
 
-    if role.role_function.level > new_rolefunction.level:
+    if role.level > new_rolefunction.level:
         raise APIException.from_error(EM({"role_level": "greater authorization level required"}).unauthorized)
         
     try:
+        permission_epochs.bump(role.company_id)  # nothing is saved if the role tokens can't be revoked
         target_role.role_function = new_rolefunction
         target_role._isActive = new_status
         db.session.commit()
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    principal_cache.invalidate_roles(target_role.id)
+    permission_epochs.bump(role.company_id, strict=False)  # tokens created before the commit
+
     return JSONResponse("user role updated").to_json()
 
 
@@ -206,14 +331,16 @@ def delete_user_company_relation(role, user_id):
     if not valid:
         raise APIException.from_error(EM({"user_id": msg}).bad_request)
 
-    if user_id == role.user.id:
+    if user_id == role.user_id:
         raise APIException.from_error(EM({"role_id": "can't delete self-user role"}).conflict)
 
-    target_role = Role.get_relation_user_company(user_id, role.company.id)
+    target_role = Role.get_relation_user_company(user_id, role.company_id)
     if not target_role:
         raise APIException.from_error(EM({"user_id": "not found"}).notFound)
 
+    target_role_id = target_role.id
     try:
+        permission_epochs.bump(role.company_id)  # nothing is saved if the role tokens can't be revoked
         db.session.delete(target_role)
         db.session.commit()
 
@@ -223,9 +350,26 @@ def delete_user_company_relation(role, user_id):
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    principal_cache.invalidate_roles(target_role_id)
+    permission_epochs.bump(role.company_id, strict=False)  # tokens created before the commit
+
     return JSONResponse("user-relation was deleted of company").to_json()
 
 
+@company_bp.route('/sessions', methods=['DELETE'])
+@json_required()
+@role_required(level=0)
+def revoke_company_sessions(role):
+    """
+    revoke the role-level access tokens of all the users of the company, including current token.
+    """
+    success, redis_error = token_generations.revoke_company(role.company_id)
+    if not success:
+        raise APIException.from_error(EM(redis_error).service_unavailable)
+
+    return JSONResponse("all role sessions of the company were revoked").to_json()
+
+
 @company_bp.route('/roles', methods=['GET'])
 @json_required()
 @role_required()#any user
@@ -251,8 +395,7 @@ def get_company_providers(role):
         if name_like:
             main_q = main_q.filter(Unaccent(func.lower(Provider.name)).like(f"%{name_like.unaccent.lower()}%"))
 
-        page, limit = qp.get_pagination_params()
-        providers = main_q.paginate(page, limit)
+        providers = paginate(main_q, qp, "providers", [Provider.id.asc()])
 
         return JSONResponse(
             message=qp.get_warings(),
@@ -285,7 +428,7 @@ def create_provider(role, body):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
 
-    to_add.update({'company_id': role.company.id}) #se agrega company
+    to_add.update({'company_id': role.company_id}) #se agrega company
 
     new_provider = Provider(**to_add)
     try:
@@ -363,12 +506,10 @@ def get_company_categories(role):
     category_id = qp.get_first_value("category_id", as_integer=True)
 
     if not category_id:
-        cat = role.company.categories.filter(Category.parent_id == None).order_by(Category.name.asc()).all() #root categories only
-        
         return JSONResponse(
             message=qp.get_warings(),
             payload={
-                "categories": list(map(lambda x: x.serialize_children(), cat))
+                "categories": category_tree_cache.get_tree(role.company_id)
             }
         ).to_json()
 
@@ -412,7 +553,7 @@ def create_or_update_category(role, body, category_id=None):
         raise APIException.from_error(EM(invalids).bad_request)
 
     main_q = db.session.query(Category).select_from(Company).join(Company.categories).\
-        filter(Company.id == role.company.id, Unaccent(func.lower(Category.name)) == new_name.unaccent.lower())
+        filter(Company.id == role.company_id, Unaccent(func.lower(Category.name)) == new_name.unaccent.lower())
 
     #POST method
     if request.method == "POST":
@@ -420,7 +561,7 @@ def create_or_update_category(role, body, category_id=None):
         if category_exists:
             raise APIException.from_error(EM({"name": f"category name [{new_name.value}] already exists"}).conflict)
 
-        newRows.update({'company_id': role.company.id, "parent_id": parent_id})
+        newRows.update({'company_id': role.company_id, "parent_id": parent_id})
         new_category = Category(**newRows)
 
         try:
@@ -429,6 +570,8 @@ def create_or_update_category(role, body, category_id=None):
         except SQLAlchemyError as e:
             handle_db_error(e)
 
+        category_tree_cache.bump(role.company_id)
+
         return JSONResponse(
             payload={"category": new_category.serialize()},
             status_code=201
@@ -444,11 +587,20 @@ def create_or_update_category(role, body, category_id=None):
         raise APIException.from_error(EM({"name": f"category name [{new_name.value}] already exists"}).conflict)
 
     try:
+        if "parent_id" in body and (parent_id or None) != target_cat.parent_id: #reparent, null moves the category to root
+            try:
+                target_cat.move_to(parent_id or None)
+            except ValueError as ve:
+                db.session.rollback()
+                raise APIException.from_error(EM({"parent_id": f"{ve}"}).conflict)
+
         db.session.query(Category).filter(Category.id == target_cat.id).update(newRows)
         db.session.commit()
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    category_tree_cache.bump(role.company_id)
+
     return JSONResponse(f'category-id: {category_id} updated').to_json()
 
 
@@ -466,17 +618,21 @@ def delete_category(role, cat_id):
         raise APIException.from_error(EM({"cat_id": f"id-{cat_id} not found"}).notFound)
 
     try:
-        db.session.delete(target_cat)
+        deleted = target_cat.delete_subtree()
         db.session.commit()
     
     except IntegrityError as ie:
+        db.session.rollback()
         raise APIException.from_error(EM({"cat_id": f"can't delete category_id: {cat_id}, {ie}"}).conflict)
 
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    category_tree_cache.bump(role.company_id)
+
     return JSONResponse(
-        message=f"category_id: {cat_id} has been deleted"
+        message=f"category_id: {cat_id} has been deleted",
+        payload={"deleted_categories": deleted}
     ).to_json()
 
 
@@ -500,6 +656,68 @@ def get_category_attributes(role, cat_id):
     ).to_json()
 
 
+@company_bp.route('/categories/<int:cat_id>/attribute-matrix', methods=['GET'])
+@json_required()
+@role_required()
+def get_category_attribute_matrix(role, cat_id):
+    """
+    items of the category and its descendants, with their value for each attribute of the category (own and inherited).
+    response is streamed as ndjson:
+        first line: {"category": {...}, "columns": [{"attribute_ID", "attribute_name"}, ...], "message": {warnings}}
+        one line per item: {"item_ID", "item_name", "item_sku", "values": [[value_id, value] | null, ...]} (same order of columns)
+        last line: {"pagination": {"limit", "has_next", "next_cursor"}}
+    query parameters:
+    ?limit:<int> - items per page, default:20
+    ?cursor:<str> - next_cursor of the previous page
+    """
+    valid, msg = IntegerHelpers.is_valid_id(cat_id)
+    if not valid:
+        raise APIException.from_error(EM({"cat_id": msg}).bad_request)
+
+    target_cat = role.company.get_category_by_id(cat_id)
+    if not target_cat:
+        raise APIException.from_error(EM({"cat_id": f"id-{cat_id} not found"}).notFound)
+
+    qp = QueryParams(request.args)
+    _, limit = qp.get_pagination_params()
+    limit = max(1, min(limit, current_app.config.get("CATEGORY_MATRIX_MAX_LIMIT", 1000)))
+    scope = f"category.matrix.{cat_id}"
+    sort_keys = [(Item.name, False), (Item.id, False)]
+    columns = target_cat.get_attributes()
+    statement = target_cat.get_attribute_matrix([c.id for c in columns], limit, get_keyset_filter(qp, scope, sort_keys))
+
+    def generate():
+        yield json.dumps({
+            "category": target_cat.serialize(),
+            "columns": [{"attribute_ID": c.id, "attribute_name": c.name} for c in columns],
+            "message": qp.get_warings() #ex: invalid cursor, first page returned
+        }) + "\n"
+
+        last, has_next = None, False
+        for i, (item_id, name, sku, values) in enumerate(
+            db.session.execute(statement.execution_options(stream_results=True))
+        ):
+            if i == limit:
+                has_next = True
+                break
+            values = values or {}
+            yield json.dumps({
+                "item_ID": item_id,
+                "item_name": name,
+                "item_sku": sku,
+                "values": [values.get(str(c.id), None) for c in columns]
+            }) + "\n"
+            last = (name, item_id)
+
+        yield json.dumps({"pagination": {
+            "limit": limit,
+            "has_next": has_next,
+            "next_cursor": encode_keyset_cursor(qp, scope, last) if has_next else None
+        }}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @company_bp.route('/categories/<int:category_id>/attributes', methods=['PUT'])
 @json_required({'attributes': list})
 @role_required(level=1)
@@ -516,7 +734,10 @@ def update_category_attributes(role, body, category_id):
 
     if not attributes: #empty list clear all attibutes
         try:
+            CategoryClosure.lock_tree(role.company_id) #a concurrent move would refresh the old subtree
             target_cat.attributes = []
+            db.session.flush()
+            CategoryEffectiveAttribute.refresh(target_cat.id)
             db.session.commit()
         except SQLAlchemyError as e:
             handle_db_error(e)
@@ -536,7 +757,10 @@ def update_category_attributes(role, body, category_id):
         raise APIException.from_error(EM({"attributes": "no attributes were found in the database"}).notFound)
 
     try:
+        CategoryClosure.lock_tree(role.company_id) #a concurrent move would refresh the old subtree
         target_cat.attributes = new_attributes
+        db.session.flush()
+        CategoryEffectiveAttribute.refresh(target_cat.id) #the category and its descendants
         db.session.commit()
     except SQLAlchemyError as e:
         handle_db_error(e)
@@ -558,15 +782,14 @@ def get_company_attributes(role):
     attribute_id = qp.get_first_value("attribute_id", as_integer=True)
 
     if not attribute_id:
-        page, limit = qp.get_pagination_params()
         name_like = StringHelpers(qp.get_first_value("name_like"))
 
-        main_q = role.company.attributes.order_by(Attribute.name.asc())
+        main_q = role.company.attributes
 
         if name_like:
             main_q = main_q.filter(Unaccent(func.lower(Attribute.name)).like(f"%{name_like.unaccent.lower()}%"))
 
-        attributes = main_q.paginate(page, limit)
+        attributes = paginate(main_q, qp, "attributes", [Attribute.name.asc(), Attribute.id.asc()])
 
         return JSONResponse(
             message=qp.get_warings(),
@@ -609,7 +832,7 @@ def create_attribute(role, body):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
     
-    to_add.update({'company_id': role.company.id})
+    to_add.update({'company_id': role.company_id})
     new_attribute = Attribute(**to_add)
 
     try:
@@ -788,7 +1011,7 @@ def update_attribute_value(role, body, value_id):
         raise APIException.from_error(EM(invalids).bad_request)
 
     base_q = db.session.query(AttributeValue).select_from(Company).join(Company.attributes).\
-        join(Attribute.attribute_values).filter(Company.id == role.company.id)
+        join(Attribute.attribute_values).filter(Company.id == role.company_id)
 
     value_exists = base_q.filter(Unaccent(func.lower(AttributeValue.value)) == attr_value.unaccent.lower()).first()
     if value_exists:
@@ -819,7 +1042,7 @@ def delete_attributeValue(role, value_id):
         raise APIException.from_error(EM({"value_id": msg}).bad_request)
 
     target_value = db.session.query(AttributeValue).select_from(Company).join(Company.attributes).join(Attribute.attribute_values).\
-        filter(Company.id == role.company.id, AttributeValue.id == value_id).first()
+        filter(Company.id == role.company_id, AttributeValue.id == value_id).first()
 
     if not target_value:
         raise APIException.from_error(EM({"value_id": f"id-{value_id} not found"}).notFound)
@@ -845,8 +1068,7 @@ def delete_attributeValue(role, value_id):
 def get_all_qrcodes(role):
 
     qp = QueryParams(request.args)
-    page, limit = qp.get_pagination_params()
-    q = db.session.query(QRCode).select_from(Company).join(Company.qr_codes)
+    q = db.session.query(QRCode).select_from(Company).join(Company.qr_codes).filter(Company.id == role.company_id)
     
     status = qp.get_first_value("status")
     if status:
@@ -859,7 +1081,7 @@ def get_all_qrcodes(role):
         if status == "free":
             q = q.filter(QRCode.container == None)
     
-    qr_codes = q.paginate(page, limit)
+    qr_codes = paginate(q, qp, "qrcodes", [QRCode.id.asc()])
 
     return JSONResponse(
         message=qp.get_warings(),
@@ -874,28 +1096,93 @@ def get_all_qrcodes(role):
 @json_required({"count": int})
 @role_required()
 def create_qrcode(role, body):
-
+    """
+    create <count> qrcodes in a single transaction.
+    response is streamed as ndjson, one qrcode per line, if the request includes
+    the header "Accept: application/x-ndjson" or ?format=ndjson in query params.
+    """
+    qp = QueryParams(request.args)
     count = body["count"]
     if count <= 0:
         raise APIException.from_error(EM({"count": f"count can't be less than 0"}).bad_request)
 
-    bulk_qrcode = []
-    while len(bulk_qrcode) < count:
-        new_qrcode = QRCode(company_id = role.company.id)
-        try:
-            db.session.add(new_qrcode)
-            db.session.commit()
-        except SQLAlchemyError as e:
-            handle_db_error(e)
+    max_count = current_app.config.get("QRCODE_BULK_MAX_COUNT", 10000)
+    if count > max_count:
+        raise APIException.from_error(EM({"count": f"{max_count} qrcodes max. per request"}).bad_request)
 
-        bulk_qrcode.append(new_qrcode)
+    company_id = role.company_id
+    chunk_size = current_app.config.get("QRCODE_INSERT_CHUNK_SIZE", 1000)
+    rows = []
+    try:
+        first = Correlative.reserve(company_id, QRCode.__tablename__, count)
+        ids = QRCode.reserve_ids(count)
+        now = datetime.utcnow()
+        texts = QR_factory.encode_many([f"{_id:02d}" for _id in ids])
+        rows = [(_id, first + i, now, True, text) for i, (_id, text) in enumerate(zip(ids, texts))]
+        for start in range(0, count, chunk_size):  # multi-row INSERT, same transaction
+            db.session.execute(QRCode.__table__.insert().values([
+                {"id": r[0], "company_id": company_id, "_correlative": r[1], "_date_created": r[2], "is_active": r[3], "_signed_text": r[4]}
+                for r in rows[start:start + chunk_size]
+            ]))
+        db.session.commit()
+    except SQLAlchemyError as e:
+        handle_db_error(e)
+
+    if request.accept_mimetypes.best == "application/x-ndjson" or qp.get_first_value("format") == "ndjson":
+        def generate():
+            for qrcode in QRCode.serialize_rows(rows, company_id):
+                yield json.dumps(qrcode) + "\n"
+
+        return Response(stream_with_context(generate()), status=201, mimetype="application/x-ndjson")
 
     return JSONResponse(
         message="ok",
-        payload={"qrcodes": list(map(lambda x:x.serialize(), bulk_qrcode))}
+        payload={"qrcodes": list(QRCode.serialize_rows(rows, company_id))}
     ).to_json()
 
 
+@company_bp.route("/qrcodes/labels", methods=["POST"])
+@json_required({"qrcode_ids": list})
+@role_required()
+def get_qrcode_labels(role, body):
+    """
+    printable sheets of qr labels, with the qrcode_key as caption.
+    required in body:
+        "qrcode_ids": [<int>, ...]
+    optional:
+        "format": "pdf" | "png" -> default pdf, all the sheets. png returns a single sheet
+        "page": <int> -> sheet number, png format only. default 1
+    """
+    qrcode_ids = body["qrcode_ids"]
+    fmt = body.get("format", "pdf")
+    page = body.get("page", 1)
+
+    invalids = {}
+    if not qrcode_ids or not all(isinstance(_id, int) for _id in qrcode_ids):
+        invalids.update({"qrcode_ids": "a list of integers is expected"})
+    if fmt not in label_renderer.FORMATS:
+        invalids.update({"format": f"valid formats are {list(label_renderer.FORMATS.keys())}"})
+    if not isinstance(page, int) or page < 1:
+        invalids.update({"page": "invalid page number"})
+    if invalids:
+        raise APIException.from_error(EM(invalids).bad_request)
+
+    max_codes = current_app.config.get("LABEL_MAX_CODES", 1000)
+    if len(qrcode_ids) > max_codes:
+        raise APIException.from_error(EM({"qrcode_ids": f"{max_codes} qrcodes max. per request"}).bad_request)
+
+    qrcodes = {qr.id: qr for qr in db.session.query(QRCode).\
+        filter(QRCode.company_id == role.company_id, QRCode.id.in_(qrcode_ids)).all()}
+    missing = [_id for _id in qrcode_ids if _id not in qrcodes]
+    if missing:
+        raise APIException.from_error(EM({"qrcode_ids": f"ids {missing} not found"}).notFound)
+
+    path = label_renderer.render(
+        [(qrcodes[_id].signed_text, qrcodes[_id].key) for _id in qrcode_ids], fmt=fmt, page=page
+    )
+    return send_file(path, mimetype=label_renderer.FORMATS[fmt], download_name=f"qrcodes.{fmt}")
+
+
 @company_bp.route("/qrcodes", methods=["DELETE"])
 @json_required()
 @role_required()
@@ -908,7 +1195,7 @@ def delete_qrcode(role):
 
     #query returns: [(1,), (2,), ... (n,)] list of tuples with matching ids
     target_qrcodes = db.session.query(QRCode.id).join(QRCode.company).\
-        filter(Company.id == role.company.id, QRCode.id.in_(qrcodeList), QRCode.container == None).all()
+        filter(Company.id == role.company_id, QRCode.id.in_(qrcodeList), QRCode.container == None).all()
 
     if not target_qrcodes:
         raise APIException.from_error(EM({"qrcode": f"passed ids: {qrcodeList} not found"}).notFound)
@@ -1,16 +1,16 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app
 
 #extensions
-from app.models.main import Acquisition, AttributeValue, Attribute, Item, Company, Provider
+from app.models.main import Acquisition, AttributeValue, Attribute, Inventory, Item, ItemStock, Company, Provider
 from app.extensions import db
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 #utils
 from app.utils.exceptions import APIException
 from app.utils.helpers import ErrorMessages as EM, JSONResponse, QueryParams, StringHelpers, IntegerHelpers, Validations
 from app.utils.route_decorators import json_required, role_required
-from app.utils.db_operations import handle_db_error, update_row_content, Unaccent
+from app.utils.db_operations import handle_db_error, update_row_content, Unaccent, paginate, keyset_paginate
 
 
 items_bp = Blueprint('items_bp', __name__)
@@ -25,18 +25,22 @@ def get_items(role):
     ?item_id:<int> - filter by item_id
     ?page:<int> - pagination page, default:1
     ?limit:<int> - pagination items limit, default:20
+    ?cursor:<str> - cursor pagination, next_cursor of the previous page (empty for the first page), instead of ?page
+    ?count:<str> - total_items strategy in page mode: exact, estimated, cached or none
     ?cat_id:<int> - filter by category_id
     ?name_like:<str> - filter by name, %like%
+    ?q:<str> - search in name, sku and description, typo tolerant. Results in relevance order,
+        paginated with ?cursor:<str> (next_cursor of the previous page) and ?limit:<int>
     ?attr_value:<int> - filter by attribute value. Accept several ids with the same key. example: 
         ?attr_value=1&attr_value=2&...attr_value=n
-        returns all coincidences
+        returns the items with any of the values of each attribute, for all the attributes requested.
+    ?include:<str> - comma separated, additional fields in each item: stock, cost. example: ?include=stock,cost
     """
     qp = QueryParams(request.args)
 
     item_id = qp.get_first_value('item_id', as_integer=True) #item_id or None
     if not item_id:
-        q = db.session.query(Item).join(Item.company).join(Company.attributes).outerjoin(Item.attribute_values).\
-            filter(Company.id == role.company.id)
+        q = db.session.query(Item).filter(Item.company_id == role.company_id)
 
         cat_id = qp.get_first_value('category_id', as_integer=True)
         if cat_id:
@@ -48,22 +52,37 @@ def get_items(role):
             if not filter_category:
                 raise APIException.from_error(EM({"category_id": f"id-{cat_id} not found"}).notFound)
 
-            q = q.filter(Item.category_id.in_(filter_category.get_all_nodes())) #get all children-nodes of category
+            q = q.filter(Item.category_id.in_(filter_category.get_subtree_query())) #category and all its descendants
         
         attr_values = qp.get_all_integers('attr_value') #expecting integers
         if attr_values:
-            q = q.filter(AttributeValue.id.in_(attr_values))
+            groups = Item.get_attribute_value_groups(role.company_id, attr_values)
+            not_found = set(attr_values).difference(v for ids in groups.values() for v in ids)
+            if not_found:
+                raise APIException.from_error(EM({"attr_value": f"ids {sorted(not_found)} not found"}).notFound)
+            q = q.filter(*Item.attribute_values_filter(groups))
 
         name_like = StringHelpers(qp.get_first_value('name_like'))
         if name_like:
-            q = q.filter(Unaccent(func.lower(Item.name)).like(f"%{name_like.unaccent.lower()}%"))
+            q = q.filter(Item._name_normalized.like(f"%{Item.normalize_search_text(name_like.value)}%"))
+
+        include = qp.get_include_options(("stock", "cost"))
+        search = Item.normalize_search_text(StringHelpers(qp.get_first_value('q')).value)
+        if search:
+            return search_items(qp, q, search, include)
+
+        q_items = paginate(q, qp, "items", [Item.name.asc(), Item.id.asc()])
+
+        items = [item.serialize() for item in q_items.items]
+        if include:  # one grouped query for the whole page
+            summaries = Item.get_stock_summaries([item.id for item in q_items.items])
+            for item, serialized in zip(q_items.items, items):
+                serialized.update(Item.serialize_stock(summaries.get(item.id, (0.0, 0.0)), include))
 
-        page, limit = qp.get_pagination_params()
-        q_items = q.order_by(Item.name.asc()).paginate(page, limit)
         return JSONResponse(
             message=qp.get_warings(),
             payload={
-                "items": list(map(lambda x: x.serialize(), q_items.items)),
+                "items": items,
                 **qp.get_pagination_form(q_items)
             }
         ).to_json()
@@ -86,6 +105,36 @@ def get_items(role):
     ).to_json()
     
 
+def search_items(qp:QueryParams, q, search:str, include:list):
+    """ranked search over the filtered query <q>, keyset paginated by (score, item_id)"""
+    score = Item.search_score(search)
+
+    # typo tolerance, for this transaction only
+    db.session.execute(select(func.set_config(
+        "pg_trgm.word_similarity_threshold", str(current_app.config.get("ITEM_SEARCH_THRESHOLD", 0.4)), True
+    )))
+    result = keyset_paginate(
+        q.filter(Item.search_filter(search)), qp, "items.search", [score.desc(), Item.id.asc()],
+        max_limit=current_app.config.get("ITEM_SEARCH_MAX_LIMIT", 100)
+    )
+
+    items = []
+    summaries = Item.get_stock_summaries([item.id for item in result.items]) if include else {}
+    for item, (item_score, _) in zip(result.items, result.keys):
+        serialized = {**item.serialize(), "item_score": float(item_score)}
+        if include:
+            serialized.update(Item.serialize_stock(summaries.get(item.id, (0.0, 0.0)), include))
+        items.append(serialized)
+
+    return JSONResponse(
+        message=qp.get_warings(),
+        payload={
+            "items": items,
+            **qp.get_pagination_form(result)
+        }
+    ).to_json()
+
+
 @items_bp.route('/<int:item_id>', methods=['PUT'])
 @json_required()
 @role_required(level=1)
@@ -106,10 +155,14 @@ def update_item(role, body, item_id): #parameters from decorators
     if 'name' in body:
         name = StringHelpers(body["name"])
         nameExists = db.session.query(Item.name).filter(Unaccent(func.lower(Item.name)) == name.unaccent.lower(),\
-            Company.id == role.company.id, Item.id != target_item.id).first()
+            Company.id == role.company_id, Item.id != target_item.id).first()
         if nameExists:
             raise APIException.from_error(EM({"name": f"name already exists"}).conflict)
 
+    search_fields = ("name", "sku", "description")
+    if any(f in newRows for f in search_fields):
+        newRows.update(Item.get_search_columns(*[newRows.get(f, getattr(target_item, f)) for f in search_fields]))
+
     #update information
     try:
         Item.query.filter(Item.id == item_id).update(newRows)
@@ -131,7 +184,7 @@ def create_item(role, body):
         raise APIException.from_error(EM(invalids).bad_request)
 
     newRows.update({
-        "company_id": role.company.id
+        "company_id": role.company_id
     })
 
     if "category_id" in body:
@@ -149,7 +202,7 @@ def create_item(role, body):
         })
     
     nameExists = db.session.query(Item).select_from(Company).join(Company.items).\
-        filter(Unaccent(func.lower(Item.name)) == newItemName.unaccent.lower(), Company.id == role.company.id).first()
+        filter(Unaccent(func.lower(Item.name)) == newItemName.unaccent.lower(), Company.id == role.company_id).first()
     if nameExists:
         raise APIException.from_error(EM({"name": f"name {newItemName.value} already exists"}).conflict)
 
@@ -206,7 +259,7 @@ def update_item_category(role, body, item_id):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
 
-    target_item = db.session.query(Item).filter(Item.company_id == role.company.id, Item.id == item_id).first()
+    target_item = db.session.query(Item).filter(Item.company_id == role.company_id, Item.id == item_id).first()
     if not target_item:
         raise APIException.from_error(EM({"item_id": f"item-{item_id} not found"}).notFound)
 
@@ -275,14 +328,20 @@ def update_item_attributeValue(role, body, item_id):
                 found duplicates values for the same attribute"
             }).bad_request)
 
-    categoryAttributesList = targetItem.category.get_attributes(return_ids=True)
-
-    newValuesInstances = db.session.query(AttributeValue).\
-        filter(Attribute.id.in_(categoryAttributesList), AttributeValue.id.in_(newValuesIDList)).all()
+    newValuesInstances = db.session.query(AttributeValue).filter(
+        AttributeValue.attribute_id.in_(targetItem.category.get_attribute_ids_query()),
+        AttributeValue.id.in_(newValuesIDList)
+    ).all()
 
     if not newValuesInstances:
         raise APIException.from_error(EM({"attributes": "no attributes were found in the database"}).notFound)
 
+    not_found = set(newValuesIDList).difference(v.id for v in newValuesInstances)
+    if not_found:
+        raise APIException.from_error(EM({
+            "values": f"values {sorted(not_found)} not found in the attributes of the item category"
+        }).notFound)
+
     try:
         targetItem.attribute_values = newValuesInstances
         db.session.commit()
@@ -306,14 +365,14 @@ def create_item_acq(role, item_id):
     if not valid:
         raise APIException.from_error(EM({"item_id": msg}).bad_request)
 
-    target_item = db.session.query(Item).filter(Item.company_id == role.company.id).\
+    target_item = db.session.query(Item).filter(Item.company_id == role.company_id).\
         filter(Item.id == item_id).first()
 
     if not target_item:
         raise APIException.from_error(EM({"item_id": f"ID-{item_id} not found"}).notFound)
 
     base_q = db.session.query(Acquisition).select_from(Company).join(Company.items).join(Item.acquisitions).\
-        filter(Company.id == role.company.id, Item.id == item_id)
+        filter(Company.id == role.company_id, Item.id == item_id)
     
     qp = QueryParams(request.args)
     acq_id = qp.get_first_value("acquisition_id", as_integer=True)
@@ -321,8 +380,7 @@ def create_item_acq(role, item_id):
 
         # add filters here
 
-        page, limit = qp.get_pagination_params()
-        all_acq = base_q.paginate(page, limit)
+        all_acq = paginate(base_q, qp, "item.acquisitions", [Acquisition.id.asc()])
 
         return JSONResponse(
             message=qp.get_warings(),
@@ -366,7 +424,7 @@ def create_acquisition(role, body, item_id):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
 
-    target_item = db.session.query(Item).filter(Item.company_id == role.company.id, Item.id == item_id).first()
+    target_item = db.session.query(Item).filter(Item.company_id == role.company_id, Item.id == item_id).first()
     if not target_item:
         raise APIException.from_error(EM({"item_id": f"ID-{item_id} not found"}).notFound)
 
@@ -382,7 +440,7 @@ def create_acquisition(role, body, item_id):
             raise APIException.from_error(EM({"provider_id": msg}).bad_request)
 
         target_provider = db.session.query(Provider.id).\
-            filter(Provider.id == provider_id, Provider.company_id == role.company.id).first()
+            filter(Provider.id == provider_id, Provider.company_id == role.company_id).first()
         
         if not target_provider:
             raise APIException.from_error(EM({"provider_id": f"ID-{provider_id} not found"}).notFound)
@@ -422,8 +480,8 @@ def update_or_delete_acq(role, acq_id, body=None):
     if invalids:
         raise APIException.from_error(EM(invalids))
 
-    target_acq = db.session.query(Acquisition.id).select_from(Company).join(Company.items).join(Item.acquisitions).\
-        filter(Company.id == role.company.id, Acquisition.id == acq_id).first()
+    target_acq = db.session.query(Acquisition).select_from(Company).join(Company.items).join(Item.acquisitions).\
+        filter(Company.id == role.company_id, Acquisition.id == acq_id).with_for_update(of=Acquisition).first()
     
     if not target_acq:
         raise APIException.from_error(EM({"acquisition_id": f"ID-{acq_id} not found"}).notFound)
@@ -446,6 +504,18 @@ def update_or_delete_acq(role, acq_id, body=None):
     
     #if request.metod == "PUT"
     try:
+        if "item_qtty" in newRows or "item_cost" in newRows:  # update the stock of available inventories
+            units = db.session.query(func.count(Inventory.id)).\
+                filter(Inventory.acquisition_id == acq_id, Inventory.order_id == None).scalar()
+            if units:
+                old_qtty, old_cost = target_acq.item_qtty or 0.0, target_acq.item_cost or 0.0
+                new_qtty, new_cost = newRows.get("item_qtty", old_qtty), newRows.get("item_cost", old_cost)
+                ItemStock.apply(
+                    role.company_id, target_acq.item_id, target_acq.storage_id,
+                    quantity=units * (new_qtty - old_qtty),
+                    total_cost=units * (new_qtty * new_cost - old_qtty * old_cost)
+                )
+
         db.session.query(Acquisition).filter(Acquisition.id == acq_id).update(newRows)
         db.session.commit()
     
@@ -26,7 +26,7 @@ def get_order_requests(role):
     or_id = qp.get_first_value("id", as_integer=True)
 
     q = db.session.query(OrderRequest).select_from(Company).join(Company.order_requests).\
-        filter(Company.id == role.company.id)
+        filter(Company.id == role.company_id)
 
     if not or_id:
 
@@ -79,13 +79,13 @@ def get_orders_in_orq(role, orq_id):
         raise APIException.from_error(EM({"order_request_id": msg}).bad_request)
 
     target_orq_instance = db.sesison.query(OrderRequest.id).select_from(Company).\
-        join(Company.order_requests).filter(Company.id == role.company.id, OrderRequest.id == orq_id).first()
+        join(Company.order_requests).filter(Company.id == role.company_id, OrderRequest.id == orq_id).first()
 
     if not target_orq_instance:
         raise APIException.from_error(EM({"order_request_id": f"ID-{orq_id} not found"}).notFound)
 
     q = db.session.query(Order).select_from(Company).join(Company.order_requests).join(OrderRequest.orders).\
-        filter(Company.id == role.company.id, OrderRequest.id == orq_id)
+        filter(Company.id == role.company_id, OrderRequest.id == orq_id)
     
     ord_id = qp.get_first_value("id", as_integer=True)
     if not ord_id:
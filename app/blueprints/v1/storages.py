@@ -1,7 +1,7 @@
 from flask import Blueprint, request
 
 #extensions
-from app.models.main import Acquisition, Company, Container, Inventory, QRCode, Storage
+from app.models.main import Acquisition, Company, Container, Inventory, ItemStock, QRCode, Storage
 from app.extensions import db
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy import func
@@ -10,7 +10,7 @@ from sqlalchemy import func
 from app.utils.helpers import JSONResponse, ErrorMessages as EM, QueryParams, StringHelpers, IntegerHelpers, Validations
 from app.utils.route_decorators import json_required, role_required
 from app.utils.db_operations import (
-    ContainerValidations, update_row_content, handle_db_error, Unaccent
+    ContainerValidations, update_row_content, handle_db_error, Unaccent, paginate
 )
 from app.utils.exceptions import APIException
 
@@ -26,14 +26,15 @@ def get_storages(role):
     query parameters:
     ?page:<int> - pagination page, default=1
     ?limit:<int> - pagination limit, default=20
+    ?cursor:<str> - cursor pagination, next_cursor of the previous page (empty for the first page), instead of ?page
+    ?count:<str> - total_items strategy in page mode: exact, estimated, cached or none
     ?storage_id:<int> - id of required storage
     """
     qp = QueryParams(request.args)
     storage_id = qp.get_first_value("storage_id", as_integer=True)
 
     if not storage_id:
-        page, limit = qp.get_pagination_params()
-        storageInstancesList = role.company.storages.order_by(Storage.name.asc()).paginate(page, limit) #return all storages,
+        storageInstancesList = paginate(role.company.storages, qp, "storages", [Storage.name.asc(), Storage.id.asc()])
         return JSONResponse(
             message=qp.get_warings(),
             payload={
@@ -71,12 +72,12 @@ def create_storage(role, body):
 
     newName = StringHelpers(body["name"])
     nameExists = db.session.query(Storage).select_from(Company).join(Company.storages).\
-        filter(Unaccent(func.lower(Storage.name)) == newName.unaccent.lower(), Company.id == role.company.id).first()
+        filter(Unaccent(func.lower(Storage.name)) == newName.unaccent.lower(), Company.id == role.company_id).first()
 
     if nameExists:
         raise APIException.from_error(EM({"name": f"<name:{newName.value}> already exists"}).conflict)
 
-    newRows["company_id"] = role.company.id # add current user company_id to dict
+    newRows["company_id"] = role.company_id # add current user company_id to dict
     new_item = Storage(**newRows)
 
     try:
@@ -111,7 +112,7 @@ def update_storage(role, body, storage_id):
 
     sameName = db.session.query(Storage).select_from(Company).join(Company.storages).\
         filter(Unaccent(func.lower(Storage.name)) == newName.unaccent.lower(), \
-            Company.id == role.company.id, Storage.id != targetStorage.id).first()
+            Company.id == role.company_id, Storage.id != targetStorage.id).first()
 
     if sameName:
         raise APIException.from_error(EM({"name": f"storage_name: {newName.value} already exists"}).conflict)
@@ -210,8 +211,7 @@ def get_storage_containers(role, storage_id):
             }
         ).to_json()
     
-    page, limit = qp.get_pagination_params()
-    containers = targetStorage.containers.paginate(page, limit)
+    containers = paginate(targetStorage.containers, qp, "storage.containers", [Container.id.asc()])
 
     return JSONResponse(
         message=qp.get_warings(),
@@ -234,14 +234,14 @@ def create_container(role, body, storage_id):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
 
-    targetStorage = db.session.query(Storage.id).filter(Storage.company_id == role.company.id).\
+    targetStorage = db.session.query(Storage.id).filter(Storage.company_id == role.company_id).\
         filter(Storage.id == storage_id).first()
 
     if not targetStorage:
         raise APIException.from_error(EM({"storage_id": f"id-{storage_id} not found"}).notFound)
 
     newRows.update({'storage_id': storage_id})
-    newQRCode = QRCode(company_id = role.company.id)
+    newQRCode = QRCode(company_id = role.company_id)
     newContainer = Container(**newRows, qr_code=newQRCode)
 
     try:
@@ -273,7 +273,7 @@ def update_container(role, body, container_id):
         raise APIException.from_error(EM(invalids).bad_request)
 
     targetContainer = db.session.query(Container).select_from(Company).join(Company.storages).\
-        join(Storage.containers).filter(Company.id == role.company.id, Container.id == container_id).first()
+        join(Storage.containers).filter(Company.id == role.company_id, Container.id == container_id).first()
 
     if not targetContainer:
         raise APIException.from_error(EM({"container_id": f"id-{container_id} not found"}))
@@ -299,7 +299,7 @@ def delete_container(role):
         raise APIException.from_error(EM({"container_id": qp.get_warings()}).bad_request)
 
     targetContainer = db.session.query(Container.id).select_from(Company).join(Company.storages).\
-        join(Storage.containers).filter(Company.id == role.company.id, Container.id == target_container_id).first()
+        join(Storage.containers).filter(Company.id == role.company_id, Container.id == target_container_id).first()
 
     if not targetContainer:
         raise APIException.from_error(EM({"container_id": f"id-{target_container_id} not found"}).notFound)
@@ -336,7 +336,7 @@ def assign_qrcode(role, body, container_id):
         raise APIException.from_error(EM({"qr_code": "invalid qrcode in request"}).notAcceptable)
 
     qrCodeInstance = db.session.query(QRCode).join(QRCode.company).\
-        filter(QRCode.id == qrCodeID, Company.id == role.company.id).first()
+        filter(QRCode.id == qrCodeID, Company.id == role.company_id).first()
         
     if not qrCodeInstance or not qrCodeInstance.is_active:
         raise APIException.from_error(EM({"qr_code": f"qr_code_id not found"}).notFound)
@@ -345,7 +345,7 @@ def assign_qrcode(role, body, container_id):
         raise APIException.from_error(EM({"qr_code": "qrcode is already in use.."}).conflict)
 
     targetContainer = db.session.query(Container).join(Container.storage).join(Storage.company).\
-        filter(Company.id == role.company.id, Container.id == container_id).first()
+        filter(Company.id == role.company_id, Container.id == container_id).first()
 
     if not targetContainer:
         raise APIException.from_error(EM({"container_id": f"id-{container_id} not found"}).notFound)
@@ -372,13 +372,13 @@ def get_storage_acquisitions(role, storage_id):
         raise APIException.from_error(EM({"storage_id": msg}).bad_request)
 
     target_storage = db.session.query(Storage).\
-        filter(Storage.company_id == role.company.id, Storage.id == storage_id).first()
+        filter(Storage.company_id == role.company_id, Storage.id == storage_id).first()
 
     if not target_storage:
         raise APIException.from_error(EM({"storage_id": f"ID-{storage_id} not found"}).notFound)
 
     base_q = db.session.query(Acquisition).select_from(Company).join(Company.storages).join(Storage.acquisitions).\
-        filter(Company.id == role.company.id, Storage.id == storage_id)
+        filter(Company.id == role.company_id, Storage.id == storage_id)
 
     qp = QueryParams(request.args)
     acq_id = qp.get_first_value("acquisition_id", as_integer=True)
@@ -386,8 +386,7 @@ def get_storage_acquisitions(role, storage_id):
 
         # add filters here
         
-        page, limit = qp.get_pagination_params()
-        result = base_q.paginate(page, limit)
+        result = paginate(base_q, qp, "storage.acquisitions", [Acquisition.id.asc()])
 
         return JSONResponse(
             message=qp.get_warings(),
@@ -425,13 +424,13 @@ def get_acq_inventories(role, acq_id):
         raise APIException.from_error(EM({"acquisition_id": msg}).bad_request)
 
     target_acq = db.session.query(Acquisition).select_from(Company).join(Company.storages).join(Storage.acquisitions).\
-        filter(Acquisition.id == acq_id, Company.id == role.company.id).first()
+        filter(Acquisition.id == acq_id, Company.id == role.company_id).first()
 
     if not target_acq:
         raise APIException.from_error(EM({"acquisition_id": f"ID-{acq_id} not found"}).notFound)
 
     base_q = db.session.query(Inventory).select_from(Company).join(Company.storages).join(Storage.acquisitions).\
-        join(Acquisition.inventories).filter(Company.id == role.company.id, Acquisition.id == acq_id)
+        join(Acquisition.inventories).filter(Company.id == role.company_id, Acquisition.id == acq_id)
 
     qp = QueryParams(request.args)
     inventory_id = qp.get_first_value("inventory_id", as_integer=True)
@@ -439,8 +438,7 @@ def get_acq_inventories(role, acq_id):
 
         #add filters herer
 
-        page, limit = qp.get_pagination_params()
-        result = base_q.paginate(page, limit)
+        result = paginate(base_q, qp, "acquisition.inventories", [Inventory.id.asc()])
 
         return JSONResponse(
             message=qp.get_warings(),
@@ -484,13 +482,14 @@ def create_inventory(role, body, acq_id):
     if invalids:
         raise APIException.from_error(EM(invalids).bad_request)
     
-    target_acquisition = db.session.query(Acquisition.id).select_from(Company).join(Company.storages).\
-        join(Storage.acquisitions).filter(Company.id == role.company.id, Acquisition.id == acq_id).first()
+    target_acquisition = db.session.query(Acquisition).select_from(Company).join(Company.storages).\
+        join(Storage.acquisitions).filter(Company.id == role.company_id, Acquisition.id == acq_id).\
+            with_for_update(read=True, of=Acquisition).first()  # cost and quantity can't change until commit
 
     if not target_acquisition:
         raise APIException.from_error(EM({"acquisition_id": f"ID-{acq_id} not found"}).notFound)
 
-    container = ContainerValidations(role.company.id, container_id)
+    container = ContainerValidations(role.company_id, container_id)
     if not container.is_found:
         raise APIException.from_error(EM({"container_id": container.not_found_message}).notFound)
 
@@ -506,6 +505,7 @@ def create_inventory(role, body, acq_id):
     newInventory = Inventory(**newRows)
     try:
         db.session.add(newInventory)
+        ItemStock.apply_inventory(target_acquisition, role.company_id)
         db.session.commit()
     except SQLAlchemyError as e:
         handle_db_error(e)
@@ -525,7 +525,7 @@ def create_inventory(role, body, acq_id):
 def update_or_delete_inventory(role, inventory_id, body=None):
 
     invalids = Validations.validate_inputs({
-        "inventory_id": inventory_id
+        "inventory_id": IntegerHelpers.is_valid_id(inventory_id)
     })
     if body:
         newRows, invalid_body = update_row_content(Inventory, body)
@@ -536,13 +536,17 @@ def update_or_delete_inventory(role, inventory_id, body=None):
 
     target_inventory = db.session.query(Inventory).select_from(Company).join(Company.storages).\
         join(Storage.containers).join(Container.inventories).\
-            filter(Company.id == role.company.id, Inventory.id == inventory_id).first()
+            filter(Company.id == role.company_id, Inventory.id == inventory_id).first()
 
     if not target_inventory:
         raise APIException.from_error(EM({"inventory_id": f"ID-{inventory_id} not found"}).notFound)
 
     if request.method == "DELETE":
         try:
+            if target_inventory.order_id is None:
+                target_acquisition = db.session.query(Acquisition).filter(Acquisition.id == target_inventory.acquisition_id).\
+                    with_for_update(read=True, of=Acquisition).populate_existing().first()  # cost and quantity can't change until commit
+                ItemStock.apply_inventory(target_acquisition, role.company_id, sign=-1)
             db.session.delete(target_inventory)
             db.session.commit()
         except IntegrityError as ie:
@@ -555,7 +559,7 @@ def update_or_delete_inventory(role, inventory_id, body=None):
 
     #if request.method=="PUT"
     if "container_id" in body:
-        container = ContainerValidations(role.company.id, body["container_id"])
+        container = ContainerValidations(role.company_id, body["container_id"])
         if not container.is_found:
             raise APIException.from_error(EM({"container_id": container.not_found_message}).notFound)
 
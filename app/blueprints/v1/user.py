@@ -15,7 +15,8 @@ from app.utils.exceptions import APIException
 from app.utils.helpers import ErrorMessages as EM, JSONResponse, StringHelpers, IntegerHelpers
 from app.utils.route_decorators import json_required, user_required
 from app.utils.db_operations import handle_db_error, update_row_content, Unaccent
-from app.utils.redis_service import RedisClient
+from app.utils.redis_service import RedisClient, token_generations
+from app.utils.principal_cache import principal_cache, permission_epochs
 
 
 user_bp = Blueprint('user_bp', __name__)
@@ -49,6 +50,8 @@ def update_user_profile(user, body):
 
     except SQLAlchemyError as e:
         handle_db_error(e)
+
+    principal_cache.invalidate_user(user.id)
     
     resp = JSONResponse(message="user's profile has been updated")
     return resp.to_json()
@@ -101,7 +104,7 @@ def create_company(user, body):
 
         new_role = Role(
             company = new_company,
-            user = user,
+            user_id = user.id,
             role_function = role_function,
             inv_accepted = True
         )
@@ -142,6 +145,8 @@ def accept_company_invitation(user, company_id):
     except SQLAlchemyError as e:
         handle_db_error(e)
 
+    principal_cache.invalidate_roles(target_role.id)
+
     return JSONResponse(
         message="invitation accepted",
     ).to_json()
@@ -178,7 +183,9 @@ def activate_company_role(user, company_id=None):
             'user_access_token': True,
             'role_access_token': True,
             'user_id': user.id,
-            'role_id': new_role.id
+            'role_id': new_role.id,
+            **permission_epochs.get_role_claims(new_role),
+            **token_generations.get_claims(user.id, new_role.company_id)
         }
     )
     payload = {
@@ -210,4 +217,19 @@ def logout(user):
     if not success:
         raise APIException.from_error(EM(redis_error).service_unavailable)
         
-    return JSONResponse(f"user <{user.email}> logged-out of current session").to_json()
\ No newline at end of file
+    return JSONResponse(f"user <{user.email}> logged-out of current session").to_json()
+
+
+@user_bp.route('/logout/all', methods=['DELETE']) #logout user from all devices
+@json_required()
+@user_required()
+def logout_all_sessions(user):
+    """
+    ! PRIVATE ENDPOINT !
+    revoca todos los tokens del usuario en todos sus dispositivos, incluyendo el token actual.
+    """
+    success, redis_error = token_generations.revoke_user(user.id)
+    if not success:
+        raise APIException.from_error(EM(redis_error).service_unavailable)
+
+    return JSONResponse(f"user <{user.email}> logged-out of all sessions").to_json()
\ No newline at end of file
@@ -0,0 +1,222 @@
+import json
+import logging
+import random
+import socket
+import os
+import threading
+import time
+import click
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import current_app
+from flask.cli import AppGroup
+from app.extensions import db
+from app.models.main import CategoryClosure, CategoryEffectiveAttribute, Item, ItemStock, QRCode
+from app.utils.helpers import QR_factory
+from sqlalchemy import bindparam
+from app.utils.email_service import EmailOutbox, EmailWorker
+from app.utils.label_service import label_renderer
+
+logger = logging.getLogger(__name__)
+
+email_cli = AppGroup("email", help="outbound email commands")
+stock_cli = AppGroup("stock", help="stock ledger commands")
+qrcode_cli = AppGroup("qrcodes", help="qrcode commands")
+items_cli = AppGroup("items", help="item commands")
+categories_cli = AppGroup("categories", help="category tree commands")
+labels_cli = AppGroup("labels", help="qr label sheet commands")
+
+
+@email_cli.command("worker")
+@click.option("--name", default=None, help="worker name, default: <hostname>-<pid>")
+@click.option("--batch-size", type=int, default=None)
+@click.option("--concurrency", type=int, default=None)
+def email_worker(name, batch_size, concurrency):
+    """drain the email outbox"""
+    config = current_app.config
+    worker = EmailWorker(
+        outbox=EmailOutbox.from_config(config),
+        name=name or f"{socket.gethostname()}-{os.getpid()}",
+        batch_size=batch_size or config.get("MAIL_WORKER_BATCH_SIZE", 20),
+        concurrency=concurrency or config.get("MAIL_WORKER_CONCURRENCY", 8),
+        timeout=config.get("MAIL_SEND_TIMEOUT", 10),
+        heartbeat_ttl=config.get("MAIL_WORKER_HEARTBEAT_TTL", 60)
+    )
+    click.echo(f"{worker} running, press CTRL+C to quit")
+    worker.run()
+
+
+@email_cli.command("stats")
+def email_stats():
+    """print the number of messages in the outbox"""
+    click.echo(json.dumps(EmailOutbox.from_config(current_app.config).stats()))
+
+
+@email_cli.command("stub-server")
+@click.option("--host", default="localhost")
+@click.option("--port", type=int, default=8025)
+@click.option("--latency", type=float, default=0.5, help="seconds per request")
+@click.option("--error-rate", type=float, default=0.0, help="fraction of requests answered with http-500")
+def email_stub_server(host, port, latency, error_rate):
+    """
+    local stand-in for the smtp api, to measure the email delivery offline.
+    point SMTP_API_URL to http://<host>:<port>/v3/smtp/email
+    """
+    stats = {"received": 0, "failed": 0, "started": time.time()}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            failed = random.random() < error_rate
+            with lock:
+                stats["received"] += 1
+                stats["failed"] += failed
+
+            body = json.dumps({"message": "stub error"} if failed else {"messageId": f"<{time.time()}@stub>"}).encode()
+            self.send_response(500 if failed else 201)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    def report():
+        while True:
+            time.sleep(5)
+            with lock:
+                elapsed = time.time() - stats["started"]
+                click.echo(
+                    f"received: {stats['received']} - failed: {stats['failed']} - "
+                    f"{stats['received'] / elapsed:.1f} req/s"
+                )
+
+    threading.Thread(target=report, daemon=True).start()
+    server = ThreadingHTTPServer((host, port), Handler)
+    click.echo(f"smtp api stub listening on http://{host}:{port}, latency: {latency}s, error-rate: {error_rate}")
+    server.serve_forever()
+
+
+@stock_cli.command("rebuild")
+@click.option("--company-id", type=int, default=None, help="rebuild only the ledger of a company")
+def stock_rebuild(company_id):
+    """recompute the stock ledger from the inventory table"""
+    q = db.session.query(ItemStock)
+    if company_id is not None:
+        q = q.filter(ItemStock.company_id == company_id)
+
+    q.delete(synchronize_session=False)
+    rows = ItemStock.get_ledger_query(company_id).all()
+    db.session.bulk_insert_mappings(ItemStock, [
+        {"item_id": r[0], "storage_id": r[1], "company_id": r[2], "quantity": r[3] or 0.0, "total_cost": r[4] or 0.0, "units": r[5]}
+        for r in rows
+    ])
+    db.session.commit()
+    click.echo(f"stock ledger rebuilt, {len(rows)} rows")
+
+
+@stock_cli.command("verify")
+@click.option("--company-id", type=int, default=None, help="verify only the ledger of a company")
+@click.option("--tolerance", type=float, default=0.01)
+def stock_verify(company_id, tolerance):
+    """compare the stock ledger with the inventory table, exit code 1 if there are differences"""
+    expected = {(r[0], r[1]): (r[3] or 0.0, r[4] or 0.0, r[5]) for r in ItemStock.get_ledger_query(company_id).all()}
+    q = db.session.query(ItemStock.item_id, ItemStock.storage_id, ItemStock.quantity, ItemStock.total_cost, ItemStock.units)
+    if company_id is not None:
+        q = q.filter(ItemStock.company_id == company_id)
+    current = {(r[0], r[1]): (r[2], r[3], r[4]) for r in q.all()}
+
+    errors = 0
+    for key in expected.keys() | current.keys():
+        exp, cur = expected.get(key, (0.0, 0.0, 0)), current.get(key, (0.0, 0.0, 0))
+        if abs(exp[0] - cur[0]) > tolerance or abs(exp[1] - cur[1]) > tolerance or exp[2] != cur[2]:
+            errors += 1
+            click.echo(f"item-{key[0]} storage-{key[1]}: expected {exp}, found {cur}")
+
+    click.echo(f"{len(expected)} ledger rows verified, {errors} differences")
+    if errors:
+        raise SystemExit(1)
+
+
+@qrcode_cli.command("sign")
+@click.option("--all", "resign_all", is_flag=True, help="sign again all the codes, after a QR_SECRET_KEY rotation")
+@click.option("--batch-size", type=int, default=1000)
+def qrcode_sign(resign_all, batch_size):
+    """store the signed text of the qrcodes without it"""
+    table = QRCode.__table__
+    update = table.update().where(table.c.id == bindparam("_id")).values(_signed_text=bindparam("_text"))
+    last_id, total = 0, 0
+    while True:
+        q = db.session.query(QRCode.id).filter(QRCode.id > last_id)
+        if not resign_all:
+            q = q.filter(QRCode._signed_text == None)
+        ids = [r[0] for r in q.order_by(QRCode.id).limit(batch_size).all()]
+        if not ids:
+            break
+
+        texts = QR_factory.encode_many([f"{_id:02d}" for _id in ids])
+        db.session.execute(update, [{"_id": _id, "_text": text} for _id, text in zip(ids, texts)])
+        db.session.commit()
+        last_id, total = ids[-1], total + len(ids)
+        click.echo(f"{total} qrcodes signed")
+
+    click.echo(f"done, {total} qrcodes signed")
+
+
+@items_cli.command("reindex")
+@click.option("--batch-size", type=int, default=1000)
+def items_reindex(batch_size):
+    """fill the normalized search columns of all the items"""
+    table = Item.__table__
+    update = table.update().where(table.c.id == bindparam("_id")).\
+        values(_name_normalized=bindparam("_name"), _search_normalized=bindparam("_search"))
+    last_id, total = 0, 0
+    while True:
+        rows = db.session.query(Item.id, Item.name, Item.sku, Item.description).filter(Item.id > last_id).\
+            order_by(Item.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        columns = [(r.id, Item.get_search_columns(r.name, r.sku, r.description)) for r in rows]
+        db.session.execute(update, [
+            {"_id": _id, "_name": c["_name_normalized"], "_search": c["_search_normalized"]} for _id, c in columns
+        ])
+        db.session.commit()
+        last_id, total = rows[-1].id, total + len(rows)
+        click.echo(f"{total} items indexed")
+
+    click.echo(f"done, {total} items indexed")
+
+
+@categories_cli.command("rebuild-closure")
+@click.option("--company-id", type=int, default=None)
+def categories_rebuild_closure(company_id):
+    """recompute the category closure table from category.parent_id"""
+    total = CategoryClosure.rebuild(company_id)
+    db.session.commit()
+    click.echo(f"done, {total} closure rows")
+
+
+@categories_cli.command("rebuild-attributes")
+@click.option("--company-id", type=int, default=None)
+def categories_rebuild_attributes(company_id):
+    """recompute the effective (inherited) attributes of the categories, run after rebuild-closure"""
+    total = CategoryEffectiveAttribute.rebuild(company_id)
+    db.session.commit()
+    click.echo(f"done, {total} category attributes")
+
+
+@labels_cli.command("prune")
+@click.option("--max-mb", type=int, default=None, help="default: LABEL_CACHE_MAX_MB")
+@click.option("--max-age", type=int, default=None, help="seconds since the last use, default: LABEL_CACHE_MAX_AGE")
+def labels_prune(max_mb, max_age):
+    """remove the old and least recently used files of the label sheet cache"""
+    if max_mb is not None:
+        label_renderer.cache_max_bytes = max_mb * 1024 * 1024
+    if max_age is not None:
+        label_renderer.cache_max_age = max_age
+
+    removed, removed_bytes = label_renderer.prune()
+    click.echo(f"done, {removed} files ({removed_bytes / 1024 / 1024:.1f} MB) removed from {label_renderer.cache_dir}")
@@ -12,6 +12,87 @@ class Config(object):
     JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(days=1)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEVELOPMENT_DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # redis
+    REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+    REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+    REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 20))
+    REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 2)) #seconds waiting for a free connection
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2))
+    REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get('REDIS_SOCKET_CONNECT_TIMEOUT', 2))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    REDIS_SOCKET_KEEPALIVE = True
+    REDIS_INVALIDATION_CHANNEL = os.environ.get('REDIS_INVALIDATION_CHANNEL', 'storage-manager:invalidations')
+    # jwt blocklist cache
+    JWT_BLOCKLIST_CACHE_ENABLED = os.environ.get('JWT_BLOCKLIST_CACHE_ENABLED', 'true').lower() == 'true'
+    JWT_BLOCKLIST_CACHE_SIZE = int(os.environ.get('JWT_BLOCKLIST_CACHE_SIZE', 10000))
+    JWT_BLOCKLIST_CACHE_TTL = int(os.environ.get('JWT_BLOCKLIST_CACHE_TTL', 300)) #seconds
+    # token generations - revoke all the sessions of an user or a company with a single INCR
+    JWT_TOKEN_GENERATIONS_ENABLED = os.environ.get('JWT_TOKEN_GENERATIONS_ENABLED', 'true').lower() == 'true'
+    # role/user snapshots used by route decorators
+    PRINCIPAL_CACHE_ENABLED = os.environ.get('PRINCIPAL_CACHE_ENABLED', 'true').lower() == 'true'
+    PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 2048))
+    PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', 60)) #seconds, per worker
+    PRINCIPAL_CACHE_REDIS = os.environ.get('PRINCIPAL_CACHE_REDIS', 'true').lower() == 'true'
+    PRINCIPAL_CACHE_REDIS_TTL = int(os.environ.get('PRINCIPAL_CACHE_REDIS_TTL', 600)) #seconds
+    # role-level tokens validated with a per-company permission epoch, without reading the role.
+    # role changes need redis to bump the epoch (503 and nothing saved if it is down). the epoch is bumped again
+    # after the commit, if that fails the tokens issued meanwhile keep the old permissions until JWT_ACCESS_TOKEN_EXPIRES
+    JWT_STATELESS_ROLES = os.environ.get('JWT_STATELESS_ROLES', 'false').lower() == 'true'
+    # serialized category tree per company, in redis, invalidated by version
+    CATEGORY_TREE_CACHE_ENABLED = os.environ.get('CATEGORY_TREE_CACHE_ENABLED', 'true').lower() == 'true'
+    CATEGORY_TREE_CACHE_TTL = int(os.environ.get('CATEGORY_TREE_CACHE_TTL', 300)) #seconds, max. staleness if redis misses a bump
+    CATEGORY_MATRIX_MAX_LIMIT = 1000 #items per page of the category attribute matrix
+    # outbound emails
+    MAIL_OUTBOX_ENABLED = os.environ.get('MAIL_OUTBOX_ENABLED', 'true').lower() == 'true'
+    MAIL_OUTBOX_PREFIX = 'email:outbox'
+    MAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('MAIL_OUTBOX_MAX_ATTEMPTS', 6))
+    MAIL_OUTBOX_BACKOFF_BASE = float(os.environ.get('MAIL_OUTBOX_BACKOFF_BASE', 2)) #seconds, base ** attempts
+    MAIL_OUTBOX_BACKOFF_MAX = float(os.environ.get('MAIL_OUTBOX_BACKOFF_MAX', 600))
+    MAIL_WORKER_BATCH_SIZE = int(os.environ.get('MAIL_WORKER_BATCH_SIZE', 20))
+    MAIL_WORKER_CONCURRENCY = int(os.environ.get('MAIL_WORKER_CONCURRENCY', 8))
+    MAIL_WORKER_HEARTBEAT_TTL = int(os.environ.get('MAIL_WORKER_HEARTBEAT_TTL', 60)) #seconds, must exceed the time of a batch
+    MAIL_SEND_TIMEOUT = float(os.environ.get('MAIL_SEND_TIMEOUT', 10))
+    BULK_INVITE_MAX_ROWS = int(os.environ.get('BULK_INVITE_MAX_ROWS', 500))
+    QRCODE_BULK_MAX_COUNT = int(os.environ.get('QRCODE_BULK_MAX_COUNT', 10000))
+    QRCODE_INSERT_CHUNK_SIZE = 1000 #rows per INSERT statement
+    # printable qr label sheets
+    LABEL_MAX_CODES = int(os.environ.get('LABEL_MAX_CODES', 1000))
+    LABEL_SHEET_COLUMNS = int(os.environ.get('LABEL_SHEET_COLUMNS', 4))
+    LABEL_SHEET_ROWS = int(os.environ.get('LABEL_SHEET_ROWS', 6))
+    LABEL_SHEET_DPI = int(os.environ.get('LABEL_SHEET_DPI', 150))
+    LABEL_RENDER_WORKERS = int(os.environ.get('LABEL_RENDER_WORKERS', 0)) #0 -> cpu count
+    LABEL_CACHE_DIR = os.environ.get('LABEL_CACHE_DIR', None) #default: <tmp>/storage-manager-labels
+    LABEL_CACHE_MAX_MB = int(os.environ.get('LABEL_CACHE_MAX_MB', 512)) #least recently used files are removed first, 0 -> no limit
+    LABEL_CACHE_MAX_AGE = int(os.environ.get('LABEL_CACHE_MAX_AGE', 604800)) #seconds since the last use, 0 -> no limit
+    # item search, pg_trgm word similarity threshold (lower is more typo tolerant)
+    ITEM_SEARCH_THRESHOLD = float(os.environ.get('ITEM_SEARCH_THRESHOLD', 0.4))
+    ITEM_SEARCH_MAX_LIMIT = 100
+    # total count of paginated listings, per endpoint: exact, estimated, cached or none. ?count= overrides it
+    PAGINATION_COUNT_STRATEGIES = {
+        "items": "cached",
+        "qrcodes": "cached",
+        "storage.acquisitions": "cached",
+        "item.acquisitions": "cached",
+        "acquisition.inventories": "cached"
+    } #other endpoints: exact
+    PAGINATION_COUNT_CACHE_TTL = int(os.environ.get('PAGINATION_COUNT_CACHE_TTL', 30)) #seconds
+    # rate limits per endpoint: rule -> [(key, max. requests, window in seconds), ...]; keys: ip, email, company
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    RATELIMIT_TRUST_PROXY = os.environ.get('RATELIMIT_TRUST_PROXY', 'false').lower() == 'true' #use X-Forwarded-For, only behind a proxy
+    RATELIMIT_PROXY_COUNT = int(os.environ.get('RATELIMIT_PROXY_COUNT', 1)) #number of proxies that append to X-Forwarded-For
+    RATELIMIT_RULES = {
+        "login": [("ip", 60, 60), ("email", 10, 300), ("company", 600, 60)],
+        "login-super-user": [("ip", 10, 60), ("email", 5, 300)],
+        "login-customer": [("ip", 30, 60), ("email", 10, 300)],
+        "email-validation": [("ip", 20, 600), ("email", 3, 600)]
+    }
+    # password hashing - stored hashes with other method or salt length are updated on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) #0 -> cpu count
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 0)) #0 -> workers * 4
+    PASSWORD_HASH_WAIT = float(os.environ.get('PASSWORD_HASH_WAIT', 5)) #seconds
 
 
 class ProductionConfig(Config):
@@ -2,15 +2,16 @@ from email.policy import default
 from app.extensions import db
 from datetime import datetime, timedelta
 from typing import Union
+import secrets
 
-from werkzeug.security import generate_password_hash
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, insert as pg_insert
 from sqlalchemy.orm import backref
-from sqlalchemy import func
+from sqlalchemy import event, func, literal, true, select, cast, exists, and_, Numeric
 from sqlalchemy.types import Interval
 
 #utils
-from app.utils.helpers import DefaultContent, DateTimeHelpers, QR_factory
+from app.utils.password_service import password_hasher
+from app.utils.helpers import DefaultContent, DateTimeHelpers, QR_factory, StringHelpers
 
 #models
 from .global_models import *
@@ -19,6 +20,7 @@ from .assoc_models import attribute_category, attributeValue_item
 
 class User(db.Model):
     __tablename__ = 'user'
+    UNUSABLE_PASSWORD_PREFIX = "!" #never produced by the password hasher
     id = db.Column(db.Integer, primary_key=True)
     _email = db.Column(db.String(256), unique=True, nullable=False)
     _password_hash = db.Column(db.String(256), nullable=False)
@@ -80,7 +82,33 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self._password_hash = generate_password_hash(password, method='sha256')
+        self._password_hash = password_hasher.hash(password)
+
+    def set_unusable_password(self) -> None:
+        """
+        store a placeholder that never matches any password, without hashing. Used for invited
+        users, which set their password later through the password reset.
+        """
+        self._password_hash = f"{self.UNUSABLE_PASSWORD_PREFIX}{secrets.token_hex(20)}"
+
+    def has_usable_password(self) -> bool:
+        return not self._password_hash.startswith(self.UNUSABLE_PASSWORD_PREFIX)
+
+    def check_password(self, password:str) -> bool:
+        """
+        check password against the stored hash. If the hash was generated with outdated
+        parameters, it is replaced in the session with a new one, commit is up to the caller.
+        """
+        if not self.has_usable_password():
+            return False
+
+        if not password_hasher.verify(self._password_hash, password):
+            return False
+
+        if password_hasher.needs_rehash(self._password_hash):
+            self.password = password
+
+        return True
 
     @property
     def email(self):
@@ -285,17 +313,58 @@ class Storage(db.Model):
         return self.containers.filter(Container.id == container_id).first()
 
 
+class Correlative(db.Model):
+    """
+    Per-company counters of the correlative numbers of items, order requests and qr codes.
+    Values are allocated with an atomic UPDATE .. RETURNING in the current transaction, the
+    row stays locked until commit, so concurrent inserts never get the same value.
+    """
+    __tablename__ = 'correlative'
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id', ondelete='CASCADE'), primary_key=True)
+    entity = db.Column(db.String(32), primary_key=True) #__tablename__ of the model
+    last_value = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'Correlative(company_id={self.company_id}, entity={self.entity}, last_value={self.last_value})'
+
+    @staticmethod
+    def get_model(entity:str):
+        models = {m.__tablename__: m for m in (Item, OrderRequest, QRCode)}
+        if entity not in models:
+            raise ValueError(f"invalid correlative entity: {entity}")
+        return models[entity]
+
+    @classmethod
+    def reserve(cls, company_id:int, entity:str, count:int=1) -> int:
+        """
+        reserve a block of <count> correlatives for an entity of a company, in one statement.
+        returns the first value of the block, the block is [first, first + count - 1].
+        the counter is created from the current max(_correlative) of the entity on first use.
+        """
+        t = cls.__table__
+        allocate = t.update().where(t.c.company_id == company_id, t.c.entity == entity).\
+            values(last_value=t.c.last_value + count).returning(t.c.last_value)
+
+        last_value = db.session.execute(allocate).scalar()
+        if last_value is None:
+            model = cls.get_model(entity)
+            seed = pg_insert(t).from_select(
+                ["company_id", "entity", "last_value"],
+                select(literal(company_id), literal(entity), func.coalesce(func.max(model._correlative), 0)).\
+                    where(model.company_id == company_id)
+            ).on_conflict_do_nothing()
+            db.session.execute(seed)
+            last_value = db.session.execute(allocate).scalar()
+
+        return last_value - count + 1
+
+
 class Item(db.Model):
     def __init__(self, *args, **kwargs) -> None:
-        """update kwargs arguments with the last qr_code counter in the company"""
+        """update kwargs arguments with the next correlative of the company"""
         company_id = kwargs.get("company_id", None)
-        if company_id and isinstance(company_id, int):
-            last_item = db.session.query(Item).filter(Item.company_id == company_id).\
-                order_by(Item._correlative.desc()).first()
-            if not last_item:
-                kwargs.update({"_correlative": 1})
-            else:
-                kwargs.update({"_correlative": last_item._correlative+1})
+        if company_id and isinstance(company_id, int) and "_correlative" not in kwargs:
+            kwargs.update({"_correlative": Correlative.reserve(company_id, Item.__tablename__)})
 
         super().__init__(*args, **kwargs)
 
@@ -311,7 +380,9 @@ class Item(db.Model):
     description = db.Column(db.Text)
     sale_unit = db.Column(db.String(128))
     sale_price = db.Column(db.Float(precision=2), default=0.0)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), index=True)
+    _name_normalized = db.Column(db.String(128), default='') #unaccented and lowercased name
+    _search_normalized = db.Column(db.Text, default='') #unaccented and lowercased name, sku and description
     #relations
     company = db.relationship('Company', back_populates='items', lazy='joined')
     category = db.relationship('Category', back_populates='items', lazy='joined')
@@ -319,9 +390,79 @@ class Item(db.Model):
     attribute_values = db.relationship('AttributeValue', secondary=attributeValue_item, back_populates='items', lazy='dynamic')
     orders = db.relationship('Order', back_populates='item', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index("ix_item_company_name", "company_id", "name"), #company listing, ordered by name
+        db.Index("ix_item_name_trgm", "_name_normalized", postgresql_using="gin", postgresql_ops={"_name_normalized": "gin_trgm_ops"}),
+        db.Index("ix_item_search_trgm", "_search_normalized", postgresql_using="gin", postgresql_ops={"_search_normalized": "gin_trgm_ops"}),
+    )
+
     def __repr__(self) -> str:
         return f'Item(id={self.id})'
 
+    @staticmethod
+    def normalize_search_text(*values) -> str:
+        """unaccented and lowercased text, same normalization for the stored columns and the search terms"""
+        return " ".join(StringHelpers(v).unaccent.lower() for v in values if v)
+
+    @classmethod
+    def get_search_columns(cls, name:str, sku:str, description:str) -> dict:
+        """values of the normalized search columns, for bulk updates that skip the mapper events"""
+        return {
+            "_name_normalized": cls.normalize_search_text(name),
+            "_search_normalized": cls.normalize_search_text(name, sku, description)
+        }
+
+    def update_search_columns(self) -> None:
+        for column, value in self.get_search_columns(self.name, self.sku, self.description).items():
+            setattr(self, column, value)
+
+    @classmethod
+    def search_filter(cls, term:str):
+        """
+        items matching a normalized <term> in name, sku or description, typo tolerant.
+        terms of 3 or more characters use the word similarity operator, shorter terms a %like% match,
+        both are served by the trigram index.
+        """
+        if len(term) < 3:
+            return cls._search_normalized.like(f"%{term}%")
+        return cls._search_normalized.op("%>")(term)
+
+    @staticmethod
+    def get_attribute_value_groups(company_id:int, value_ids:list) -> dict:
+        """{attribute_id: [value_id, ...]} of the requested values that belong to the company"""
+        rows = db.session.query(AttributeValue.attribute_id, AttributeValue.id).\
+            join(Attribute, Attribute.id == AttributeValue.attribute_id).\
+            filter(Attribute.company_id == company_id, AttributeValue.id.in_(value_ids)).all()
+
+        groups = {}
+        for attr_id, value_id in rows:
+            groups.setdefault(attr_id, []).append(value_id)
+        return groups
+
+    @classmethod
+    def attribute_values_filter(cls, groups:dict) -> list:
+        """
+        faceted filter, one EXISTS per attribute over attributeValue_item:
+        items with any of the values of an attribute (OR), for every attribute in <groups> (AND).
+        """
+        return [
+            exists().where(attributeValue_item.c.item_id == cls.id, attributeValue_item.c.attribute_value_id.in_(ids))
+            for ids in groups.values()
+        ]
+
+    @classmethod
+    def search_score(cls, term:str):
+        """
+        relevance of an item for a normalized <term>: best word similarity in the name, or in name+sku+description
+        with a lower weight, plus the similarity of the whole name to break ties in favor of shorter names.
+        rounded to numeric, so the score can be used as a keyset cursor
+        """
+        score = func.greatest(
+            func.word_similarity(term, cls._name_normalized),
+            func.word_similarity(term, cls._search_normalized) * 0.8
+        ) + func.similarity(cls._name_normalized, term) * 0.2
+        return func.round(cast(score, Numeric), 6, type_=Numeric)
+
     @property
     def images(self):
         return self._images
@@ -336,15 +477,50 @@ class Item(db.Model):
         }
 
     def serialize_attributes(self) -> dict:
-        if self.category:
-            attributes = self.category.get_attributes()
-            return {
-                'item_attributes': list(map(lambda x:x.serialize_with_item(self.id), attributes))
-            }
-        else:
+        """attributes of the item category and its ancestors, with the value of the item. one statement"""
+        if not self.category_id:
             return {}
 
+        item_value = db.session.query(AttributeValue.id.label("value_id"), AttributeValue.value.label("value")).\
+            join(attributeValue_item, attributeValue_item.c.attribute_value_id == AttributeValue.id).\
+            filter(AttributeValue.attribute_id == Attribute.id, attributeValue_item.c.item_id == self.id).\
+            limit(1).subquery().lateral("item_value")
+
+        rows = db.session.query(Attribute.id, Attribute.name, item_value.c.value_id, item_value.c.value).\
+            select_from(Attribute).join(CategoryEffectiveAttribute, CategoryEffectiveAttribute.attribute_id == Attribute.id).\
+            filter(CategoryEffectiveAttribute.category_id == self.category_id).outerjoin(item_value, true()).\
+            order_by(Attribute.id).all()
+
+        attributes = []
+        for attr_id, attr_name, value_id, value in rows:
+            attr = {'attribute_ID': attr_id, 'attribute_name': attr_name}
+            if value_id is not None:
+                attr.update({'attributeValue_ID': value_id, 'attributeValue_name': value})
+            attributes.append(attr)
+
+        return {'item_attributes': attributes}
+
+    def get_counters(self) -> dict:
+        """acquisitions and orders count, stock and total cost of the item, in one statement"""
+        def scalar(q):
+            return q.filter_by(item_id=self.id).scalar_subquery()
+
+        row = db.session.query(
+            scalar(db.session.query(func.count(Acquisition.id))),
+            scalar(db.session.query(func.count(Order.id))),
+            scalar(db.session.query(func.sum(ItemStock.quantity))),
+            scalar(db.session.query(func.sum(ItemStock.total_cost)))
+        ).first()
+
+        self._stock_summary = (row[2] or 0.0, row[3] or 0.0)
+        return {
+            'item_acquisitions_count': row[0] or 0,
+            'item_orders_count': row[1] or 0,
+            **self.serialize_stock(self._stock_summary, ["stock", "cost"])
+        }
+
     def serialize_all(self) -> dict:
+        """item detail, three statements at most, regardless of the depth of the category or the number of attributes"""
         resp =  {
             **self.serialize(),
             **self.serialize_attributes(),
@@ -353,10 +529,7 @@ class Item(db.Model):
             'item_unit': self.sale_unit,
             'item_price': {"amount": self.sale_price, "symbol": "USD"},
             "item_company": self.company.serialize(),
-            'item_acquisitions_count': self.acquisitions.count(),
-            'item_orders_count': self.orders.count(),
-            'item_stock': self.stock,
-            'item_avrg_cost': self.avrg_cost
+            **self.get_counters()
         }
         if self.category:
             resp.update({
@@ -368,29 +541,43 @@ class Item(db.Model):
 
         return resp
 
+    def get_stock_summary(self) -> tuple:
+        """(quantity, total_cost) of the available inventories of the item, read from the stock ledger"""
+        if getattr(self, "_stock_summary", None) is None:
+            self._stock_summary = self.get_stock_summaries([self.id]).get(self.id, (0.0, 0.0))
+
+        return self._stock_summary
+
+    @staticmethod
+    def get_stock_summaries(item_ids:list) -> dict:
+        """{item_id: (quantity, total_cost)} for a list of items, in one grouped query. Items without stock are not included"""
+        if not item_ids:
+            return {}
+
+        rows = db.session.query(ItemStock.item_id, func.sum(ItemStock.quantity), func.sum(ItemStock.total_cost)).\
+            filter(ItemStock.item_id.in_(item_ids)).group_by(ItemStock.item_id).all()
+
+        return {r[0]: (r[1] or 0.0, r[2] or 0.0) for r in rows}
+
+    @staticmethod
+    def serialize_stock(summary:tuple, include:list) -> dict:
+        """stock fields of a (quantity, total_cost) summary. include: ["stock", "cost"]"""
+        quantity, total_cost = summary
+        resp = {}
+        if "stock" in include:
+            resp["item_stock"] = quantity
+        if "cost" in include:
+            resp["item_avrg_cost"] = round(total_cost/quantity, 2) if quantity else 0.0
+        return resp
+
     @property
     def stock(self):
         """get the current stock of the instance"""
-        stock = db.session.query(func.sum(Acquisition.item_qtty)).select_from(Item).join(Item.acquisitions).\
-            join(Acquisition.inventories).outerjoin(Inventory.order).\
-                filter(Item.id == self.id, Inventory.order == None).scalar() or 0.0
-
-        return stock
+        return self.get_stock_summary()[0]
 
     @property
     def avrg_cost(self):
-        acq = db.session.query(Acquisition.item_qtty, Acquisition.item_cost).select_from(Item).\
-            join(Item.acquisitions).join(Acquisition.inventories).\
-                filter(Item.id == self.id, Inventory.order == None).all()
-        if not acq:
-            return 0.0
-
-        numerator = sum([(x * y) for x,y in acq])
-        denominator = sum([x[0] for x in acq])
-        if not denominator:
-            return 0.0
-        
-        return round(numerator/denominator, 2)
+        return self.serialize_stock(self.get_stock_summary(), ["cost"])["item_avrg_cost"]
 
 
 class Category(db.Model):
@@ -430,44 +617,238 @@ class Category(db.Model):
             "category_childs": list(map(lambda x: x.serialize_children(), self.children))
         }
 
+    @staticmethod
+    def get_tree(company_id:int) -> list:
+        """serialized tree of all the categories of a company (serialize_children format), loaded in one query"""
+        rows = db.session.query(Category.id, Category.name, Category.parent_id).\
+            filter(Category.company_id == company_id).order_by(Category.name.asc(), Category.id.asc()).all()
+
+        nodes = {_id: {"category_ID": _id, "category_name": name, "category_childs": []} for _id, name, _ in rows}
+        roots = []
+        for _id, _, parent_id in rows:
+            (nodes[parent_id]["category_childs"] if parent_id in nodes else roots).append(nodes[_id])
+
+        return roots
+
     def serialize_path(self) -> list:
         """serialize the path to root of current category"""
-        path = []
-        p = self.parent
-        while p is not None:
-            path.insert(0, {"category_name": p.name, "category_id": p.id})
-            p = p.parent
-        
-        return path
+        path = Category.get_path_subquery(self.id)
+        rows = db.session.query(path.c.id, path.c.name).filter(path.c.depth > 0).order_by(path.c.depth.desc()).all()
+
+        return [{"category_name": name, "category_id": _id} for _id, name in rows]
+
+    @staticmethod
+    def get_path_subquery(category_id:int):
+        """a category and all its ancestors: (id, name, parent_id, depth), read from the closure table. depth=0 is the category"""
+        return db.session.query(Category.id, Category.name, Category.parent_id, CategoryClosure.depth.label("depth")).\
+            join(CategoryClosure, CategoryClosure.ancestor_id == Category.id).\
+            filter(CategoryClosure.descendant_id == category_id).subquery("category_path")
+
+    def get_subtree_query(self):
+        """ids of the category and all its descendants, to use in a filter: Item.category_id.in_(...)"""
+        return db.session.query(CategoryClosure.descendant_id).filter(CategoryClosure.ancestor_id == self.id)
 
     def get_all_nodes(self) -> list:
         """get all children nodes of current category. Includes all descendants"""
-        ids = [self.id]
-        for i in self.children:
-            ids.append(i.id)
-            if i.children:
-                ids.extend(i.get_all_nodes())
-        
-        return list(set(ids))
+        return [row[0] for row in self.get_subtree_query().all()]
+
+    def is_ancestor_of(self, category_id:int) -> bool:
+        """True if <category_id> is the category or one of its descendants"""
+        return db.session.query(
+            self.get_subtree_query().filter(CategoryClosure.descendant_id == category_id).exists()
+        ).scalar()
+
+    def move_to(self, parent_id:Union[int, None]) -> None:
+        """
+        reparent the category, and update the closure rows of the whole subtree in two statements.
+        raises ValueError if the new parent is the category or one of its descendants
+        """
+        CategoryClosure.lock_tree(self.company_id)
+        if parent_id is not None and self.is_ancestor_of(parent_id):
+            raise ValueError(f"category-{parent_id} is the category or one of its descendants")
+
+        t = CategoryClosure.__table__
+        subtree = select(t.c.descendant_id).where(t.c.ancestor_id == self.id)
+        db.session.execute(t.delete().where(
+            t.c.descendant_id.in_(subtree), t.c.ancestor_id.not_in(subtree)
+        ))
+        if parent_id is not None:
+            above, below = t.alias("above"), t.alias("below")
+            db.session.execute(t.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1).\
+                    where(above.c.descendant_id == parent_id, below.c.ancestor_id == self.id)
+            ))
+        self.parent_id = parent_id
+        CategoryEffectiveAttribute.refresh(self.id)
+
+    def get_attribute_ids_query(self):
+        """ids of the attributes of the category and its ancestors, to use in a filter: Attribute.id.in_(...)"""
+        return db.session.query(CategoryEffectiveAttribute.attribute_id).\
+            filter(CategoryEffectiveAttribute.category_id == self.id)
+
+    def delete_subtree(self) -> int:
+        """
+        delete the category and all its descendants with set-based statements, in the current transaction:
+        items of the subtree are detached, attribute links removed and the categories deleted in one statement.
+        closure and effective attribute rows are deleted by the database (ON DELETE CASCADE).
+        returns the number of deleted categories
+        """
+        CategoryClosure.lock_tree(self.company_id)
+        ids = self.get_all_nodes()
+        db.session.execute(Item.__table__.update().where(Item.category_id.in_(ids)).values(category_id=None))
+        db.session.execute(attribute_category.delete().where(attribute_category.c.category_id.in_(ids)))
+        result = db.session.execute(Category.__table__.delete().where(Category.id.in_(ids)))
+        return result.rowcount
 
     def get_attributes(self, return_ids:bool=False) -> list:
         """function that returns a list with all the attributes of the current category and its ascendat categories"""
-        ids = [self.id]
-        p = self.parent
-        while p is not None:
-            ids.append(p.id)
-            if p.parent is not None:
-                ids.append(p.parent_id)
-            p = p.parent
-        
         if return_ids:
-            return ids
+            return [row[0] for row in self.get_attribute_ids_query().all()]
+
+        return db.session.query(Attribute).join(CategoryEffectiveAttribute, CategoryEffectiveAttribute.attribute_id == Attribute.id).\
+            filter(CategoryEffectiveAttribute.category_id == self.id).order_by(Attribute.id).all()
 
-        return db.session.query(Attribute).join(Attribute.categories).filter(Category.id.in_(ids)).all()
+    def get_attribute_matrix(self, attribute_ids:list, limit:int, after=None):
+        """
+        one aggregate statement with a page of the items of the category and its descendants, ordered by (name, id),
+        and the values of the item for the attributes in <attribute_ids>:
+        (item_id, item_name, item_sku, {attribute_id: [value_id, value], ...} or None)
+        <after> is a keyset filter on (Item.name, Item.id). the page includes limit+1 rows, to know if there is a next page
+        """
+        page = db.session.query(Item.id, Item.name, Item.sku).\
+            filter(Item.company_id == self.company_id, Item.category_id.in_(self.get_subtree_query()))
+        if after is not None:
+            page = page.filter(after)
+        page = page.order_by(Item.name.asc(), Item.id.asc()).limit(limit + 1).subquery("page")
+
+        values = func.json_object_agg(
+            AttributeValue.attribute_id, func.json_build_array(AttributeValue.id, AttributeValue.value)
+        ).filter(AttributeValue.id != None)
+
+        return select(page.c.id, page.c.name, page.c.sku, values).select_from(
+            page.outerjoin(attributeValue_item, attributeValue_item.c.item_id == page.c.id).outerjoin(
+                AttributeValue, and_(
+                    AttributeValue.id == attributeValue_item.c.attribute_value_id,
+                    AttributeValue.attribute_id.in_(attribute_ids)
+                )
+            )
+        ).group_by(page.c.id, page.c.name, page.c.sku).order_by(page.c.name.asc(), page.c.id.asc())
 
     def get_attribute_by_id(self, att_id:int):
         """get attribute instance related to current category"""
-        self.attributes.filter(Attribute.id == att_id).first()
+        return self.attributes.filter(Attribute.id == att_id).first()
+
+
+class CategoryClosure(db.Model):
+    """
+    Closure table of the category tree, one row per (ancestor, descendant) pair, including (category, category)
+    with depth 0. Rows are created with the category (after_insert event), moved by Category.move_to and
+    deleted by the database with the categories. flask categories rebuild-closure recompute it from parent_id.
+    """
+    __tablename__ = 'category_closure'
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('category.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('category.id', ondelete='CASCADE'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_category_closure_descendant", "descendant_id", "depth"), #ancestors of a category
+    )
+
+    LOCK_NAMESPACE = 7301 #pg_advisory_xact_lock(namespace, company_id)
+
+    def __repr__(self) -> str:
+        return f'CategoryClosure(ancestor_id={self.ancestor_id}, descendant_id={self.descendant_id}, depth={self.depth})'
+
+    @classmethod
+    def lock_tree(cls, company_id:int, connection=None) -> None:
+        """serialize the writes to the category tree of a company until the end of the transaction"""
+        (connection or db.session).execute(select(func.pg_advisory_xact_lock(cls.LOCK_NAMESPACE, company_id)))
+
+    @classmethod
+    def insert_node(cls, connection, company_id:int, category_id:int, parent_id:Union[int, None]) -> None:
+        """closure rows of a new leaf: the ancestors of the parent, and the category itself"""
+        t = cls.__table__
+        cls.lock_tree(company_id, connection)
+        rows = select(literal(category_id), literal(category_id), literal(0))
+        if parent_id is not None:
+            rows = rows.union_all(
+                select(t.c.ancestor_id, literal(category_id), t.c.depth + 1).where(t.c.descendant_id == parent_id)
+            )
+        connection.execute(t.insert().from_select(["ancestor_id", "descendant_id", "depth"], rows))
+
+    @classmethod
+    def rebuild(cls, company_id:int = None) -> int:
+        """recompute the closure rows from category.parent_id, returns the number of rows"""
+        t, c = cls.__table__, Category.__table__
+        delete = t.delete()
+        roots = select(c.c.id.label("ancestor_id"), c.c.id.label("descendant_id"), literal(0).label("depth"))
+        if company_id is not None:
+            cls.lock_tree(company_id)
+            ids = select(c.c.id).where(c.c.company_id == company_id)
+            delete = delete.where(t.c.descendant_id.in_(ids))
+            roots = roots.where(c.c.company_id == company_id)
+
+        tree = roots.cte("tree", recursive=True)
+        child = c.alias("child")
+        tree = tree.union_all(
+            select(tree.c.ancestor_id, child.c.id, tree.c.depth + 1).where(child.c.parent_id == tree.c.descendant_id)
+        )
+        db.session.execute(delete)
+        result = db.session.execute(t.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"], select(tree.c.ancestor_id, tree.c.descendant_id, tree.c.depth)
+        ))
+        return result.rowcount
+
+
+class CategoryEffectiveAttribute(db.Model):
+    """
+    Effective attributes of each category: its own attributes and the ones inherited from its ancestors.
+    Derived from attribute_category and category_closure, the rows of a subtree are recomputed with
+    refresh(<root of the subtree>) when the attributes of a category change or a category is moved or created.
+    flask categories rebuild-attributes recompute the whole table.
+    """
+    __tablename__ = 'category_effective_attribute'
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id', ondelete='CASCADE'), primary_key=True)
+    attribute_id = db.Column(db.Integer, db.ForeignKey('attribute.id', ondelete='CASCADE'), primary_key=True)
+
+    __table_args__ = (
+        db.Index("ix_category_effective_attribute_attribute", "attribute_id", "category_id"),
+    )
+
+    def __repr__(self) -> str:
+        return f'CategoryEffectiveAttribute(category_id={self.category_id}, attribute_id={self.attribute_id})'
+
+    @classmethod
+    def _select_effective(cls, categories):
+        """(category_id, attribute_id) of every category in <categories>, from the attributes of all its ancestors"""
+        closure = CategoryClosure.__table__
+        return select(closure.c.descendant_id, attribute_category.c.attribute_id).distinct().\
+            select_from(closure.join(attribute_category, attribute_category.c.category_id == closure.c.ancestor_id)).\
+            where(closure.c.descendant_id.in_(categories))
+
+    @classmethod
+    def refresh(cls, category_id:int, connection=None) -> None:
+        """recompute the effective attributes of a category and all its descendants, in two statements"""
+        t, closure = cls.__table__, CategoryClosure.__table__
+        subtree = select(closure.c.descendant_id).where(closure.c.ancestor_id == category_id)
+        executor = connection or db.session
+        executor.execute(t.delete().where(t.c.category_id.in_(subtree)))
+        executor.execute(t.insert().from_select(["category_id", "attribute_id"], cls._select_effective(subtree)))
+
+    @classmethod
+    def rebuild(cls, company_id:int = None) -> int:
+        """recompute the whole table, or the categories of a company. returns the number of rows"""
+        t, c = cls.__table__, Category.__table__
+        categories = select(c.c.id)
+        if company_id is not None:
+            categories = categories.where(c.c.company_id == company_id)
+
+        db.session.execute(t.delete().where(t.c.category_id.in_(categories)))
+        result = db.session.execute(
+            t.insert().from_select(["category_id", "attribute_id"], cls._select_effective(categories))
+        )
+        return result.rowcount
 
 
 class Provider(db.Model):
@@ -501,15 +882,10 @@ class Provider(db.Model):
 
 class OrderRequest(db.Model):
     def __init__(self, *args, **kwargs) -> None:
-        """update kwargs arguments with the last qr_code counter in the company"""
+        """update kwargs arguments with the next correlative of the company"""
         company_id = kwargs.get("company_id", None)
-        if company_id and isinstance(company_id, int):
-            last_request = db.session.query(OrderRequest).filter(OrderRequest.company_id == company_id).\
-                order_by(OrderRequest._correlative.desc()).first()
-            if not last_request:
-                kwargs.update({"_correlative": 1})
-            else:
-                kwargs.update({"_correlative": last_request._correlative+1})
+        if company_id and isinstance(company_id, int) and "_correlative" not in kwargs:
+            kwargs.update({"_correlative": Correlative.reserve(company_id, OrderRequest.__tablename__)})
 
         super().__init__(*args, **kwargs)
 
@@ -710,7 +1086,7 @@ class AttributeValue(db.Model):
     __tablename__ = 'attribute_value'
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.String(64), default="") #unit value for a given attribute
-    attribute_id = db.Column(db.Integer, db.ForeignKey('attribute.id'), nullable=False)
+    attribute_id = db.Column(db.Integer, db.ForeignKey('attribute.id'), nullable=False, index=True)
     #relations
     items = db.relationship('Item', secondary=attributeValue_item, back_populates='attribute_values', lazy='dynamic')
     attribute = db.relationship('Attribute', back_populates='attribute_values', lazy='joined')
@@ -815,25 +1191,94 @@ class Inventory(db.Model):
         return False if self.order else True
 
 
+class ItemStock(db.Model):
+    """
+    Stock ledger, one row per (item, storage) with the totals of the available inventories
+    (inventories without order). Rows are updated with ItemStock.apply() in the same
+    transaction of the inventory and acquisition writes. flask stock rebuild|verify
+    recompute the ledger from the inventory table.
+    """
+    __tablename__ = 'item_stock'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id', ondelete='CASCADE'), primary_key=True)
+    storage_id = db.Column(db.Integer, db.ForeignKey('storage.id', ondelete='CASCADE'), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id', ondelete='CASCADE'), nullable=False, index=True)
+    quantity = db.Column(db.Float(precision=2), default=0.0, nullable=False)
+    total_cost = db.Column(db.Float(precision=2), default=0.0, nullable=False)
+    units = db.Column(db.Integer, default=0, nullable=False) #available inventories
+    _last_update = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f'ItemStock(item_id={self.item_id}, storage_id={self.storage_id})'
+
+    def serialize(self) -> dict:
+        return {
+            'stock_storage_ID': self.storage_id,
+            'stock_quantity': self.quantity,
+            'stock_total_cost': round(self.total_cost, 2),
+            'stock_units': self.units
+        }
+
+    @classmethod
+    def apply(cls, company_id:int, item_id:int, storage_id:int, quantity:float=0.0, total_cost:float=0.0, units:int=0) -> None:
+        """
+        add the deltas to the ledger row of (item_id, storage_id), the row is created if not exists.
+        runs in the current session, commit is up to the caller.
+        """
+        stmt = pg_insert(cls.__table__).values(
+            item_id=item_id, storage_id=storage_id, company_id=company_id,
+            quantity=quantity, total_cost=total_cost, units=units, _last_update=datetime.utcnow()
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.item_id, cls.storage_id],
+            set_={
+                "quantity": cls.quantity + stmt.excluded.quantity,
+                "total_cost": cls.total_cost + stmt.excluded.total_cost,
+                "units": cls.units + stmt.excluded.units,
+                "_last_update": stmt.excluded._last_update
+            }
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def apply_inventory(cls, acquisition:Acquisition, company_id:int, sign:int=1) -> None:
+        """add (sign=1) or remove (sign=-1) an available inventory of <acquisition> to the ledger"""
+        qtty = acquisition.item_qtty or 0.0
+        cls.apply(
+            company_id, acquisition.item_id, acquisition.storage_id,
+            quantity=sign * qtty, total_cost=sign * qtty * (acquisition.item_cost or 0.0), units=sign
+        )
+
+    @staticmethod
+    def get_ledger_query(company_id:int=None):
+        """query with the ledger rows computed from the inventory table, (item_id, storage_id, company_id, quantity, total_cost, units)"""
+        q = db.session.query(
+            Acquisition.item_id, Acquisition.storage_id, Item.company_id,
+            func.sum(Acquisition.item_qtty), func.sum(Acquisition.item_qtty * Acquisition.item_cost), func.count(Inventory.id)
+        ).select_from(Inventory).join(Inventory.acquisition).join(Acquisition.item).\
+            filter(Inventory.order_id == None).group_by(Acquisition.item_id, Acquisition.storage_id, Item.company_id)
+
+        if company_id is not None:
+            q = q.filter(Item.company_id == company_id)
+
+        return q
+
+
 class QRCode(db.Model):
     def __init__(self, *args, **kwargs) -> None:
-        """update kwargs arguments with the last qr_code counter in the company"""
+        """update kwargs arguments with the next correlative of the company"""
         company_id = kwargs.get("company_id", None)
-        if company_id and isinstance(company_id, int):
-            last_qr = db.session.query(QRCode).filter(QRCode.company_id == company_id).\
-                order_by(QRCode._correlative.desc()).first()
-            if not last_qr:
-                kwargs.update({"_correlative": 1})
-            else:
-                kwargs.update({"_correlative": last_qr._correlative+1})
+        if company_id and isinstance(company_id, int) and "_correlative" not in kwargs:
+            kwargs.update({"_correlative": Correlative.reserve(company_id, QRCode.__tablename__)})
 
         super().__init__(*args, **kwargs)
 
     __tablename__ = 'qr_code'
+    ID_SEQUENCE = "qr_code_id_seq" #id is reserved before insert, to store the signed text in the same row
     id = db.Column(db.Integer, primary_key=True)
     _date_created = db.Column(db.DateTime, default=datetime.utcnow)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
     _correlative = db.Column(db.Integer, default=0)
+    _signed_text = db.Column(db.String(128)) #signed at creation, existing rows are filled by flask qrcodes sign
     is_active = db.Column(db.Boolean, default=True)
     #relations
     company = db.relationship('Company', back_populates='qr_codes', lazy='joined')
@@ -847,12 +1292,44 @@ class QRCode(db.Model):
         return {
             'qrcode_dateCreated': DateTimeHelpers(self._date_created).datetime_formatter(),
             'qrcode_isActive': self.is_active,
-            'qrcode_text': QR_factory(data=f"{self.id:02d}").encode,
-            'qrcode_key': f"{self.company.id:02d}.{self._correlative:02d}",
+            'qrcode_text': self.signed_text,
+            'qrcode_key': self.key,
             'qrcode_isUsed': self.is_used
         }
 
 
+    @property
+    def key(self) -> str:
+        """human readable key of the qrcode, <company_id>.<correlative>"""
+        return f"{self.company_id:02d}.{self._correlative:02d}"
+
+    @property
+    def signed_text(self) -> str:
+        """signed qrcode payload, never None: rows not filled by flask qrcodes sign yet are signed on the fly"""
+        return self._signed_text or QR_factory(data=f"{self.id:02d}").encode
+
+    @classmethod
+    def reserve_ids(cls, count:int) -> list:
+        """reserve <count> ids from the qr_code sequence, in one statement"""
+        return db.session.execute(
+            select(func.nextval(cls.ID_SEQUENCE)).select_from(func.generate_series(1, count))
+        ).scalars().all()
+
+    @staticmethod
+    def serialize_rows(rows:list, company_id:int):
+        """
+        serialize (id, _correlative, _date_created, is_active, _signed_text) rows of new qrcodes without loading the instances.
+        yields the same dict of QRCode.serialize(), in the same order of <rows>
+        """
+        for row in rows:
+            yield {
+                'qrcode_dateCreated': DateTimeHelpers(row[2]).datetime_formatter(),
+                'qrcode_isActive': row[3],
+                'qrcode_text': row[4],
+                'qrcode_key': f"{company_id:02d}.{row[1]:02d}",
+                'qrcode_isUsed': False
+            }
+
     def serialize_all(self) -> dict:
         return {
             **self.serialize(),
@@ -877,4 +1354,33 @@ class QRCode(db.Model):
         returns int(0) if parser fails
         returns int(id) for valid formatted qr-string
         """
-        return QR_factory(data=raw_qrcode).decode
\ No newline at end of file
+        return QR_factory(data=raw_qrcode).decode
+
+
+@event.listens_for(Item, "before_insert")
+@event.listens_for(Item, "before_update")
+def normalize_item_search_columns(mapper, connection, target):
+    """keep the normalized search columns in sync with name, sku and description"""
+    target.update_search_columns()
+
+
+@event.listens_for(Item.__table__, "before_create")
+def create_trigram_extension(target, connection, **kw):
+    """the trigram indexes of the item table need the pg_trgm extension"""
+    connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@event.listens_for(Category, "after_insert")
+def insert_category_closure(mapper, connection, target):
+    """closure rows and inherited attributes of a new category"""
+    CategoryClosure.insert_node(connection, target.company_id, target.id, target.parent_id)
+    CategoryEffectiveAttribute.refresh(target.id, connection)
+
+
+@event.listens_for(QRCode, "before_insert")
+def sign_new_qrcode(mapper, connection, target):
+    """reserve the id of a new qrcode, so its signed text is stored in the same INSERT"""
+    if target._signed_text is None:
+        if target.id is None:
+            target.id = connection.execute(select(func.nextval(QRCode.ID_SEQUENCE))).scalar()
+        target._signed_text = QR_factory(data=f"{target.id:02d}").encode
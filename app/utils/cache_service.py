@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe, bounded LRU cache with a time-to-live for each entry.
+    One instance lives in each worker process, values are never shared between workers.
+
+    methods:
+    - get(key) -> value or None
+    - set(key, value, stamp=None)
+    - delete(key), clear()
+    - stamp() -> int, counter of invalidations. A value read before an invalidation
+      is not stored if the stamp taken before the read is passed to set().
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamp = 0
+
+    def __repr__(self) -> str:
+        return f"TTLCache(maxsize={self.maxsize}, ttl={self.ttl}, size={len(self._data)})"
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def configure(self, maxsize: int = None, ttl: float = None) -> None:
+        """update cache limits, current entries are discarded"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._data.clear()
+            self._stamp += 1
+
+    def stamp(self) -> int:
+        return self._stamp
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, None)
+            if entry is None:
+                return default
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, stamp: int = None) -> bool:
+        """store a value in the cache, returns False if the value was discarded"""
+        if self.maxsize <= 0:
+            return False
+
+        with self._lock:
+            if stamp is not None and stamp != self._stamp:
+                return False  # an invalidation arrived while the value was being read
+
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+        return True
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self._stamp += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._stamp += 1
@@ -0,0 +1,114 @@
+import json
+import logging
+import time
+import redis
+from app.models.main import Category
+from app.utils.cache_service import TTLCache
+from app.utils.redis_service import RedisClient, invalidation_listener
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryTreeCache:
+    """
+    Serialized category tree of each company, cached in redis.
+
+    Entries are keyed by the version of the company tree, every create, update or delete of a
+    category bumps the version after commit, so old entries are never read again and expire
+    with their ttl. Current versions are cached per worker and evicted by the messages published
+    in the invalidation channel, a cache hit is a single GET.
+
+    Versions start at the current time in milliseconds, so a version key evicted by redis
+    starts again above any version already used. Entries live for minutes, which bounds the
+    staleness when a bump can't reach redis.
+    """
+    NAMESPACE = "category-tree"
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 300
+        self._versions = TTLCache()
+        invalidation_listener.register(self.NAMESPACE, self._evict, on_reset=self._versions.clear)
+
+    def __repr__(self) -> str:
+        return f"CategoryTreeCache(enabled={self.enabled}, ttl={self.ttl})"
+
+    def init_app(self, app):
+        self.enabled = app.config.get("CATEGORY_TREE_CACHE_ENABLED", False)
+        self.ttl = app.config.get("CATEGORY_TREE_CACHE_TTL", self.ttl)
+        self._versions.configure(
+            maxsize=app.config.get("CATEGORY_TREE_CACHE_SIZE", 2048),
+            ttl=app.config.get("CATEGORY_TREE_VERSION_TTL", 60)
+        )
+
+    def _evict(self, company_id: str) -> None:
+        self._versions.delete(int(company_id))
+
+    @staticmethod
+    def _version_key(company_id: int) -> str:
+        return f"category-tree:{company_id}:version"
+
+    @staticmethod
+    def _tree_key(company_id: int, version: int) -> str:
+        return f"category-tree:{company_id}:{version}"
+
+    @staticmethod
+    def _version_seed() -> int:
+        return int(time.time() * 1000)
+
+    def get_version(self, client: redis.Redis, company_id: int) -> int:
+        local = invalidation_listener.is_subscribed()
+        if local:
+            version = self._versions.get(company_id)
+            if version is not None:
+                return version
+
+        stamp = self._versions.stamp()
+        version = client.get(self._version_key(company_id))
+        if version is None:  # new company or evicted key
+            client.set(self._version_key(company_id), self._version_seed(), nx=True)
+            version = client.get(self._version_key(company_id))
+        version = int(version)
+        if local:
+            self._versions.set(company_id, version, stamp=stamp)
+
+        return version
+
+    def get_tree(self, company_id: int) -> list:
+        """serialized category tree of a company, from the cache or loaded in one query"""
+        if not self.enabled:
+            return Category.get_tree(company_id)
+
+        try:
+            client = RedisClient().get_client()
+            version = self.get_version(client, company_id)  # read before the tree, a newer write bumps it
+            cached = client.get(self._tree_key(company_id, version))
+            if cached is not None:
+                return json.loads(cached)
+
+            tree = Category.get_tree(company_id)
+            client.set(self._tree_key(company_id, version), json.dumps(tree), ex=self.ttl)
+            return tree
+
+        except redis.RedisError as re:
+            logger.warning(f"category tree cache not available - {re}")
+            return Category.get_tree(company_id)
+
+    def bump(self, company_id: int) -> None:
+        """invalidates the cached tree of a company, call it after the commit of the change"""
+        if not self.enabled:
+            return
+
+        self._versions.delete(company_id)
+        try:
+            r = RedisClient().get_client()
+            with r.pipeline(transaction=False) as pipe:
+                pipe.set(self._version_key(company_id), self._version_seed(), nx=True)
+                pipe.incr(self._version_key(company_id))
+                invalidation_listener.publish(pipe, self.NAMESPACE, company_id)
+                pipe.execute()
+        except redis.RedisError as re:
+            logger.error(f"category tree version of company-{company_id} not updated, stale for {self.ttl}s - {re}")
+
+
+category_tree_cache = CategoryTreeCache()
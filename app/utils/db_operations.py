@@ -1,12 +1,21 @@
+import hashlib
+import json
 import logging
+import redis
 from datetime import datetime
+from typing import Union
 from app.extensions import db
 from app.models.main import Company, Container, Inventory, Storage
-from app.utils.helpers import StringHelpers, DateTimeHelpers
+from decimal import Decimal
+from app.utils.helpers import StringHelpers, DateTimeHelpers, QueryParams
+from app.utils.redis_service import RedisClient
 from app.utils.func_decorators import app_logger
-from flask import abort
+from flask import abort, current_app
+from flask_sqlalchemy import Pagination
 from sqlalchemy.sql.functions import ReturnTypeFromArgs
-from sqlalchemy import func
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+from sqlalchemy import func, and_, or_
 ReturnTypeFromArgs.inherit_cache = True
 
 logger = logging.getLogger(__name__)
@@ -120,4 +129,196 @@ class ContainerValidations():
             return True if same_item else False
         
         #if container is empty, returns True
-        return True
\ No newline at end of file
+        return True
+
+
+class KeysetPage:
+    """a page of a keyset paginated query, read by QueryParams.get_pagination_form"""
+    def __init__(self, items:list, limit:int, has_next:bool, next_cursor:str = None, keys:list = None) -> None:
+        self.items = items
+        self.keys = keys or [] #sort key of each item
+        self.limit = limit
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+
+    def __repr__(self) -> str:
+        return f"KeysetPage(items={len(self.items)}, has_next={self.has_next})"
+
+
+def _parse_sort_key(order) -> tuple:
+    """(expression, descending) of an order_by element, ex: Item.name.asc() -> (Item.name, False)"""
+    if isinstance(order, UnaryExpression) and order.modifier in (operators.asc_op, operators.desc_op):
+        return order.element, order.modifier is operators.desc_op
+    return order, False
+
+
+def _cursor_value(expression, value):
+    """values of a decoded cursor back to the type of the sort expression"""
+    if value is None:
+        return None
+    try:
+        python_type = expression.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is Decimal:
+        return Decimal(str(value))
+    return python_type(value)
+
+
+def keyset_filter(sort_keys:list, values:list):
+    """
+    rows after <values> in the order of <sort_keys> [(expression, descending), ...]:
+    (a > va) OR (a = va AND b > vb) OR ...
+    """
+    clauses = []
+    for i, (expression, descending) in enumerate(sort_keys):
+        after = expression < values[i] if descending else expression > values[i]
+        clauses.append(and_(*[e == v for (e, _), v in zip(sort_keys[:i], values[:i])], after))
+    return or_(*clauses)
+
+
+def get_keyset_filter(qp:QueryParams, scope:str, sort_keys:list):
+    """filter for the rows after the cursor in the request, None for the first page or an invalid cursor"""
+    cursor = qp.get_cursor(scope)
+    if not cursor:
+        return None
+
+    try:
+        values = [_cursor_value(e, v) for (e, _), v in zip(sort_keys, cursor)]
+    except (ValueError, TypeError, ArithmeticError):
+        values = []
+    if len(values) != len(sort_keys):
+        qp.warnings.append({"cursor": "invalid cursor, first page returned"})
+        return None
+
+    return keyset_filter(sort_keys, values)
+
+
+def encode_keyset_cursor(qp:QueryParams, scope:str, values) -> str:
+    """cursor with the sort key of the last row of a page"""
+    return qp.encode_cursor([v.isoformat() if isinstance(v, datetime) else v for v in values], scope)
+
+
+def keyset_paginate(query, qp:QueryParams, scope:str, order_by:list, max_limit:int = None) -> KeysetPage:
+    """
+    cursor pagination of <query> in the order of <order_by>, the last element must be unique (ex: Model.id).
+    the cursor encodes the sort key of the last row, so every page is an index range scan, regardless of
+    its depth. Sort expressions must be not nullable. <scope> ties the cursors to one listing.
+    <max_limit> caps the page size of expensive listings.
+    """
+    _, limit = qp.get_pagination_params()
+    if max_limit is not None:
+        limit = min(limit, max_limit)
+    sort_keys = [_parse_sort_key(o) for o in order_by]
+    after = get_keyset_filter(qp, scope, sort_keys)
+    if after is not None:
+        query = query.filter(after)
+
+    rows = query.order_by(None).add_columns(*[e for e, _ in sort_keys]).order_by(*order_by).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_keyset_cursor(qp, scope, rows[-1][1:]) if has_next else None
+
+    return KeysetPage([r[0] for r in rows], limit, has_next, next_cursor, keys=[tuple(r[1:]) for r in rows])
+
+
+class CountedPagination(Pagination):
+    """
+    Flask-SQLAlchemy pagination with has_next read from the page itself (limit+1 rows).
+    total is None when the count is omitted
+    """
+    def __init__(self, query, page:int, per_page:int, total:int, items:list, has_next:bool, count_strategy:str):
+        super().__init__(query, page, per_page, total, items)
+        self._has_next = has_next
+        self.count_strategy = count_strategy
+
+    @property
+    def pages(self):
+        return super().pages if self.total is not None else None
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+
+def _compile_query(query) -> tuple:
+    """(sql, params) of a query, for the statements that run outside the ORM"""
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    return str(compiled), compiled.params
+
+
+def get_estimated_count(query) -> int:
+    """number of rows of <query> estimated by the planner, no rows are read"""
+    sql, params = _compile_query(query.order_by(None))
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def get_cached_count(query, scope:str) -> int:
+    """
+    exact count of <query>, cached in redis for PAGINATION_COUNT_CACHE_TTL seconds.
+    the key is the hash of the compiled query, so it includes the company and all the filters.
+    falls back to an exact count if redis is not available
+    """
+    sql, params = _compile_query(query.order_by(None))
+    digest = hashlib.sha1(f"{sql}{sorted(params.items(), key=lambda p: p[0])}".encode()).hexdigest()
+    key = f"pagination:count:{scope}:{digest}"
+    try:
+        client = RedisClient().get_client()
+        cached = client.get(key)
+        if cached is not None:
+            return int(cached)
+        total = query.order_by(None).count()
+        client.set(key, total, ex=current_app.config.get("PAGINATION_COUNT_CACHE_TTL", 30))
+        return total
+    except redis.RedisError as re:
+        logger.warning(f"count cache not available - {re}")
+        return query.order_by(None).count()
+
+
+def get_total(query, strategy:str, scope:str) -> Union[int, None]:
+    """total rows of <query> with a count strategy: exact, estimated, cached or none"""
+    if strategy == "none":
+        return None
+    if strategy == "estimated":
+        return get_estimated_count(query)
+    if strategy == "cached":
+        return get_cached_count(query, scope)
+    return query.order_by(None).count()
+
+
+def paginate(query, qp:QueryParams, scope:str, order_by:list):
+    """
+    paginate <query> in the order of <order_by>, the last element must be unique (ex: Model.id).
+    - page mode (default): ?page=<int>&limit=<int>. The total is computed with the count strategy of the endpoint,
+      PAGINATION_COUNT_STRATEGIES[scope] or ?count=<exact|estimated|cached|none>, see QueryParams.get_count_strategy
+    - cursor mode: ?cursor=<str>&limit=<int>, an empty cursor returns the first page. see keyset_paginate
+    """
+    if qp.cursor_mode:
+        return keyset_paginate(query, qp, scope, order_by)
+
+    page, limit = qp.get_pagination_params()
+    if page < 1 or limit < 0:
+        abort(404)
+
+    strategy = qp.get_count_strategy(
+        default=current_app.config.get("PAGINATION_COUNT_STRATEGIES", {}).get(scope, "exact")
+    )
+    rows = query.order_by(None).order_by(*order_by).limit(limit + 1).offset((page - 1) * limit).all()
+    if not rows and page != 1:
+        abort(404)
+
+    has_next = len(rows) > limit
+    items = rows[:limit]
+    if not has_next and (page == 1 or items) and strategy != "none":
+        total = (page - 1) * limit + len(items) #last page, the total is known without a count
+    else:
+        total = get_total(query, strategy, scope)
+        if total is not None:
+            total = max(total, (page - 1) * limit + len(items) + int(has_next)) #estimates never below the rows seen
+
+    return CountedPagination(query, page, limit, total, items, has_next, strategy)
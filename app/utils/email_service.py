@@ -1,11 +1,18 @@
 import logging
 import requests
 import os
+import json
+import time
+import uuid
+import redis
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from requests.exceptions import (
     RequestException
 )
-from flask import render_template
+from flask import render_template, current_app
 from app.utils.func_decorators import app_logger
+from app.utils.redis_service import RedisClient
 
 logger = logging.getLogger(__name__)
 
@@ -49,7 +56,27 @@ class Email_api_service:
             "htmlContent": self.content
         }
 
-    def send_request(self) -> tuple:
+    def to_message(self) -> dict:
+        """serialize the email to be stored in the outbox"""
+        return {
+            "id": uuid.uuid4().hex,
+            "email_to": self.email_to,
+            "content": self.content,
+            "sender": self.sender,
+            "subject": self.subject,
+            "attempts": 0
+        }
+
+    @classmethod
+    def from_message(cls, message: dict):
+        return cls(
+            email_to=message["email_to"],
+            content=message["content"],
+            sender=message["sender"],
+            subject=message["subject"]
+        )
+
+    def send_request(self, session: requests.Session = None, timeout: float = 3) -> tuple:
         """
         SMTP API request function
         return tuple with status and message:
@@ -62,7 +89,7 @@ class Email_api_service:
             return True, "email printed in console"
 
         try:
-            r = requests.post(headers=self.get_headers(), json=self.get_body(), url=self.SMTP_API_URL, timeout=3)
+            r = (session or requests).post(headers=self.get_headers(), json=self.get_body(), url=self.SMTP_API_URL, timeout=timeout)
             r.raise_for_status()
 
         except RequestException as e:
@@ -70,6 +97,242 @@ class Email_api_service:
 
         return True, f"email sent to user: {self.email_to}"
 
+    def deliver(self) -> tuple:
+        """
+        hand the email to the outbox, to be sent by the email worker.
+        the email is sent in the current request if the outbox is disabled or in development mode
+
+        * returns tuple -> (success:bool, msg:str)
+        """
+        return self.deliver_many([self])
+
+    @classmethod
+    def deliver_many(cls, mails: list) -> tuple:
+        """
+        hand a list of emails to the outbox in a single redis command.
+        * returns tuple -> (success:bool, msg:str)
+        """
+        if cls.MAIL_MODE == 'development' or not current_app.config.get("MAIL_OUTBOX_ENABLED", False):
+            for mail in mails:
+                success, msg = mail.send_request()
+                if not success:
+                    return success, msg
+            return True, f"{len(mails)} email(s) sent"
+
+        return EmailOutbox.from_config(current_app.config).enqueue(*mails)
+
+
+class EmailOutbox:
+    """
+    Durable queue of outbound emails, stored in redis.
+
+    - <prefix>:queue -> list of pending messages.
+    - <prefix>:processing:<worker> -> messages taken by a worker and not yet confirmed.
+    - <prefix>:heartbeat:<worker> -> set by every running worker, expires if the worker dies.
+    - <prefix>:retry -> sorted set of failed messages, scored by the time of the next attempt.
+    - <prefix>:dead -> messages that reached the max number of attempts.
+    """
+
+    # moves the retries that are due back to the queue, atomically.
+    PROMOTE_SCRIPT = """
+    local msgs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, msg in ipairs(msgs) do
+        redis.call('ZREM', KEYS[1], msg)
+        redis.call('LPUSH', KEYS[2], msg)
+    end
+    return #msgs
+    """
+
+    def __init__(self, prefix: str = "email:outbox", max_attempts: int = 6, backoff_base: float = 2, backoff_max: float = 600):
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def __repr__(self) -> str:
+        return f"EmailOutbox(prefix={self.prefix})"
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            prefix=config.get("MAIL_OUTBOX_PREFIX", "email:outbox"),
+            max_attempts=config.get("MAIL_OUTBOX_MAX_ATTEMPTS", 6),
+            backoff_base=config.get("MAIL_OUTBOX_BACKOFF_BASE", 2),
+            backoff_max=config.get("MAIL_OUTBOX_BACKOFF_MAX", 600)
+        )
+
+    @property
+    def queue_key(self) -> str:
+        return f"{self.prefix}:queue"
+
+    @property
+    def retry_key(self) -> str:
+        return f"{self.prefix}:retry"
+
+    @property
+    def dead_key(self) -> str:
+        return f"{self.prefix}:dead"
+
+    def processing_key(self, worker_name: str) -> str:
+        return f"{self.prefix}:processing:{worker_name}"
+
+    def heartbeat_key(self, worker_name: str) -> str:
+        return f"{self.prefix}:heartbeat:{worker_name}"
+
+    def enqueue(self, *mails: Email_api_service) -> tuple:
+        """
+        store emails in the outbox.
+        * returns tuple -> (success:bool, msg:str)
+        """
+        try:
+            RedisClient().get_client().lpush(self.queue_key, *[json.dumps(m.to_message()) for m in mails])
+        except redis.RedisError as re:
+            return False, {"email_outbox": f"{re}"}
+
+        return True, f"{len(mails)} email(s) queued for delivery"
+
+    def get_backoff(self, attempts: int) -> float:
+        """seconds to wait before the next attempt of a message"""
+        return min(self.backoff_base ** attempts, self.backoff_max)
+
+    def stats(self) -> dict:
+        r = RedisClient().get_client()
+        with r.pipeline(transaction=False) as pipe:
+            pipe.llen(self.queue_key)
+            pipe.zcard(self.retry_key)
+            pipe.llen(self.dead_key)
+            queued, retry, dead = pipe.execute()
+
+        return {"queued": queued, "retry": retry, "dead": dead}
+
+
+class EmailWorker:
+    """
+    Drains the email outbox. Messages are taken in batches and sent concurrently with a
+    pooled http session. Failed messages are retried with exponential backoff.
+
+    Each worker keeps a heartbeat key alive while it runs. The processing lists of workers
+    without heartbeat are moved back to the queue, so the messages of a crashed worker are
+    delivered by the others, whatever its name was.
+    """
+
+    def __init__(
+        self, outbox: EmailOutbox, name: str, batch_size: int = 20, concurrency: int = 8, timeout: float = 10,
+        heartbeat_ttl: int = 60
+    ):
+        self.outbox = outbox
+        self.name = name
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.heartbeat_ttl = heartbeat_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="email-worker")
+
+    def __repr__(self) -> str:
+        return f"EmailWorker(name={self.name}, batch_size={self.batch_size}, concurrency={self.concurrency})"
+
+    @property
+    def processing_key(self) -> str:
+        return self.outbox.processing_key(self.name)
+
+    def heartbeat(self, r: redis.Redis) -> None:
+        r.set(self.outbox.heartbeat_key(self.name), int(time.time()), ex=self.heartbeat_ttl)
+
+    def recover(self, r: redis.Redis) -> int:
+        """
+        move back to the queue the messages left by a previous run of this worker and by
+        any other worker whose heartbeat has expired.
+        """
+        count = 0
+        processing_prefix = self.outbox.processing_key("")
+        for key in r.scan_iter(match=f"{processing_prefix}*", count=100):
+            key = key.decode() if isinstance(key, bytes) else key
+            worker_name = key[len(processing_prefix):]
+            if worker_name != self.name and r.exists(self.outbox.heartbeat_key(worker_name)):
+                continue
+
+            while r.rpoplpush(key, self.outbox.queue_key) is not None:
+                count += 1
+
+        return count
+
+    def get_batch(self, r: redis.Redis, block_timeout: int = 1) -> list:
+        first = r.brpoplpush(self.outbox.queue_key, self.processing_key, timeout=block_timeout)
+        if first is None:
+            return []
+
+        batch = [first]
+        while len(batch) < self.batch_size:
+            raw = r.rpoplpush(self.outbox.queue_key, self.processing_key)
+            if raw is None:
+                break
+            batch.append(raw)
+
+        return batch
+
+    def send(self, raw: bytes) -> tuple:
+        message = json.loads(raw)
+        return Email_api_service.from_message(message).send_request(session=self.session, timeout=self.timeout)
+
+    def process_batch(self, r: redis.Redis, batch: list) -> tuple:
+        """send a batch of messages, returns (sent:int, failed:int)"""
+        results = list(self._executor.map(self.send, batch))
+        now = time.time()
+        sent = 0
+        with r.pipeline(transaction=True) as pipe:
+            for raw, (success, msg) in zip(batch, results):
+                pipe.lrem(self.processing_key, 1, raw)
+                if success:
+                    sent += 1
+                    continue
+
+                message = json.loads(raw)
+                message["attempts"] += 1
+                logger.warning(f"email {message['id']} to {message['email_to']} failed, attempt {message['attempts']} - {msg}")
+                if message["attempts"] >= self.outbox.max_attempts:
+                    pipe.lpush(self.outbox.dead_key, json.dumps(message))
+                else:
+                    pipe.zadd(self.outbox.retry_key, {json.dumps(message): now + self.outbox.get_backoff(message["attempts"])})
+            pipe.execute()
+
+        return sent, len(batch) - sent
+
+    def run(self, stop_event=None) -> None:
+        r = RedisClient().get_client()
+        promote = r.register_script(EmailOutbox.PROMOTE_SCRIPT)
+        self.heartbeat(r)
+        recovered = self.recover(r)
+        logger.info(f"{self} started, {recovered} message(s) recovered")
+        last_recover = time.monotonic()
+
+        while stop_event is None or not stop_event.is_set():
+            try:
+                self.heartbeat(r)
+                if time.monotonic() - last_recover >= self.heartbeat_ttl:
+                    recovered = self.recover(r)
+                    last_recover = time.monotonic()
+                    if recovered:
+                        logger.warning(f"{recovered} message(s) of stopped workers moved back to the queue")
+
+                promote(keys=[self.outbox.retry_key, self.outbox.queue_key], args=[time.time(), self.batch_size * 10])
+                batch = self.get_batch(r)
+                if batch:
+                    sent, failed = self.process_batch(r, batch)
+                    logger.info(f"email batch processed - sent: {sent}, failed: {failed}")
+
+            except redis.RedisError as re:
+                logger.error(f"email worker can't reach redis-service - {re}")
+                time.sleep(1)
+
+        try:
+            r.delete(self.outbox.heartbeat_key(self.name))
+        except redis.RedisError:
+            pass
+
 
 @app_logger(logger)
 def send_verification_email(user_email: str, verification_code: int, user_name: str = None) -> tuple:
@@ -88,20 +351,14 @@ def send_verification_email(user_email: str, verification_code: int, user_name:
         subject="[My App] - Código de Verificación"
     )
 
-    return mail.send_request()
+    return mail.deliver()
 
 
-@app_logger(logger)
-def send_user_invitation(user_email: str, user_name: str = None, company_name: str = None):
-    """
-    funcion para invitar a un nuevo usuario a que se inscriba en la aplicacion. Este nuevo usuario fue invitado
-    por otro usuario a participar en la gestion de su empresa.
-
-    *returns tuple -> (success: bool, msg: str)
-    """
+def get_user_invitation(user_email: str, user_name: str = None, company_name: str = None) -> Email_api_service:
+    """build the invitation email of an user"""
     identifier = user_name if user_name is not None else user_email
 
-    mail = Email_api_service(
+    return Email_api_service(
         email_to=user_email,
         content=render_template(
             "email/user-invitation.html",
@@ -110,4 +367,29 @@ def send_user_invitation(user_email: str, user_name: str = None, company_name: s
         subject="[My App] - Invitación a colaborar"
     )
 
-    return mail.send_request()
+
+@app_logger(logger)
+def send_user_invitation(user_email: str, user_name: str = None, company_name: str = None):
+    """
+    funcion para invitar a un nuevo usuario a que se inscriba en la aplicacion. Este nuevo usuario fue invitado
+    por otro usuario a participar en la gestion de su empresa.
+
+    *returns tuple -> (success: bool, msg: str)
+    """
+    return get_user_invitation(user_email, user_name, company_name).deliver()
+
+
+@app_logger(logger)
+def send_user_invitations(invitations: list, company_name: str = None) -> tuple:
+    """
+    send the invitations of a bulk invite, all emails are queued at once.
+    invitations -> list of tuples: (user_email, user_name)
+
+    *returns tuple -> (success: bool, msg: str)
+    """
+    if not invitations:
+        return True, "no invitations to send"
+
+    return Email_api_service.deliver_many(
+        [get_user_invitation(email, name, company_name) for email, name in invitations]
+    )
@@ -3,9 +3,9 @@ from .helpers import JSONResponse
 
 class APIException(Exception, JSONResponse):
 
-    def __init__(self, message, app_result="error", status_code=400, payload=None):  # default code 400
+    def __init__(self, message, app_result="error", status_code=400, payload=None, headers=None):  # default code 400
         Exception.__init__(self)
-        JSONResponse.__init__(self, message, app_result, status_code, payload)
+        JSONResponse.__init__(self, message, app_result, status_code, payload, headers)
 
     @classmethod
     def from_error(cls, error):
@@ -13,5 +13,6 @@ class APIException(Exception, JSONResponse):
 
         status_code = error.get('status_code', 400)  # 400 is the default status code
         msg = error.get('msg')
+        headers = error.get('headers', None)  # additional response headers, ex: Retry-After
 
-        return cls(message=msg, status_code=status_code)
+        return cls(message=msg, status_code=status_code, headers=headers)
@@ -1,16 +1,18 @@
 from inspect import Parameter
+import functools
 import os
 import re
 import logging
 import unicodedata
 import string
 from datetime import datetime, timezone
+from decimal import Decimal
 from dateutil.parser import parse, ParserError
 from random import sample
 from typing import Union
-from flask import jsonify
+from flask import jsonify, current_app
 from app.utils.func_decorators import app_logger
-from itsdangerous import BadSignature, Signer
+from itsdangerous import BadSignature, Signer, URLSafeSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -172,13 +174,94 @@ class QueryParams:
         return page, limit
 
 
+    @app_logger(logger)
+    def get_include_options(self, allowed: tuple, key: str = "include") -> list:
+        """
+        returns the options requested in a comma separated parameter, ex: ?include=stock,cost
+        options not in <allowed> are ignored with a warning.
+        """
+        values = self.get_all_values(key) or []
+        options = [o.strip().lower() for v in values for o in v.split(",") if o.strip()]
+        invalids = [o for o in options if o not in allowed]
+        if invalids:
+            self.warnings.append({key: f"invalid options {invalids}, valid options are {list(allowed)}"})
+
+        return [o for o in allowed if o in options]
+
+
+    COUNT_STRATEGIES = ("exact", "estimated", "cached", "none")
+
+    @app_logger(logger)
+    def get_count_strategy(self, default:str = "exact", key:str = "count") -> str:
+        """
+        strategy for the total count of a paginated listing, ?count=<exact|estimated|cached|none>
+        - exact: COUNT(*) of the filtered query
+        - estimated: rows estimated by the planner
+        - cached: exact count, cached per filtered query for a short time
+        - none: no total, has_next is read from the page
+        """
+        value = self.params_flat.get(key, None)
+        if not value:
+            return default
+
+        value = value.strip().lower()
+        if value not in self.COUNT_STRATEGIES:
+            self.warnings.append({key: f"invalid count strategy {value}, valid options are {list(self.COUNT_STRATEGIES)}"})
+            return default
+
+        return value
+
+
+    @property
+    def cursor_mode(self) -> bool:
+        """True if the cursor pagination is requested, ?cursor= (empty) for the first page"""
+        return "cursor" in self.params_flat
+
+
+    @staticmethod
+    def _cursor_serializer(scope:str) -> URLSafeSerializer:
+        return URLSafeSerializer(current_app.config["SECRET_KEY"], salt=f"cursor.{scope}")
+
+
+    @classmethod
+    def encode_cursor(cls, values:list, scope:str) -> str:
+        """opaque and signed cursor with the sort key of the last row of a page. <scope> ties the cursor to one listing"""
+        return cls._cursor_serializer(scope).dumps([str(v) if isinstance(v, Decimal) else v for v in values])
+
+
+    @app_logger(logger)
+    def get_cursor(self, scope:str, key:str = "cursor") -> Union[list, None]:
+        """
+        returns the sort key stored in the cursor parameter, or None if the parameter is not present.
+        an invalid or tampered cursor is ignored with a warning, and the first page is returned
+        """
+        token = self.params_flat.get(key, None)
+        if not token:
+            return None
+
+        try:
+            return self._cursor_serializer(scope).loads(token)
+        except BadSignature:
+            self.warnings.append({key: "invalid cursor, first page returned"})
+            return None
+
+
     @staticmethod
     def get_pagination_form(pag_instance) -> dict:
         """
-        Receive a pagination instance from flasksqlalchemy, 
+        Receive a pagination instance from flasksqlalchemy, or a KeysetPage in cursor mode,
         returns a dict with pagination data in a dict, set to return to the user.
         """
-        return {
+        if hasattr(pag_instance, "next_cursor"):
+            return {
+                "pagination": {
+                    "limit": pag_instance.limit,
+                    "has_next": pag_instance.has_next,
+                    "next_cursor": pag_instance.next_cursor
+                }
+            }
+
+        form = {
             "pagination": {
                 "pages": pag_instance.pages,
                 "has_next": pag_instance.has_next,
@@ -187,6 +270,9 @@ class QueryParams:
                 "total_items": pag_instance.total
             }
         }
+        if hasattr(pag_instance, "count_strategy"):
+            form["pagination"]["count_strategy"] = pag_instance.count_strategy
+        return form
 
 
     def get_warings(self) -> dict:
@@ -407,6 +493,7 @@ class IntegerHelpers:
 class QR_factory(Signer):
 
     SECRET = os.environ["QR_SECRET_KEY"]
+    SECRET_PREVIOUS = os.environ.get("QR_SECRET_KEY_PREVIOUS", None) #still valid to decode, during key rotation
     QR_PREFIX = "QR"
 
     def __init__(self, data:str, *args, **kwargs):
@@ -415,11 +502,23 @@ class QR_factory(Signer):
 
         self._data = data
         kwargs["sep"] = "."
-        super().__init__(self.SECRET, *args, **kwargs)
+        super().__init__(self.get_secret_keys(), *args, **kwargs)
+
+    @classmethod
+    def get_secret_keys(cls) -> list:
+        """signing keys, oldest to newest. codes are signed with the newest key, and verified with all of them"""
+        return [cls.SECRET_PREVIOUS, cls.SECRET] if cls.SECRET_PREVIOUS else [cls.SECRET]
 
     def __repr__(self) -> str:
         return f"QR_factory()"
 
+    @classmethod
+    def encode_many(cls, data:list):
+        """sign a list of <str> data with a single signer, yields the signed strings in the same order"""
+        signer = Signer(cls.get_secret_keys(), sep=".")
+        for d in data:
+            yield signer.sign(f"{cls.QR_PREFIX + d}").decode("utf-8")
+
     @property
     def encode(self) -> str:
         """
@@ -436,12 +535,18 @@ class QR_factory(Signer):
         return None if the decode fails, otherwise, return 'int' value. (QR-id)
         raises TypeError if an invalid string is in 'payload' parameter
         """
-        try:
-            unsigned = self.unsign(f"{self._data}").decode("utf-8") #string
-            return int(unsigned[len(self.QR_PREFIX):])
+        return _decode_qr_payload(self._data)
 
-        except (BadSignature, ValueError):
-            return None
+
+@functools.lru_cache(maxsize=4096)
+def _decode_qr_payload(payload:str) -> Union[int, None]:
+    """cache of recently decoded qr payloads, scans of the same code don't run the HMAC again"""
+    try:
+        unsigned = Signer(QR_factory.get_secret_keys(), sep=".").unsign(payload).decode("utf-8") #string
+        return int(unsigned[len(QR_factory.QR_PREFIX):])
+
+    except (BadSignature, ValueError):
+        return None
 
 
 class JSONResponse:
@@ -452,6 +557,7 @@ class JSONResponse:
     - app_result = "success", "error"
     - status_code = http status code
     - payload = dict con cualquier informacion que se necesite enviar al usuario.
+    - headers = dict con headers adicionales de la respuesta, ej: {"Retry-After": "30"}
 
     methods:
 
@@ -460,11 +566,12 @@ class JSONResponse:
 
     """
 
-    def __init__(self, message="ok", app_result="success", status_code=200, payload=None):
+    def __init__(self, message="ok", app_result="success", status_code=200, payload=None, headers=None):
         self.app_result = app_result
         self.status_code = status_code
         self.data = payload
         self.message = message
+        self.headers = headers
 
     def __repr__(self) -> str:
         return f'JSONResponse(status_code={self.status_code})'
@@ -479,6 +586,8 @@ class JSONResponse:
 
     @app_logger(logger)
     def to_json(self):
+        if self.headers:
+            return jsonify(self.serialize()), self.status_code, self.headers
         return jsonify(self.serialize()), self.status_code
 
 
@@ -558,6 +667,11 @@ class ErrorMessages:
         """status_code = 409"""
         return self.get_response(message='parameter already exists in the database', status_code=409)
 
+    @property
+    def too_many_requests(self):
+        """status_code = 429"""
+        return self.get_response(message='too many requests, try again later', status_code=429)
+
     @property
     def service_unavailable(self):
         """status_code = 503"""
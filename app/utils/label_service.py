@@ -0,0 +1,211 @@
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+A4_INCHES = (8.27, 11.69)
+
+
+def render_sheet(labels: list, layout: dict) -> tuple:
+    """
+    render one sheet of qr labels, runs in the process pool.
+    labels -> list of (qrcode_text, caption)
+    returns (size, raw bytes of a grayscale image)
+    """
+    import qrcode
+    from PIL import Image, ImageDraw, ImageFont
+
+    dpi = layout["dpi"]
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    columns, rows = layout["columns"], layout["rows"]
+    margin = int(dpi * 0.25)
+    cell_w, cell_h = (width - 2 * margin) // columns, (height - 2 * margin) // rows
+    caption_h = int(dpi * 0.2)
+    qr_size = min(cell_w, cell_h - caption_h) - int(dpi * 0.1)
+
+    sheet = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    for i, (text, caption) in enumerate(labels):
+        x = margin + (i % columns) * cell_w
+        y = margin + (i // columns) * cell_h
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=1)
+        qr.add_data(text)
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="black", back_color="white").convert("L").resize((qr_size, qr_size), Image.NEAREST)
+        sheet.paste(img, (x + (cell_w - qr_size) // 2, y))
+        text_w = draw.textlength(caption, font=font)
+        draw.text((x + (cell_w - text_w) / 2, y + qr_size + caption_h // 4), caption, fill=0, font=font)
+
+    return sheet.size, sheet.tobytes()
+
+
+class LabelRenderer:
+    """
+    Printable sheets of qr labels (A4, columns x rows labels per sheet), as pdf or png.
+
+    Sheets are rendered in parallel in a per-process pool of worker processes. The output
+    is stored in a content-addressed disk cache, the key is the hash of the labels and the
+    layout, so repeated requests for the same codes are served from disk. The cache is bounded
+    by size and age, least recently used files are removed first (see prune).
+    """
+    FORMATS = {"pdf": "application/pdf", "png": "image/png"}
+    CACHE_VERSION = 1
+    PRUNE_INTERVAL = 60 #seconds, min. time between two prunes of a process after a write
+    MIN_AGE = 60 #seconds, recently used files are never removed, they may be in use by a response
+
+    def __init__(self, app=None):
+        self.layout = {"columns": 4, "rows": 6, "dpi": 150}
+        self.workers = os.cpu_count() or 2
+        self.cache_dir = os.path.join(tempfile.gettempdir(), "storage-manager-labels")
+        self.cache_max_bytes = 512 * 1024 * 1024
+        self.cache_max_age = 7 * 24 * 3600
+        self._last_prune = 0.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def __repr__(self) -> str:
+        return f"LabelRenderer(layout={self.layout}, workers={self.workers})"
+
+    def init_app(self, app):
+        self.layout = {
+            "columns": app.config.get("LABEL_SHEET_COLUMNS", 4),
+            "rows": app.config.get("LABEL_SHEET_ROWS", 6),
+            "dpi": app.config.get("LABEL_SHEET_DPI", 150)
+        }
+        self.workers = app.config.get("LABEL_RENDER_WORKERS", None) or self.workers
+        self.cache_dir = app.config.get("LABEL_CACHE_DIR", None) or self.cache_dir
+        self.cache_max_bytes = app.config.get("LABEL_CACHE_MAX_MB", 512) * 1024 * 1024
+        self.cache_max_age = app.config.get("LABEL_CACHE_MAX_AGE", 7 * 24 * 3600)
+        self.shutdown()
+        app.extensions["label_renderer"] = self
+
+    @property
+    def per_sheet(self) -> int:
+        return self.layout["columns"] * self.layout["rows"]
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    # spawn, the api worker runs background threads that must not be forked
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                    self._pid = pid
+        return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._pid = None
+
+    def get_cache_path(self, labels: list, fmt: str, page: int = None) -> str:
+        key = hashlib.sha256(json.dumps(
+            {"v": self.CACHE_VERSION, "layout": self.layout, "labels": labels, "format": fmt, "page": page}
+        ).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def render(self, labels: list, fmt: str = "pdf", page: int = None) -> str:
+        """
+        render the labels and returns the path of the file in the cache.
+        labels -> list of (qrcode_text, caption). pdf includes all the sheets, png only the sheet <page> (1-based)
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"invalid format: {fmt}")
+
+        labels = [list(label) for label in labels]
+        sheets = [labels[i:i + self.per_sheet] for i in range(0, len(labels), self.per_sheet)]
+        if fmt == "png":
+            page = min(max(page or 1, 1), len(sheets))
+            sheets = sheets[page - 1:page]
+        else:
+            page = None
+
+        path = self.get_cache_path(labels, fmt, page)
+        try:
+            os.utime(path)  # mtime is the last use of the file
+            logger.debug(f"label sheet served from cache: {path}")
+            return path
+        except FileNotFoundError:
+            pass
+
+        from PIL import Image
+        images = [
+            Image.frombytes("L", size, raw)
+            for size, raw in self._get_executor().map(render_sheet, sheets, [self.layout] * len(sheets))
+        ]
+        buffer = io.BytesIO()
+        if fmt == "pdf":
+            images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=self.layout["dpi"])
+        else:
+            images[0].save(buffer, "PNG", optimize=True)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)  # atomic, concurrent requests never read a partial file
+
+        if time.time() - self._last_prune > self.PRUNE_INTERVAL:
+            self._last_prune = time.time()
+            try:
+                self.prune()
+            except OSError as e:
+                logger.warning(f"label cache not pruned - {e}")
+        return path
+
+    def prune(self) -> tuple:
+        """
+        remove the cache files not used in <cache_max_age> seconds, and the least recently used ones until the
+        cache is smaller than <cache_max_bytes>. a limit of 0 disables it. files used in the last MIN_AGE seconds
+        are kept. leftovers of interrupted writes are removed after <MIN_AGE>.
+        returns (removed files, removed bytes)
+        """
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path, os.path.splitext(name)[1][1:] in self.FORMATS))
+
+        files.sort()  # least recently used first
+        total = sum(f[1] for f in files)
+        removed, removed_bytes = 0, 0
+        for mtime, size, path, is_sheet in files:
+            age = now - mtime
+            expired = not is_sheet or (self.cache_max_age and age > self.cache_max_age)
+            oversize = self.cache_max_bytes and total > self.cache_max_bytes
+            if age < self.MIN_AGE or not (expired or oversize):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by another worker
+                pass
+            total -= size
+            removed, removed_bytes = removed + 1, removed_bytes + size
+
+        if removed:
+            logger.info(f"label cache pruned, {removed} files ({removed_bytes} bytes) removed")
+        return removed, removed_bytes
+
+
+label_renderer = LabelRenderer()
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherBusy(Exception):
+    """raised when the hashing pool can't take more work in the configured wait time"""
+    pass
+
+
+class PasswordHasher:
+    """
+    Password hashing engine.
+
+    Hashing method and salt length are read from app.config, any method supported by
+    werkzeug.security is valid, ex: "pbkdf2:sha256:260000", "pbkdf2:sha512:310000".
+    Hashes are computed in a per-process thread pool (hashlib releases the GIL), and a bounded
+    semaphore limits the pending work, so a login storm can't take every worker thread of
+    the API. When the limit is reached, PasswordHasherBusy is raised after PASSWORD_HASH_WAIT seconds.
+    """
+
+    def __init__(self, app=None):
+        self.method = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+        self.salt_length = 16
+        self.workers = os.cpu_count() or 2
+        self.max_pending = self.workers * 4
+        self.wait = 5
+        self._executor = None
+        self._semaphore = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def __repr__(self) -> str:
+        return f"PasswordHasher(method={self.method}, workers={self.workers})"
+
+    @staticmethod
+    def normalize_method(method: str) -> str:
+        """adds the default number of iterations to pbkdf2 methods, ex: pbkdf2:sha256 -> pbkdf2:sha256:260000"""
+        parts = method.split(":")
+        if parts[0] == "pbkdf2":
+            if len(parts) == 1:
+                parts.append("sha256")
+            if len(parts) == 2:
+                parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        return ":".join(parts)
+
+    def init_app(self, app):
+        self.method = self.normalize_method(app.config.get("PASSWORD_HASH_METHOD", self.method))
+        self.salt_length = app.config.get("PASSWORD_SALT_LENGTH", self.salt_length)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", None) or self.workers
+        self.max_pending = app.config.get("PASSWORD_HASH_MAX_PENDING", None) or self.workers * 4
+        self.wait = app.config.get("PASSWORD_HASH_WAIT", self.wait)
+        self.shutdown()
+        app.extensions["password_hasher"] = self
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pw-hasher")
+                    self._semaphore = threading.BoundedSemaphore(self.max_pending)
+                    self._pid = pid
+        return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._pid = None
+
+    def _run(self, fn, *args):
+        executor = self._get_executor()
+        semaphore = self._semaphore
+        if not semaphore.acquire(timeout=self.wait):
+            logger.warning("password hasher is busy, request rejected")
+            raise PasswordHasherBusy("password service is busy, try again later")
+
+        try:
+            return executor.submit(fn, *args).result()
+        finally:
+            semaphore.release()
+
+    def hash(self, password: str, method: str = None, salt_length: int = None) -> str:
+        """hash a password with the configured method"""
+        return self._run(
+            generate_password_hash, password, method or self.method, salt_length or self.salt_length
+        )
+
+    def verify(self, pw_hash: str, password: str) -> bool:
+        """check a password against a stored hash"""
+        return self._run(check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """True if the stored hash was not generated with the current method and salt length"""
+        if pw_hash.count("$") < 2:
+            return True
+
+        method, salt, _ = pw_hash.split("$", 2)
+        return method != self.method or len(salt) != self.salt_length
+
+
+password_hasher = PasswordHasher()
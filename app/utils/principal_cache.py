@@ -0,0 +1,427 @@
+import json
+import logging
+import redis
+from app.extensions import db
+from app.models.main import User, Role, Company, RoleFunction, Plan
+from app.utils.cache_service import TTLCache
+from app.utils.redis_service import RedisClient, invalidation_listener
+
+logger = logging.getLogger(__name__)
+
+
+class RolePrincipal:
+    """
+    Compact snapshot of the role in a role-level access token.
+    The snapshot holds everything the authorization checks need. Any other attribute
+    (relationships, serializers, etc.) is read from the Role row, loaded on first access.
+    """
+
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+        self.id = snapshot["role_id"]
+        self.user_id = snapshot["user_id"]
+        self.company_id = snapshot["company_id"]
+        self.role_function_id = snapshot["role_function_id"]
+        self.level = snapshot["level"]
+        self._instance = None
+
+    def __repr__(self) -> str:
+        return f"RolePrincipal(role_id={self.id}, level={self.level})"
+
+    def __getattr__(self, name):
+        # only called for attributes not included in the snapshot
+        return getattr(self.instance, name)
+
+    @property
+    def instance(self) -> Role:
+        if self._instance is None:
+            self._instance = Role.get_role_by_id(self.id)
+        return self._instance
+
+    @property
+    def company(self) -> Company:
+        return Company.get_company_by_id(self.company_id)
+
+    @property
+    def user(self) -> User:
+        return User.get_user_by_id(self.user_id)
+
+    @property
+    def role_function(self) -> RoleFunction:
+        return RoleFunction.get_rolefunc_by_id(self.role_function_id)
+
+    @property
+    def plan_limits(self) -> dict:
+        limits = self.snapshot.get("plan_limits", None)
+        if limits is None:  # not included in stateless tokens
+            limits = self.company.plan.limits or {}
+        return limits
+
+    @property
+    def is_active(self) -> bool:
+        return self.snapshot["is_active"]
+
+    @property
+    def inv_accepted(self) -> bool:
+        return self.snapshot["inv_accepted"]
+
+    @property
+    def user_enabled(self) -> bool:
+        return self.snapshot["user_enabled"]
+
+    def is_enabled(self) -> bool:
+        return True if self.is_active and self.inv_accepted else False
+
+    @staticmethod
+    def get_snapshot(role_id: int) -> dict:
+        """build the snapshot of a role from the database, returns None if the role does not exists"""
+        row = db.session.query(
+            Role.id, Role.user_id, Role.company_id, Role.role_function_id, Role._isActive, Role._inv_accepted,
+            RoleFunction.level, User._email_confirmed, User._signup_completed, Plan.limits
+        ).select_from(Role).join(Role.role_function).join(Role.user).join(Role.company).join(Company.plan).\
+            filter(Role.id == role_id).first()
+
+        if row is None:
+            return None
+
+        return {
+            "role_id": row[0],
+            "user_id": row[1],
+            "company_id": row[2],
+            "role_function_id": row[3],
+            "is_active": bool(row[4]),
+            "inv_accepted": bool(row[5]),
+            "level": row[6],
+            "user_enabled": bool(row[7] and row[8]),
+            "plan_limits": row[9] or {}
+        }
+
+
+class UserPrincipal:
+    """
+    Compact snapshot of the user in a user-level access token.
+    Attributes not included in the snapshot are read from the User row, loaded on first access.
+    """
+
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+        self.id = snapshot["user_id"]
+        self.email = snapshot["email"]
+        self._instance = None
+
+    def __repr__(self) -> str:
+        return f"UserPrincipal(user_id={self.id})"
+
+    def __getattr__(self, name):
+        return getattr(self.instance, name)
+
+    @property
+    def instance(self) -> User:
+        if self._instance is None:
+            self._instance = User.get_user_by_id(self.id)
+        return self._instance
+
+    def is_enabled(self) -> bool:
+        return self.snapshot["enabled"]
+
+    @staticmethod
+    def get_snapshot(user_id: int) -> dict:
+        """build the snapshot of an user from the database, returns None if the user does not exists"""
+        row = db.session.query(User.id, User._email, User._email_confirmed, User._signup_completed).\
+            filter(User.id == user_id).first()
+
+        if row is None:
+            return None
+
+        return {
+            "user_id": row[0],
+            "email": row[1],
+            "enabled": bool(row[2] and row[3])
+        }
+
+
+class PrincipalCache:
+    """
+    Cache of role and user snapshots used by the route decorators.
+
+    Snapshots are stored in a per-worker TTLCache and, optionally, in redis so all the
+    workers share them. Redis keys include a schema version, so a change in the snapshot
+    format never reads old entries. Invalidations are published in the invalidation channel.
+
+    Each id has a version counter in redis, incremented by every invalidation. A snapshot is
+    stored with the version read before loading it from the database, and only if that version
+    is still current, so a reader that loaded the row before a concurrent update can't store
+    its stale snapshot after the invalidation.
+    """
+    KEY_VERSION = "v2"
+    # KEYS: version, snapshot - ARGV: expected version, snapshot, ttl
+    # the version key outlives the snapshots written with it, so it never resets to a used value
+    SET_IF_CURRENT = """
+        local version = redis.call('GET', KEYS[1]) or '0'
+        if version ~= ARGV[1] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], version, 'EX', tonumber(ARGV[3]) * 2)
+        redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+        return 1
+    """
+    ROLE = "role"
+    USER = "user"
+
+    def __init__(self):
+        self.enabled = False
+        self.use_redis = False
+        self.redis_ttl = 600
+        self._caches = {self.ROLE: TTLCache(), self.USER: TTLCache()}
+        for namespace, cache in self._caches.items():
+            invalidation_listener.register(
+                f"principal-{namespace}", self._get_local_handler(cache), on_reset=cache.clear
+            )
+
+    def __repr__(self) -> str:
+        return f"PrincipalCache(enabled={self.enabled}, use_redis={self.use_redis})"
+
+    @staticmethod
+    def _get_local_handler(cache: TTLCache):
+        def handler(key: str):
+            try:
+                cache.delete(int(key))
+            except ValueError:
+                cache.clear()
+        return handler
+
+    def init_app(self, app):
+        self.enabled = app.config.get("PRINCIPAL_CACHE_ENABLED", False)
+        self.use_redis = app.config.get("PRINCIPAL_CACHE_REDIS", False)
+        self.redis_ttl = app.config.get("PRINCIPAL_CACHE_REDIS_TTL", 600)
+        for cache in self._caches.values():
+            cache.configure(
+                maxsize=app.config.get("PRINCIPAL_CACHE_SIZE", 2048),
+                ttl=app.config.get("PRINCIPAL_CACHE_TTL", 60)
+            )
+
+    def _redis_key(self, namespace: str, _id: int) -> str:
+        return f"principal:{self.KEY_VERSION}:{namespace}:{_id}"
+
+    def _version_key(self, namespace: str, _id: int) -> str:
+        return f"principal:{self.KEY_VERSION}:{namespace}:{_id}:version"
+
+    def _get_snapshot(self, namespace: str, _id: int, loader) -> dict:
+        if not self.enabled:
+            return loader(_id)
+
+        cache = self._caches[namespace]
+        local = invalidation_listener.is_subscribed()
+        if local:
+            snapshot = cache.get(_id)
+            if snapshot is not None:
+                return snapshot
+
+        stamp = cache.stamp()
+        snapshot, version = None, None
+        if self.use_redis:
+            try:
+                with RedisClient().get_client().pipeline(transaction=False) as pipe:
+                    pipe.get(self._version_key(namespace, _id))
+                    pipe.get(self._redis_key(namespace, _id))
+                    version, raw = pipe.execute()
+                version = int(version or 0)
+                entry = json.loads(raw) if raw is not None else None
+                if entry is not None and entry.get("version") == version:
+                    snapshot = entry["snapshot"]
+            except redis.RedisError as re:
+                version = None
+                logger.warning(f"principal cache not available - {re}")
+
+        if snapshot is None:
+            snapshot = loader(_id)
+            if snapshot is None:
+                return None
+
+            if version is not None:  # version read before loading the row
+                try:
+                    RedisClient().get_client().eval(
+                        self.SET_IF_CURRENT, 2, self._version_key(namespace, _id), self._redis_key(namespace, _id),
+                        version, json.dumps({"version": version, "snapshot": snapshot}), self.redis_ttl
+                    )
+                except redis.RedisError as re:
+                    logger.warning(f"principal cache not available - {re}")
+
+        if local:
+            cache.set(_id, snapshot, stamp=stamp)
+
+        return snapshot
+
+    def get_role(self, role_id: int) -> RolePrincipal:
+        """returns the RolePrincipal of role_id, or None if the role does not exists"""
+        snapshot = self._get_snapshot(self.ROLE, role_id, RolePrincipal.get_snapshot)
+        return RolePrincipal(snapshot) if snapshot is not None else None
+
+    def get_user(self, user_id: int) -> UserPrincipal:
+        """returns the UserPrincipal of user_id, or None if the user does not exists"""
+        snapshot = self._get_snapshot(self.USER, user_id, UserPrincipal.get_snapshot)
+        return UserPrincipal(snapshot) if snapshot is not None else None
+
+    def _invalidate(self, namespace: str, ids: list) -> None:
+        if not self.enabled or not ids:
+            return
+
+        cache = self._caches[namespace]
+        for _id in ids:
+            cache.delete(_id)
+
+        try:
+            r = RedisClient().get_client()
+            with r.pipeline(transaction=False) as pipe:
+                if self.use_redis:
+                    for _id in ids:
+                        pipe.incr(self._version_key(namespace, _id))
+                        pipe.expire(self._version_key(namespace, _id), self.redis_ttl * 2)
+                    pipe.delete(*[self._redis_key(namespace, _id) for _id in ids])
+                for _id in ids:
+                    invalidation_listener.publish(pipe, f"principal-{namespace}", _id)
+                pipe.execute()
+        except redis.RedisError as re:
+            logger.error(f"principal cache invalidation failed - {re}")
+
+    def invalidate_roles(self, *role_ids) -> None:
+        self._invalidate(self.ROLE, list(role_ids))
+
+    def invalidate_company(self, company_id: int) -> None:
+        """invalidate the snapshots of all the roles in a company"""
+        if not self.enabled:
+            return
+        role_ids = [r[0] for r in db.session.query(Role.id).filter(Role.company_id == company_id).all()]
+        self.invalidate_roles(*role_ids)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """invalidate the snapshot of an user and the snapshots of all its roles"""
+        if not self.enabled:
+            return
+        self._invalidate(self.USER, [user_id])
+        role_ids = [r[0] for r in db.session.query(Role.id).filter(Role.user_id == user_id).all()]
+        self.invalidate_roles(*role_ids)
+
+
+principal_cache = PrincipalCache()
+
+
+class PermissionEpochs:
+    """
+    Per-company permission epochs, used by the stateless authorization mode.
+
+    Role-level access tokens carry the role snapshot and the epoch of the company at the
+    time the token was created. Any change in the permissions of the company bumps the
+    epoch, which invalidates all the role tokens of that company at once. The epoch is
+    stored in redis and cached per worker.
+    """
+    NAMESPACE = "perm-epoch"
+    CLAIM = "perm_epoch"
+
+    def __init__(self):
+        self.enabled = False
+        self._cache = TTLCache()
+        invalidation_listener.register(
+            self.NAMESPACE, PrincipalCache._get_local_handler(self._cache), on_reset=self._cache.clear
+        )
+
+    def __repr__(self) -> str:
+        return f"PermissionEpochs(enabled={self.enabled})"
+
+    def init_app(self, app):
+        self.enabled = app.config.get("JWT_STATELESS_ROLES", False)
+        self._cache.configure(
+            maxsize=app.config.get("PRINCIPAL_CACHE_SIZE", 2048),
+            ttl=app.config.get("PRINCIPAL_CACHE_TTL", 60)
+        )
+
+    @staticmethod
+    def _redis_key(company_id: int) -> str:
+        return f"principal:{PrincipalCache.KEY_VERSION}:epoch:company:{company_id}"
+
+    def get(self, company_id: int) -> int:
+        """
+        get current epoch of a company.
+        raises redis.RedisError if redis-service is not available
+        """
+        local = invalidation_listener.is_subscribed()
+        if local:
+            epoch = self._cache.get(company_id)
+            if epoch is not None:
+                return epoch
+
+        stamp = self._cache.stamp()
+        epoch = int(RedisClient().get_client().get(self._redis_key(company_id)) or 0)
+        if local:
+            self._cache.set(company_id, epoch, stamp=stamp)
+
+        return epoch
+
+    def bump(self, company_id: int, strict: bool = True) -> bool:
+        """
+        invalidates all the role-level access tokens of a company. call it before committing a permission change
+        (strict), so the change is not saved if the tokens can't be revoked, and again after the commit (strict=False)
+        for the tokens created in between.
+        raises redis.RedisError if the epoch could not be updated and <strict>, the tokens are still valid.
+        returns False if the epoch could not be updated and not <strict>
+        """
+        if not self.enabled:
+            return True
+
+        self._cache.delete(company_id)
+        try:
+            r = RedisClient().get_client()
+            with r.pipeline(transaction=False) as pipe:
+                pipe.incr(self._redis_key(company_id))
+                invalidation_listener.publish(pipe, self.NAMESPACE, company_id)
+                pipe.execute()
+        except redis.RedisError as re:
+            logger.error(f"permission epoch of company-{company_id} not updated - {re}")
+            if strict:
+                raise redis.RedisError(
+                    f"the access tokens of company-{company_id} could not be revoked, changes were not saved - {re}"
+                ) from re
+            return False
+
+        return True
+
+    def get_role_claims(self, role: Role) -> dict:
+        """additional claims for a role-level access token. Empty if the stateless mode is disabled"""
+        if not self.enabled:
+            return {}
+
+        try:
+            epoch = self.get(role.company_id)
+        except redis.RedisError as re:
+            logger.warning(f"stateless role token not available - {re}")
+            return {}
+
+        return {
+            "company_id": role.company_id,
+            "role_function_id": role.role_function_id,
+            "role_level": role.role_function.level,
+            self.CLAIM: epoch
+        }
+
+    def get_role(self, claims: dict) -> RolePrincipal:
+        """
+        build a RolePrincipal from the claims of a stateless token.
+        returns None if the epoch in the token is not the current epoch of the company
+        raises redis.RedisError if redis-service is not available
+        """
+        if claims[self.CLAIM] != self.get(claims["company_id"]):
+            return None
+
+        return RolePrincipal({
+            "role_id": claims["role_id"],
+            "user_id": claims["user_id"],
+            "company_id": claims["company_id"],
+            "role_function_id": claims["role_function_id"],
+            "level": claims["role_level"],
+            "is_active": True,  # tokens are only created for enabled roles
+            "inv_accepted": True,
+            "user_enabled": True
+        })
+
+
+permission_epochs = PermissionEpochs()
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import math
+import time
+import redis
+from flask import request
+from app.utils.helpers import StringHelpers
+from app.utils.redis_service import RedisClient
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """raised when a request exceeds one of the limits of an endpoint"""
+
+    def __init__(self, rule: str, key: str, limit: int, window: int, retry_after: int):
+        Exception.__init__(self, f"rate limit exceeded - rule: {rule}, key: {key}, {limit} requests per {window}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Sliding-window rate limiter backed by the shared redis.
+
+    Every rule counts requests in fixed windows and estimates the sliding window with the
+    weighted count of the previous window:
+        count = previous * (1 - elapsed / window) + current
+
+    Limits are read from app.config["RATELIMIT_RULES"], one entry per endpoint:
+        "login": [("ip", 30, 60), ("email", 10, 300)] -> (key, limit, window in seconds)
+    valid keys are "ip", "email" and "company". A key not present in the request is skipped.
+    All the counters of a request are updated in a single pipeline. If redis is not
+    available the request is allowed (fail-open).
+    """
+    PREFIX = "ratelimit"
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.rules = {}
+        if app is not None:
+            self.init_app(app)
+
+    def __repr__(self) -> str:
+        return f"RateLimiter(enabled={self.enabled}, rules={list(self.rules.keys())})"
+
+    def init_app(self, app):
+        self.enabled = app.config.get("RATELIMIT_ENABLED", False)
+        self.rules = app.config.get("RATELIMIT_RULES", {})
+        app.extensions["rate_limiter"] = self
+
+    def get_key_value(self, key: str, claims: dict = None) -> str:
+        """read the value of a rule key from current request, returns None if the value is not present"""
+        claims = claims or {}
+        if key == "ip":  # behind a proxy, remote_addr is set by ProxyFix (RATELIMIT_TRUST_PROXY)
+            return request.remote_addr
+
+        body = request.get_json(silent=True) if request.is_json else None
+        body = body if isinstance(body, dict) else {}
+
+        if key == "email":
+            value = body.get("email", None) or request.args.get("email", None) or claims.get("sub", None)
+            return StringHelpers(value).email_normalized if isinstance(value, str) else None
+
+        if key == "company":
+            value = body.get("company_id", None) or claims.get("company_id", None)
+            return str(value) if value is not None else None
+
+        raise ValueError(f"invalid rate limit key: {key}")
+
+    def _redis_key(self, rule: str, key: str, value: str, window: int, window_start: int) -> str:
+        digest = hashlib.sha1(value.encode()).hexdigest()[:20]  # no emails or ips stored in redis
+        return f"{self.PREFIX}:{rule}:{key}:{window}:{digest}:{window_start}"
+
+    @staticmethod
+    def get_retry_after(previous: int, current: int, limit: int, window: int, elapsed: float) -> int:
+        """seconds until a new request fits in the limit. current includes the rejected requests"""
+        if current < limit and previous > 0:  # enough once the previous window loses weight
+            wait = window * (1 - (limit - current - 1) / previous) - elapsed
+        else:  # wait for the next window, and for the current window to lose weight
+            wait = (window - elapsed) + max(0, window * (1 - (limit - 1) / current))
+        return max(1, math.ceil(wait))
+
+    def hit(self, rule: str, claims: dict = None) -> None:
+        """
+        count a request in all the limits of a rule.
+        raises RateLimitExceeded if any of the limits is exceeded
+        """
+        if not self.enabled or rule not in self.rules:
+            return
+
+        now = time.time()
+        checks = []
+        for key, limit, window in self.rules[rule]:
+            value = self.get_key_value(key, claims)
+            if not value:
+                continue
+            window_start = int(now // window) * window
+            checks.append((key, limit, window, now - window_start,
+                self._redis_key(rule, key, value, window, window_start),
+                self._redis_key(rule, key, value, window, window_start - window)
+            ))
+
+        if not checks:
+            return
+
+        try:
+            with RedisClient().get_client().pipeline(transaction=False) as pipe:
+                for _, _, window, _, current_key, previous_key in checks:
+                    pipe.incr(current_key)
+                    pipe.expire(current_key, window * 2)
+                    pipe.get(previous_key)
+                results = pipe.execute()
+        except redis.RedisError as re:
+            logger.warning(f"rate limiter not available, request allowed - {re}")
+            return
+
+        for i, (key, limit, window, elapsed, _, _) in enumerate(checks):
+            current, _, previous = results[i * 3: i * 3 + 3]
+            current, previous = int(current), int(previous or 0)
+            count = previous * (1 - elapsed / window) + current
+            if count > limit:
+                raise RateLimitExceeded(
+                    rule, key, limit, window, self.get_retry_after(previous, current, limit, window, elapsed)
+                )
+
+
+rate_limiter = RateLimiter()
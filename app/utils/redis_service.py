@@ -2,26 +2,380 @@ import logging
 import redis
 import os
 import datetime
+import threading
+import time
 from app.utils.helpers import DateTimeHelpers
+from app.utils.cache_service import TTLCache
 from app.utils.func_decorators import app_logger
 
 logger = logging.getLogger(__name__)
 
+
+class RedisPool:
+    """
+    Process-wide redis connection pool.
+
+    a single pool is shared by every RedisClient in the worker process. The pool is
+    created on first use and re-created if the process id changes (fork), so gunicorn
+    workers never share sockets with the master process.
+    """
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.settings = self._get_settings({})
+        if app is not None:
+            self.init_app(app)
+
+    def __repr__(self) -> str:
+        return f"RedisPool(pid={self._pid})"
+
+    @staticmethod
+    def _get_settings(config) -> dict:
+        return {
+            "host": config.get("REDIS_HOST", os.environ.get("REDIS_HOST", "localhost")),
+            "port": int(config.get("REDIS_PORT", os.environ.get("REDIS_PORT", 6379))),
+            "password": config.get("REDIS_PASSWORD", os.environ.get("REDIS_PASSWORD", None)),
+            "max_connections": config.get("REDIS_MAX_CONNECTIONS", 20),
+            "timeout": config.get("REDIS_POOL_TIMEOUT", 2),
+            "socket_timeout": config.get("REDIS_SOCKET_TIMEOUT", 2),
+            "socket_connect_timeout": config.get("REDIS_SOCKET_CONNECT_TIMEOUT", 2),
+            "health_check_interval": config.get("REDIS_HEALTH_CHECK_INTERVAL", 30),
+            "socket_keepalive": config.get("REDIS_SOCKET_KEEPALIVE", True)
+        }
+
+    def init_app(self, app):
+        """read pool settings from app.config. the pool itself is created lazily in each process"""
+        self.settings = self._get_settings(app.config)
+        self.disconnect()
+        app.extensions["redis_pool"] = self
+
+    def get_pool(self) -> redis.ConnectionPool:
+        """returns the connection pool of the current process"""
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    logger.debug(f"creating redis connection pool for pid: {pid}")
+                    self._pool = redis.BlockingConnectionPool(**self.settings)
+                    self._pid = pid
+
+        return self._pool
+
+    def disconnect(self) -> None:
+        """close all connections of the current pool"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.disconnect()
+            self._pool = None
+            self._pid = None
+
+
+redis_pool = RedisPool()
+
+
+class InvalidationListener:
+    """
+    Background thread subscribed to the invalidation channel in redis.
+
+    messages published in the channel have the format "<namespace>:<key>". Every local
+    cache registers a handler for its namespace, so a change made by any worker (in any
+    node) is propagated to the caches of all the workers within milliseconds.
+    While the listener is not subscribed, local caches must not be trusted.
+    """
+    RETRY_MAX_WAIT = 30  # seconds
+
+    def __init__(self, channel: str = "invalidations"):
+        self.channel = channel
+        self._handlers = {}
+        self._reset_handlers = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+
+    def __repr__(self) -> str:
+        return f"InvalidationListener(channel={self.channel})"
+
+    def init_app(self, app):
+        self.channel = app.config.get("REDIS_INVALIDATION_CHANNEL", self.channel)
+
+    def register(self, namespace: str, handler, on_reset=None) -> None:
+        """
+        register a handler for the messages of a namespace.
+        * handler(key:str) is called for each message
+        * on_reset() is called each time the subscription is lost
+        """
+        self._handlers[namespace] = handler
+        if on_reset is not None and on_reset not in self._reset_handlers:
+            self._reset_handlers.append(on_reset)
+
+    def publish(self, client: redis.Redis, namespace: str, key) -> None:
+        client.publish(self.channel, f"{namespace}:{key}")
+
+    def is_subscribed(self) -> bool:
+        """starts the listener in the current process if needed, returns True if the subscription is active"""
+        if self._pid != os.getpid():
+            self._start()
+
+        return self._subscribed.is_set()
+
+    def _start(self) -> None:
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+
+            self._subscribed = threading.Event()
+            self._reset()
+            self._thread = threading.Thread(target=self._run, name="redis-invalidation-listener", daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def _reset(self) -> None:
+        for handler in self._reset_handlers:
+            handler()
+
+    def _dispatch(self, data) -> None:
+        message = data.decode("utf-8") if isinstance(data, bytes) else str(data)
+        namespace, _, key = message.partition(":")
+        handler = self._handlers.get(namespace, None)
+        if handler is not None:
+            handler(key)
+
+    def _run(self) -> None:
+        wait = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = RedisClient().get_client().pubsub()
+                pubsub.subscribe(self.channel)
+                while True:
+                    msg = pubsub.get_message(timeout=1.0)
+                    if msg is None:
+                        continue
+                    if msg["type"] == "subscribe":
+                        self._subscribed.set()
+                        wait = 1
+                    elif msg["type"] == "message":
+                        self._dispatch(msg["data"])
+
+            except redis.RedisError as re:
+                logger.warning(f"invalidation listener disconnected: {re}")
+
+            except Exception as e:
+                logger.error(f"invalidation listener error: {e}", exc_info=True)
+
+            self._subscribed.clear()
+            self._reset()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except redis.RedisError:
+                    pass
+
+            time.sleep(wait)
+            wait = min(wait * 2, self.RETRY_MAX_WAIT)
+
+
+invalidation_listener = InvalidationListener()
+
+
+class BlocklistCache:
+    """
+    Per-worker cache of jti values known to be NOT revoked.
+    Entries are evicted by the messages published in the invalidation channel when a
+    jwt is added to the blocklist.
+    """
+    NAMESPACE = "jti"
+
+    def __init__(self):
+        self.enabled = False
+        self._cache = TTLCache()
+        invalidation_listener.register(self.NAMESPACE, self._cache.delete, on_reset=self._cache.clear)
+
+    def __repr__(self) -> str:
+        return f"BlocklistCache(enabled={self.enabled}, cache={self._cache})"
+
+    def init_app(self, app):
+        self.enabled = app.config.get("JWT_BLOCKLIST_CACHE_ENABLED", False)
+        self._cache.configure(
+            maxsize=app.config.get("JWT_BLOCKLIST_CACHE_SIZE", 10000),
+            ttl=app.config.get("JWT_BLOCKLIST_CACHE_TTL", 300)
+        )
+
+    def is_revoked(self, client: redis.Redis, jti: str) -> bool:
+        """check if a jti is in the blocklist. Redis is only reached on cache misses"""
+        if not self.enabled or not invalidation_listener.is_subscribed():
+            return client.get(jti) is not None
+
+        if self._cache.get(jti, False):
+            return False
+
+        stamp = self._cache.stamp()
+        revoked = client.get(jti) is not None
+        if not revoked:
+            self._cache.set(jti, True, stamp=stamp)
+
+        return revoked
+
+
+blocklist_cache = BlocklistCache()
+
+
+class TokenGenerations:
+    """
+    Per-user and per-company token generation counters.
+
+    Access tokens carry the generation of its user ("user_gen") and, in role-level tokens,
+    the generation of the company ("company_gen") at the time they were created. A token
+    with a generation lower than the current one is revoked, so all the sessions of an user
+    or of a company are revoked with a single INCR. Current generations are cached per worker
+    and evicted by the messages published in the invalidation channel.
+    """
+    NAMESPACE = "token-gen"
+    USER = "user"
+    COMPANY = "company"
+    CLAIMS = {USER: "user_gen", COMPANY: "company_gen"}
+
+    def __init__(self):
+        self.enabled = False
+        self._cache = TTLCache()
+        invalidation_listener.register(self.NAMESPACE, self._cache.delete, on_reset=self._cache.clear)
+
+    def __repr__(self) -> str:
+        return f"TokenGenerations(enabled={self.enabled}, cache={self._cache})"
+
+    def init_app(self, app):
+        self.enabled = app.config.get("JWT_TOKEN_GENERATIONS_ENABLED", False)
+        self._cache.configure(
+            maxsize=app.config.get("JWT_BLOCKLIST_CACHE_SIZE", 10000),
+            ttl=app.config.get("JWT_BLOCKLIST_CACHE_TTL", 300)
+        )
+
+    @staticmethod
+    def _redis_key(cache_key: str) -> str:
+        return f"jwt:gen:{cache_key}"
+
+    def get_many(self, client: redis.Redis, cache_keys: list) -> dict:
+        """
+        current generation of each key, ex: ["user:1", "company:2"] -> {"user:1": 0, "company:2": 3}
+        raises redis.RedisError if redis-service is not available
+        """
+        local = invalidation_listener.is_subscribed()
+        generations = {}
+        missing = []
+        for cache_key in cache_keys:
+            gen = self._cache.get(cache_key) if local else None
+            if gen is None:
+                missing.append(cache_key)
+            else:
+                generations[cache_key] = gen
+
+        if missing:
+            stamp = self._cache.stamp()
+            values = client.mget([self._redis_key(k) for k in missing])
+            for cache_key, value in zip(missing, values):
+                generations[cache_key] = int(value or 0)
+                if local:
+                    self._cache.set(cache_key, generations[cache_key], stamp=stamp)
+
+        return generations
+
+    def get_claims(self, user_id: int, company_id: int = None) -> dict:
+        """
+        generation claims for a new access token. Empty if token generations are disabled.
+        company_id is only given for role-level tokens, customer tokens are not revoked with the company.
+        if redis-service is not available the claims have generation 0: the token is issued, and it is
+        revoked by the next INCR of its user or company, or as soon as redis is back if it was revoked before.
+        """
+        if not self.enabled:
+            return {}
+
+        keys = {self.USER: f"{self.USER}:{user_id}"}
+        if company_id is not None:
+            keys[self.COMPANY] = f"{self.COMPANY}:{company_id}"
+
+        try:
+            generations = self.get_many(RedisClient().get_client(), list(keys.values()))
+        except redis.RedisError as re:
+            logger.warning(f"token generations not available, token issued with generation 0 - {re}")
+            generations = dict.fromkeys(keys.values(), 0)
+
+        claims = {self.CLAIMS[kind]: generations[cache_key] for kind, cache_key in keys.items()}
+        if company_id is not None:
+            claims["company_id"] = company_id
+        return claims
+
+    def is_revoked(self, client: redis.Redis, jwt_payload: dict) -> bool:
+        """True if the generation of any of the claims in the token is not current"""
+        if not self.enabled:
+            return False
+
+        keys = {}
+        if self.CLAIMS[self.USER] in jwt_payload and "user_id" in jwt_payload:
+            keys[f"{self.USER}:{jwt_payload['user_id']}"] = jwt_payload[self.CLAIMS[self.USER]]
+        if jwt_payload.get("role_access_token", False) and self.CLAIMS[self.COMPANY] in jwt_payload \
+                and "company_id" in jwt_payload:
+            keys[f"{self.COMPANY}:{jwt_payload['company_id']}"] = jwt_payload[self.CLAIMS[self.COMPANY]]
+
+        if not keys:
+            return False  # tokens created before generations were enabled
+
+        generations = self.get_many(client, list(keys.keys()))
+        return any(gen < generations[cache_key] for cache_key, gen in keys.items())
+
+    def _revoke(self, cache_key: str) -> tuple:
+        self._cache.delete(cache_key)
+        try:
+            r = RedisClient().get_client()
+            with r.pipeline(transaction=False) as pipe:
+                pipe.incr(self._redis_key(cache_key))
+                invalidation_listener.publish(pipe, self.NAMESPACE, cache_key)
+                pipe.execute()
+        except redis.RedisError as re:
+            return False, {"token-generations": f"{re}"}
+
+        return True, f"all sessions of {cache_key} revoked"
+
+    @app_logger(logger)
+    def revoke_user(self, user_id: int) -> tuple:
+        """
+        revoke all the access tokens of an user
+        * returns tuple -> (success:bool, msg:string)
+        """
+        return self._revoke(f"{self.USER}:{user_id}")
+
+    @app_logger(logger)
+    def revoke_company(self, company_id: int) -> tuple:
+        """
+        revoke all the role-level access tokens of a company
+        * returns tuple -> (success:bool, msg:string)
+        """
+        return self._revoke(f"{self.COMPANY}:{company_id}")
+
+
+token_generations = TokenGenerations()
+
+
 class RedisClient:
 
-    REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
-    REDIS_PORT = os.environ.get("REDIS_PORT", "6379")
-    REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", None)
-    
     def __init__(self):
         pass
 
-    def set_client(self):
-        return redis.Redis(
-            host=self.REDIS_HOST,
-            port=self.REDIS_PORT,
-            password=self.REDIS_PASSWORD
-        )
+    def get_client(self) -> redis.Redis:
+        """returns a redis client bound to the process-wide connection pool"""
+        return redis.Redis(connection_pool=redis_pool.get_pool())
+
+    def is_jwt_revoked(self, jwt_payload: dict) -> bool:
+        """
+        check if a jwt has been revoked.
+        raises redis.RedisError if redis-service is not available
+        """
+        client = self.get_client()
+        return token_generations.is_revoked(client, jwt_payload) or \
+            blocklist_cache.is_revoked(client, jwt_payload["jti"])
 
     @app_logger(logger)
     def add_jwt_to_blocklist(self, claims) -> tuple:
@@ -29,7 +383,7 @@ class RedisClient:
         function to save a jwt in redis
         * returns tuple -> (success:bool, msg:string)
         """
-        r = self.set_client()
+        r = self.get_client()
         jti = claims["jti"]
         jwt_exp = DateTimeHelpers._epoch_utc_to_datetime(claims["exp"])
         now_date = datetime.datetime.utcnow()
@@ -42,7 +396,8 @@ class RedisClient:
 
         try:
             r.set(jti, "", ex=expires)
+            invalidation_listener.publish(r, BlocklistCache.NAMESPACE, jti)
         except redis.RedisError as re:
             return False, {"blocklist": f"{re}"}
         
-        return True, "JWT in blocklist"
\ No newline at end of file
+        return True, "JWT in blocklist"
@@ -1,11 +1,14 @@
 import logging
 import functools
+import redis
 from flask import request, abort
 from app.utils.exceptions import (
     APIException
 )
-from app.models.main import User, Role, Company
+from app.models.main import User, Company
 from app.utils.helpers import ErrorMessages as EM
+from app.utils.principal_cache import principal_cache, permission_epochs
+from app.utils.rate_limiter import rate_limiter, RateLimitExceeded
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
 
 logger = logging.getLogger(__name__)
@@ -47,6 +50,31 @@ def json_required(required: dict = None):
     return decorator
 
 
+# decorator to limit the requests to an endpoint, limits are defined in config.RATELIMIT_RULES[rule]
+def rate_limited(rule: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper_func(*args, **kwargs):
+            try:
+                claims = get_jwt()  # available when placed after a jwt decorator
+            except RuntimeError:
+                claims = {}
+
+            try:
+                rate_limiter.hit(rule, claims)
+            except RateLimitExceeded as e:
+                logger.info(f"{e} | path: {request.path}")
+                error = EM({e.key: f"too many requests, retry after {e.retry_after} seconds"}).too_many_requests
+                error["headers"] = {"Retry-After": str(e.retry_after)}
+                raise APIException.from_error(error)
+
+            return func(*args, **kwargs)
+
+        return wrapper_func
+
+    return decorator
+
+
 # decorator to grant access to general users.
 def role_required(level: int = 99):  # role-level requiried for the target endpoint
     def wrapper(fn):
@@ -60,15 +88,26 @@ def role_required(level: int = 99):  # role-level requiried for the target endpo
                 if role_id is None:
                     abort(500, "role_id not present in jwt")
 
-                role = Role.get_role_by_id(role_id)
+                role = None
+                if permission_epochs.enabled and claims.get(permission_epochs.CLAIM, None) is not None:
+                    try:
+                        role = permission_epochs.get_role(claims)
+                    except redis.RedisError as re:
+                        logger.warning(f"stateless authorization not available - {re}")
+                    else:
+                        if role is None:
+                            raise APIException.from_error(EM({"role": "role permissions have changed, login again"}).unauthorized)
+
+                if role is None:
+                    role = principal_cache.get_role(role_id)  # RolePrincipal
 
                 if role is None:
                     raise APIException.from_error(EM({"role": f"role-id-{role_id} not found"}).notFound)
                 
-                if not role.is_enabled or not role.user.is_enabled:
+                if not role.is_enabled() or not role.user_enabled:
                     raise APIException.from_error(EM({"user": "user-role has been disabled"}).user_not_active)
 
-                if role.role_function.level > level:
+                if role.level > level:
                     raise APIException.from_error(EM({"role-level": "current role does not have enough privileges"}).unauthorized)
 
                 kwargs['role'] = role
@@ -93,7 +132,7 @@ def user_required(customer:bool = False):
                 if user_id is None:
                     abort(500, "user_id not present in jwt")
 
-                user = User.get_user_by_id(user_id)
+                user = principal_cache.get_user(user_id)  # UserPrincipal
                 if user is None:
                     raise APIException.from_error(EM({"user": f"user-ID-{user_id} not found"}).notFound)
 
@@ -0,0 +1,98 @@
+"""
+Time and statements needed to delete a category subtree: Category.delete_subtree (set-based statements) compared
+with the previous path, the ORM delete-orphan cascade of Category.children. Each path deletes its own copy of
+a tree of <nodes> categories, with items and attributes. Needs DATABASE_URL.
+
+    python -m benchmarks.category_delete --nodes 5000 --branching 10 --items-per-node 1
+"""
+import argparse
+import time
+from sqlalchemy import event, text
+from benchmarks.common import create_bench_app, create_company, report
+
+
+def create_tree(company_id: int, nodes: int, branching: int, items_per_node: int) -> int:
+    """
+    tree of <nodes> categories, <branching> children per category (breadth first), with <items_per_node> items in
+    each category and one attribute on each child of the root. returns the id of the root
+    """
+    from app.extensions import db
+    from app.models.main import Attribute, Category, CategoryClosure, CategoryEffectiveAttribute, Item, attribute_category
+
+    ids = [row[0] for row in db.session.execute(
+        text("SELECT nextval('category_id_seq') FROM generate_series(1, :nodes)"), {"nodes": nodes}
+    )]
+    db.session.execute(Category.__table__.insert(), [
+        {"id": cat_id, "company_id": company_id, "name": f"node-{n}", "parent_id": ids[(n - 1) // branching] if n else None}
+        for n, cat_id in enumerate(ids)  # parents are inserted before their children
+    ])
+
+    attributes = [Attribute(company_id=company_id, name=f"attribute-{n}") for n in range(min(branching, nodes - 1))]
+    db.session.add_all(attributes)
+    db.session.flush()
+    if attributes:
+        db.session.execute(attribute_category.insert(), [
+            {"attribute_id": attribute.id, "category_id": cat_id} for attribute, cat_id in zip(attributes, ids[1:])
+        ])
+
+    if items_per_node:
+        db.session.execute(Item.__table__.insert(), [
+            {"company_id": company_id, "name": f"item-{cat_id}-{n}", "category_id": cat_id}
+            for cat_id in ids for n in range(items_per_node)
+        ])
+
+    CategoryClosure.rebuild(company_id)
+    CategoryEffectiveAttribute.rebuild(company_id)
+    db.session.commit()
+    return ids[0]
+
+
+def timed_delete(root_id: int, delete) -> dict:
+    """seconds and statements of delete(<root category>) and the commit, with an empty session"""
+    from app.extensions import db
+    from app.models.main import Category
+
+    db.session.expunge_all()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        start = time.perf_counter()
+        delete(db.session.query(Category).get(root_id))
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    assert db.session.query(Category).filter(Category.id == root_id).count() == 0
+    return {"seconds": round(elapsed, 3), "statements": len(statements)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--branching", type=int, default=10)
+    parser.add_argument("--items-per-node", type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_bench_app(database=True)
+    with app.app_context():
+        from app.extensions import db
+        company = create_company()
+        paths = {
+            "orm-cascade": db.session.delete,  # the previous path of DELETE /v1/company/categories/<id>
+            "delete-subtree": lambda category: category.delete_subtree(),
+        }
+        for path, delete in paths.items():
+            root_id = create_tree(company["company_id"], args.nodes, args.branching, args.items_per_node)
+            report(
+                "category_delete", path=path, nodes=args.nodes, items=args.nodes * args.items_per_node,
+                **timed_delete(root_id, delete)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Shared setup of the benchmarks.
+
+Benchmarks are run from the root of the repository, ex: python -m benchmarks.token_revocation
+- redis is read from the REDIS_* variables of app.config (default localhost:6379).
+- database benchmarks need DATABASE_URL, pointing to a scratch postgresql database. Its tables
+  are created if missing and filled with benchmark data, never use a real database.
+"""
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import uuid
+
+BENCH_ENV = {
+    "APP_SETTINGS": "app.config.TestingConfig",
+    "SECRET_KEY": "benchmark",
+    "JWT_SECRET_KEY": "benchmark",
+    "QR_SECRET_KEY": "benchmark",
+    "SMTP_API_URL": "http://localhost:8025/v3/smtp/email",
+    "SMTP_API_KEY": "benchmark",
+    "MAIL_MODE": "development",
+    "RATELIMIT_ENABLED": "false",
+}
+
+_app = None
+
+
+def get_database_url() -> str:
+    """DATABASE_URL of the scratch database, exits if it is not set"""
+    url = os.environ.get("DATABASE_URL", None)
+    if not url:
+        sys.exit("DATABASE_URL is required, it must point to a scratch postgresql database")
+    return url
+
+
+def create_bench_app(database: bool = False, **env):
+    """
+    application for the benchmarks and tests, one per process: the extensions (redis pool, invalidation
+    listener) are module-level instances, a second create_app() would reset them under the first one.
+    app.config reads the environment when it is imported, so <env> overrides (ex: RATELIMIT_ENABLED="false")
+    and DATABASE_URL only apply to the first call of a process.
+    """
+    global _app
+    if _app is None:
+        for key, value in BENCH_ENV.items():
+            os.environ.setdefault(key, value)
+        os.environ.update(env)
+        if database or os.environ.get("DATABASE_URL"):  # a later call of the process may need it
+            os.environ["DEVELOPMENT_DATABASE_URL"] = get_database_url()
+
+        from app import create_app
+        _app = create_app()
+
+    from app.extensions import db
+    app = _app
+    if database:
+        with app.app_context():
+            db.create_all()
+    return app
+
+
+def create_company(limits: dict = None) -> dict:
+    """
+    plan, company, enabled user and owner role (level 0) in the scratch database, call it in an app context.
+    returns {"company_id", "role_id", "user_id", "email"}
+    """
+    from app.extensions import db
+    from app.models.global_models import Plan, RoleFunction
+    from app.models.main import Company, Role, User
+    from app.utils.principal_cache import principal_cache
+
+    suffix = uuid.uuid4().hex[:12]
+    plan = Plan(name=f"benchmark-{suffix}", code=f"benchmark-{suffix}", limits=limits or {})
+    company = Company(name=f"benchmark-{suffix}", plan=plan)
+    user = User(email=f"{suffix}@example.com", _email_confirmed=True, _signup_completed=True)
+    user.set_unusable_password()
+    role_function = RoleFunction(name="benchmark owner", code=f"benchmark-{suffix}", level=0)
+    role = Role(user=user, company=company, role_function=role_function, _inv_accepted=True, _isActive=True)
+    db.session.add_all([plan, company, user, role_function, role])
+    db.session.commit()
+    principal_cache.invalidate_user(user.id)  # ids are reused when the scratch database is recreated
+
+    return {"company_id": company.id, "role_id": role.id, "user_id": user.id, "email": user.email}
+
+
+def get_role_headers(company: dict) -> dict:
+    """headers of a request with a role-level access token of create_company(), as issued by the login"""
+    from flask_jwt_extended import create_access_token
+    from app.extensions import db
+    from app.models.main import Role
+    from app.utils.principal_cache import permission_epochs
+    from app.utils.redis_service import token_generations
+
+    role = db.session.query(Role).get(company["role_id"])
+    token = create_access_token(identity=company["email"], additional_claims={
+        "user_access_token": True,
+        "role_access_token": True,
+        "user_id": company["user_id"],
+        "role_id": company["role_id"],
+        **permission_epochs.get_role_claims(role),
+        **token_generations.get_claims(company["user_id"], company["company_id"])
+    })
+    return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+
+def percentile(samples: list, p: float) -> float:
+    """nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples: list) -> dict:
+    """latency summary in milliseconds of a list of durations in seconds"""
+    total = sum(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "per_sec": round(len(samples) / total, 1) if total else None
+    }
+
+
+def measure(fn, repeat: int, warmup: int = 0) -> dict:
+    """run <fn> <repeat> times, returns the latency summary"""
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def report(name: str, **results) -> None:
+    """print one result as a json line, easy to compare between runs"""
+    print(json.dumps({"benchmark": name, **results}))
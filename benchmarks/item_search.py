@@ -0,0 +1,146 @@
+"""
+Latency of the ranked item search, GET /v1/company/items/?q=<term>, over a company with 1M items.
+Terms are brand names (rare words), brand names with a typo, common words, 2-letter terms and skus. Needs DATABASE_URL (with
+the pg_trgm extension available) and a running redis (authentication).
+
+    python -m benchmarks.item_search --items 1000000 --queries 60
+    python -m benchmarks.item_search --company-id <id> --role-id <id>   # reuse the items of a previous run
+"""
+import argparse
+import json
+import random
+import time
+from collections import defaultdict
+from urllib.parse import quote
+from sqlalchemy import text
+from benchmarks.common import create_bench_app, create_company, get_role_headers, report, summarize
+
+NOUNS = [
+    "tornillo", "tuerca", "arandela", "perno", "clavo", "bisagra", "manguera", "valvula", "tuberia", "codo",
+    "cable", "enchufe", "interruptor", "bombillo", "cinta", "pintura", "brocha", "rodillo", "lija", "martillo",
+    "destornillador", "alicate", "llave", "taladro", "broca", "sierra", "nivel", "escalera", "candado", "cerradura"
+]
+DETAILS = [
+    "galvanizado", "inoxidable", "hexagonal", "plastico", "aluminio", "bronce", "cobre", "reforzado", "industrial",
+    "electrico", "blanco", "negro", "rojo", "mate", "brillante", "corto", "largo", "grueso", "fino", "flexible"
+]
+SIZES = ["1/4", "3/8", "1/2", "3/4", "1", "2", "5mm", "8mm", "10mm", "12mm", "20cm", "1m", "2m", "5m", "10m"]
+
+
+def get_brands(count: int = 2000, seed: int = 7) -> list:
+    """pseudo words used as brand or model names, each one is in a few hundred items of 1M"""
+    rnd = random.Random(seed)
+    consonants, vowels = "bcdfglmnprstvz", "aeiou"
+    brands = set()
+    while len(brands) < count:
+        brands.add("".join(rnd.choice(consonants) + rnd.choice(vowels) for _ in range(rnd.randint(2, 4))))
+    return sorted(brands)
+
+
+BRANDS = get_brands()
+
+SEED_SQL = """
+    INSERT INTO item (
+        company_id, name, sku, description, _correlative, _images, pkg_sizes, pkg_weight, sale_price,
+        _name_normalized, _search_normalized
+    )
+    SELECT :company_id, w.name, w.sku, w.description, g, CAST(:images AS json), CAST(:pkg_sizes AS json), 0, 0,
+        lower(w.name), lower(w.name || ' ' || w.sku || ' ' || w.description)
+    FROM generate_series(:first, :last) AS g
+    CROSS JOIN LATERAL (
+        SELECT
+            (CAST(:nouns AS text[]))[1 + g % :n_nouns] || ' ' || (CAST(:brands AS text[]))[1 + (g::bigint * 7919) % :n_brands]
+                || ' ' || (CAST(:details AS text[]))[1 + (g / 7) % :n_details]
+                || ' ' || (CAST(:sizes AS text[]))[1 + (g / 131) % :n_sizes] AS name,
+            'SKU-' || lpad(g::text, 8, '0') AS sku,
+            (CAST(:details AS text[]))[1 + (g / 3) % :n_details] || ' ' || (CAST(:nouns AS text[]))[1 + (g / 11) % :n_nouns]
+                || ' para uso ' || (CAST(:details AS text[]))[1 + (g / 17) % :n_details] AS description
+    ) AS w
+"""
+
+
+def seed_items(company_id: int, count: int, chunk: int = 100000) -> None:
+    """<count> items with generated names, same normalization as Item.update_search_columns (ascii text)"""
+    from app.extensions import db
+    from app.utils.helpers import DefaultContent
+
+    params = {
+        "company_id": company_id,
+        "images": json.dumps({"images": [DefaultContent().item_image]}),
+        "pkg_sizes": json.dumps({"pkg_sizes": {"length": 0, "width": 0, "height": 0}}),
+        "nouns": NOUNS, "n_nouns": len(NOUNS),
+        "details": DETAILS, "n_details": len(DETAILS),
+        "sizes": SIZES, "n_sizes": len(SIZES),
+        "brands": BRANDS, "n_brands": len(BRANDS),
+    }
+    for first in range(1, count + 1, chunk):
+        start = time.perf_counter()
+        db.session.execute(text(SEED_SQL), {**params, "first": first, "last": min(first + chunk - 1, count)})
+        db.session.commit()
+        print(f"seeded {min(first + chunk - 1, count)}/{count} items ({time.perf_counter() - start:.1f}s)", flush=True)
+
+    db.session.execute(text("ANALYZE item"))
+    db.session.commit()
+
+
+def with_typo(word: str, rnd: random.Random) -> str:
+    i = rnd.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]  # swap two letters
+
+
+def get_terms(count: int, items: int, rnd: random.Random) -> list:
+    """
+    (kind, term) pairs. brands are in ~0.05% of the items, nouns in ~3% of them (worst case,
+    every match is ranked)
+    """
+    kinds = {
+        "brand": lambda: rnd.choice(BRANDS),
+        "brand-typo": lambda: with_typo(rnd.choice([b for b in BRANDS if len(b) >= 6]), rnd),
+        "noun-brand": lambda: f"{rnd.choice(NOUNS)} {rnd.choice(BRANDS)}",
+        "noun": lambda: rnd.choice(NOUNS),
+        "short": lambda: rnd.choice(NOUNS)[:2],
+        "sku": lambda: f"SKU-{rnd.randrange(1, items + 1):08d}",
+    }
+    names = list(kinds)
+    return [(kind, kinds[kind]()) for kind in (names[i % len(names)] for i in range(count))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=60)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--role-id", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    app = create_bench_app(database=True)
+    with app.app_context():
+        from app.extensions import db
+        from app.models.main import Role
+        if args.company_id is None:
+            company = create_company()
+            seed_items(company["company_id"], args.items)
+            print(f"items seeded in company-id {company['company_id']}, role-id {company['role_id']}")
+        else:
+            role = db.session.query(Role).get(args.role_id)
+            company = {"company_id": args.company_id, "role_id": role.id, "user_id": role.user_id, "email": role.user.email}
+        headers = get_role_headers(company)
+
+    client = app.test_client()
+    samples, empty = defaultdict(list), defaultdict(int)
+    for kind, term in get_terms(args.queries, args.items, random.Random(args.seed)):
+        start = time.perf_counter()
+        resp = client.get(f"/v1/company/items/?q={quote(term)}&limit={args.limit}", headers=headers)
+        samples[kind].append(time.perf_counter() - start)
+        assert resp.status_code == 200, resp.get_data(as_text=True)[:500]
+        empty[kind] += not resp.get_json()["data"]["items"]
+
+    for kind, values in samples.items():
+        report("item_search", items=args.items, kind=kind, empty_results=empty[kind], **summarize(values))
+    report("item_search", items=args.items, kind="all", **summarize([v for values in samples.values() for v in values]))
+
+
+if __name__ == "__main__":
+    main()
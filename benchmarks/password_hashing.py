@@ -0,0 +1,56 @@
+"""
+Logins/sec of the password verification for each hashing setting, with a login storm of
+concurrent clients. Each login is one verification in the hashing pool, the same work done
+by the login endpoints.
+
+    python -m benchmarks.password_hashing --methods pbkdf2:sha256:260000,pbkdf2:sha512:260000 --workers 2,4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import create_bench_app, report, summarize
+
+
+def storm(hasher, pw_hash: str, logins: int, clients: int) -> dict:
+    def login(_):
+        start = time.perf_counter()
+        assert hasher.verify(pw_hash, "benchmark-password")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        samples = list(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+
+    return {**summarize(samples), "per_sec": round(logins / elapsed, 1)}  # throughput with concurrent clients
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", default="pbkdf2:sha256:260000,pbkdf2:sha256:600000,pbkdf2:sha512:260000")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 2}", help="sizes of the hashing pool")
+    parser.add_argument("--logins", type=int, default=300)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent login requests")
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    from app.utils.password_service import password_hasher
+
+    for method in args.methods.split(","):
+        for workers in sorted({int(w) for w in args.workers.split(",")}):
+            app.config.update(
+                PASSWORD_HASH_METHOD=method, PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_MAX_PENDING=args.clients
+            )
+            password_hasher.init_app(app)
+            pw_hash = password_hasher.hash("benchmark-password")
+            report(
+                "password_hashing", method=password_hasher.method, workers=workers, clients=args.clients,
+                **storm(password_hasher, pw_hash, args.logins, args.clients)
+            )
+
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
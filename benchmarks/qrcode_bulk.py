@@ -0,0 +1,59 @@
+"""
+QR codes per second created by POST /v1/company/qrcodes (bulk insert, json and ndjson responses),
+compared with the previous path: one QRCode instance, INSERT and commit per code. Needs DATABASE_URL
+and a running redis (authentication).
+
+    python -m benchmarks.qrcode_bulk --count 5000 --loop-count 500
+"""
+import argparse
+import time
+from benchmarks.common import create_bench_app, create_company, get_role_headers, report
+
+
+def loop_path(company_id: int, count: int) -> list:
+    """the per-code path replaced by the bulk insert"""
+    from app.extensions import db
+    from app.models.main import QRCode
+
+    codes = []
+    for _ in range(count):
+        qrcode = QRCode(company_id=company_id)
+        db.session.add(qrcode)
+        db.session.commit()
+        codes.append(qrcode)
+    return [c.serialize() for c in codes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=5000, help="codes per bulk request")
+    parser.add_argument("--loop-count", type=int, default=500, help="codes created with the per-code path")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_bench_app(database=True)
+    with app.app_context():
+        company = create_company()
+        headers = get_role_headers(company)
+
+        start = time.perf_counter()
+        loop_path(company["company_id"], args.loop_count)
+        elapsed = time.perf_counter() - start
+        report("qrcode_bulk", path="loop", count=args.loop_count, seconds=round(elapsed, 3),
+               per_sec=round(args.loop_count / elapsed, 1))
+
+    client = app.test_client()
+    for fmt, extra in (("json", {}), ("ndjson", {"Accept": "application/x-ndjson"})):
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            resp = client.post("/v1/company/qrcodes", json={"count": args.count}, headers={**headers, **extra})
+            lines = resp.get_data().count(b"\n")  # consumes the stream
+            elapsed = time.perf_counter() - start
+            assert resp.status_code in (200, 201), resp.get_data(as_text=True)[:500]
+            assert fmt == "json" or lines == args.count
+            report("qrcode_bulk", path=f"bulk-{fmt}", count=args.count, seconds=round(elapsed, 3),
+                   per_sec=round(args.count / elapsed, 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Requests/sec of an authenticated endpoint, with and without the per-worker cache of the
+jwt blocklist. Needs a running redis.
+
+    python -m benchmarks.token_revocation --requests 5000
+"""
+import argparse
+import time
+from flask import jsonify
+from flask_jwt_extended import create_access_token, jwt_required
+from benchmarks.common import create_bench_app, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    from app.utils.redis_service import RedisClient, blocklist_cache, invalidation_listener
+
+    @app.route("/benchmark/protected")
+    @jwt_required()
+    def protected():
+        return jsonify({"ok": True})
+
+    RedisClient().get_client().ping()
+    with app.app_context():
+        token = create_access_token(identity="benchmark@example.com", additional_claims={"user_access_token": True})
+
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def request():
+        resp = client.get("/benchmark/protected", headers=headers)
+        assert resp.status_code == 200, resp.get_data(as_text=True)
+
+    for enabled in (False, True):
+        blocklist_cache.enabled = enabled
+        if enabled:  # the cache is bypassed until the listener is subscribed
+            deadline = time.time() + 5
+            while not invalidation_listener.is_subscribed() and time.time() < deadline:
+                time.sleep(0.05)
+
+        report("token_revocation", blocklist_cache=enabled, **measure(request, args.requests, warmup=100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Statement count of the item detail (Item.serialize_all). Runs against the scratch postgresql
+database of DATABASE_URL, skipped when it is not set.
+
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import unittest
+import uuid
+from sqlalchemy import event
+from benchmarks.common import create_bench_app
+
+MAX_STATEMENTS = 3
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL of a scratch database is required")
+class ItemDetailStatementsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_bench_app(database=True)
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+
+        from app.extensions import db
+        from app.models.global_models import Plan
+        from app.models.main import Company
+        suffix = uuid.uuid4().hex[:12]
+        plan = Plan(name=f"test-{suffix}", code=f"test-{suffix}")
+        cls.company = Company(name=f"test-{suffix}", plan=plan)
+        db.session.add(cls.company)
+        db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        from app.extensions import db
+        db.session.remove()
+        cls.ctx.pop()
+
+    def create_item(self, depth: int, attributes: int) -> int:
+        """item in a category <depth> levels deep, with a value for <attributes> attributes of its ancestors"""
+        from app.extensions import db
+        from app.models.main import Attribute, AttributeValue, Category, CategoryEffectiveAttribute, Item
+
+        parent = root = None
+        for level in range(depth):
+            parent = Category(company_id=self.company.id, name=f"level-{level}", parent=parent)
+            root = root or parent
+            db.session.add(parent)
+        db.session.flush()
+
+        item = Item(company_id=self.company.id, name=f"item-{depth}-{attributes}", category=parent)
+        db.session.add(item)
+        ancestor = parent
+        for n in range(attributes):
+            attribute = Attribute(company_id=self.company.id, name=f"attribute-{n}")
+            ancestor.attributes.append(attribute)  # spread over the ancestors, own and inherited attributes
+            item.attribute_values.append(AttributeValue(attribute=attribute, value=str(n)))
+            ancestor = ancestor.parent or parent
+
+        db.session.flush()
+        CategoryEffectiveAttribute.refresh(root.id)
+        db.session.commit()
+        item_id = item.id
+        db.session.expunge_all()
+        return item_id
+
+    def count_statements(self, item_id: int) -> tuple:
+        """(statements, payload) of the detail of an item, loaded as the endpoints do"""
+        from app.extensions import db
+        from app.models.main import Item
+
+        item = db.session.query(Item).get(item_id)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            payload = item.serialize_all()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+            db.session.rollback()
+
+        return len(statements), payload
+
+    def test_statements_do_not_grow_with_depth_or_attributes(self):
+        counts = {}
+        for depth, attributes in [(1, 0), (1, 1), (3, 5), (12, 1), (12, 30)]:
+            count, payload = self.count_statements(self.create_item(depth, attributes))
+            counts[(depth, attributes)] = count
+            self.assertEqual(len(payload["item_category"]["path"]), depth - 1)  # ancestors of the category
+            self.assertEqual(len([a for a in payload.get("item_attributes", []) if "attributeValue_ID" in a]), attributes)
+
+        self.assertLessEqual(max(counts.values()), MAX_STATEMENTS, counts)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Size and age limits of the label sheet cache (LabelRenderer.prune).
+
+    python -m pytest tests
+"""
+import os
+import tempfile
+import time
+import unittest
+from benchmarks.common import create_bench_app
+
+MB = 1024 * 1024
+
+
+class LabelCachePruneTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        create_bench_app()
+
+    def setUp(self):
+        from app.utils.label_service import LabelRenderer
+        self.tmp = tempfile.TemporaryDirectory()
+        self.renderer = LabelRenderer()
+        self.renderer.cache_dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add_file(self, name: str, size: int, last_use: float) -> str:
+        """cache file of <size> bytes, used <last_use> seconds ago"""
+        path = os.path.join(self.tmp.name, name[:2], name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        mtime = time.time() - last_use
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def remaining(self) -> list:
+        return sorted(name for _, _, names in os.walk(self.tmp.name) for name in names)
+
+    def test_least_recently_used_first(self):
+        self.renderer.cache_max_bytes, self.renderer.cache_max_age = 2 * MB, 0
+        self.add_file("aa.pdf", MB, last_use=3000)
+        self.add_file("bb.pdf", MB, last_use=1000)
+        self.add_file("cc.png", MB, last_use=2000)
+        self.assertEqual(self.renderer.prune(), (1, MB))
+        self.assertEqual(self.remaining(), ["bb.pdf", "cc.png"])
+
+    def test_max_age(self):
+        self.renderer.cache_max_bytes, self.renderer.cache_max_age = 0, 3600
+        self.add_file("aa.pdf", 10, last_use=7200)
+        self.add_file("bb.pdf", 10, last_use=600)
+        self.renderer.prune()
+        self.assertEqual(self.remaining(), ["bb.pdf"])
+
+    def test_recently_used_and_partial_files(self):
+        self.renderer.cache_max_bytes, self.renderer.cache_max_age = MB, 3600
+        self.add_file("aa.pdf", 2 * MB, last_use=5)  # in use by a response
+        self.add_file("bbtmp1234", 10, last_use=5)  # write in progress
+        self.add_file("cctmp5678", 10, last_use=600)  # interrupted write
+        self.renderer.prune()
+        self.assertEqual(self.remaining(), ["aa.pdf", "bbtmp1234"])
+
+
+if __name__ == "__main__":
+    unittest.main()
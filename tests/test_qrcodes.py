@@ -0,0 +1,51 @@
+"""
+Signed text of the qrcodes created before the _signed_text column (flask qrcodes sign backfill). Runs against
+the scratch postgresql database of DATABASE_URL, skipped when it is not set.
+
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import unittest
+from benchmarks.common import create_bench_app, create_company
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL of a scratch database is required")
+class QRCodeSignBackfillTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_bench_app(database=True)
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+        cls.company = create_company()
+
+    @classmethod
+    def tearDownClass(cls):
+        from app.extensions import db
+        db.session.remove()
+        cls.ctx.pop()
+
+    def test_unsigned_rows(self):
+        from app.extensions import db
+        from app.models.main import QRCode
+
+        qrcode = QRCode(company_id=self.company["company_id"])
+        db.session.add(qrcode)
+        db.session.commit()
+        signed_text = qrcode._signed_text
+        db.session.query(QRCode).filter(QRCode.id == qrcode.id).update({"_signed_text": None})  # row of a previous version
+        db.session.commit()
+
+        qrcode_id = qrcode.id
+        qrcode = db.session.query(QRCode).get(qrcode_id)
+        self.assertIsNone(qrcode._signed_text)
+        self.assertEqual(qrcode.serialize()["qrcode_text"], signed_text)  # signed on the fly until the backfill
+        self.assertEqual(QRCode.parse_qr(qrcode.signed_text), qrcode_id)
+
+        result = self.app.test_cli_runner().invoke(args=["qrcodes", "sign"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(db.session.query(QRCode).get(qrcode_id)._signed_text, signed_text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Stock ledger (ItemStock) of the inventory writes, checked with flask stock verify. Runs against the scratch
+postgresql database of DATABASE_URL and a running redis (authentication), skipped when DATABASE_URL is not set.
+
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import threading
+import time
+import unittest
+from sqlalchemy import text
+from benchmarks.common import create_bench_app, create_company, get_role_headers
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL of a scratch database is required")
+class InventoryDeleteLedgerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_bench_app(database=True)
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+        cls.company = create_company()
+        cls.headers = get_role_headers(cls.company)
+
+    @classmethod
+    def tearDownClass(cls):
+        from app.extensions import db
+        db.session.remove()
+        cls.ctx.pop()
+
+    def create_inventories(self, count: int, item_qtty: float = 2.0, item_cost: float = 10.0) -> tuple:
+        """acquisition with <count> available inventories in one container, and its ledger row. returns (acquisition_id, [inventory_id, ...])"""
+        from app.extensions import db
+        from app.models.main import Acquisition, Container, Inventory, Item, ItemStock, QRCode, Storage
+
+        company_id = self.company["company_id"]
+        storage = Storage(company_id=company_id, name="ledger-test")
+        item = Item(company_id=company_id, name="ledger-test")
+        acquisition = Acquisition(storage=storage, item=item, item_qtty=item_qtty, item_cost=item_cost)
+        container = Container(storage=storage, qr_code=QRCode(company_id=company_id))
+        inventories = [Inventory(container=container, acquisition=acquisition) for _ in range(count)]
+        db.session.add_all([storage, item, acquisition, container, *inventories])
+        db.session.flush()
+        for _ in inventories:
+            ItemStock.apply_inventory(acquisition, company_id)
+        db.session.commit()
+        return acquisition.id, [inventory.id for inventory in inventories]
+
+    def delete_inventory(self, inventory_id: int):
+        return self.app.test_client().delete(
+            f"/v1/company/storages/acquisitions/inventories/{inventory_id}", headers=self.headers
+        )
+
+    def assertLedgerVerified(self):
+        result = self.app.test_cli_runner().invoke(args=["stock", "verify", "--company-id", str(self.company["company_id"])])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def test_delete_inventory(self):
+        _, inventory_ids = self.create_inventories(2)
+        resp = self.delete_inventory(inventory_ids[0])
+        self.assertEqual(resp.status_code, 200, resp.get_data(as_text=True))
+        self.assertLedgerVerified()
+
+    def test_delete_inventory_during_acquisition_update(self):
+        """the delete waits for a concurrent update of the acquisition and removes the updated quantity and cost"""
+        from app.extensions import db
+
+        acquisition_id, inventory_ids = self.create_inventories(2)
+        responses = []
+
+        def delete():
+            with self.app.app_context():
+                responses.append(self.delete_inventory(inventory_ids[0]))
+
+        # same writes as PUT /v1/company/items/acquisitions/<id>, in a transaction that is still open
+        with db.engine.connect() as conn:
+            trans = conn.begin()
+            acquisition = conn.execute(
+                text("SELECT item_id, storage_id FROM acquisition WHERE id = :id FOR UPDATE"), {"id": acquisition_id}
+            ).one()
+            conn.execute(text("UPDATE acquisition SET item_qtty = 5, item_cost = 20 WHERE id = :id"), {"id": acquisition_id})
+            conn.execute(text(
+                "UPDATE item_stock SET quantity = quantity + :quantity, total_cost = total_cost + :total_cost "
+                "WHERE item_id = :item_id AND storage_id = :storage_id"
+            ), {"quantity": 2 * (5 - 2), "total_cost": 2 * (5 * 20 - 2 * 10), **acquisition._mapping})
+
+            worker = threading.Thread(target=delete)
+            worker.start()
+            time.sleep(0.5)
+            self.assertTrue(worker.is_alive(), "the delete did not wait for the acquisition update")
+            trans.commit()
+
+        worker.join(timeout=10)
+        self.assertEqual(responses[0].status_code, 200, responses[0].get_data(as_text=True))
+        self.assertLedgerVerified()
+
+
+if __name__ == "__main__":
+    unittest.main()
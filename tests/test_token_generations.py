@@ -0,0 +1,90 @@
+"""
+Access tokens issued while redis-service is down: login still works, and the generation claims of the
+token keep it revocable. Runs against the scratch postgresql database of DATABASE_URL, skipped when it is
+not set.
+
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import unittest
+from unittest import mock
+import redis
+from flask_jwt_extended import decode_token
+from benchmarks.common import create_bench_app, create_company
+
+PASSWORD = "Benchmark-password-1"
+
+
+class RedisDown:
+    """client of a redis-service that is not available"""
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise redis.ConnectionError("redis-service is down")
+        return command
+
+
+class RedisGenerations:
+    """client with the current generations of the keys"""
+
+    def __init__(self, generations: dict):
+        self.generations = generations
+
+    def mget(self, keys: list) -> list:
+        return [self.generations.get(key) for key in keys]
+
+
+def is_revoked(claims: dict, generations: dict) -> bool:
+    """token_generations.is_revoked with the current <generations>, without the per-worker cache"""
+    from app.utils.redis_service import invalidation_listener, token_generations
+    with mock.patch.object(invalidation_listener, "is_subscribed", lambda: False):
+        return token_generations.is_revoked(RedisGenerations(generations), claims)
+
+
+@unittest.skipUnless(os.environ.get("DATABASE_URL"), "DATABASE_URL of a scratch database is required")
+class LoginRedisDownTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_bench_app(database=True)
+        cls.ctx = cls.app.app_context()
+        cls.ctx.push()
+
+        from app.extensions import db
+        from app.models.main import User
+        cls.company = create_company()
+        user = db.session.query(User).get(cls.company["user_id"])
+        user.password = PASSWORD
+        db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        from app.extensions import db
+        db.session.remove()
+        cls.ctx.pop()
+
+    def login(self, **body) -> dict:
+        from app.utils.redis_service import RedisClient
+        with mock.patch.object(RedisClient, "get_client", lambda self: RedisDown()):
+            resp = self.app.test_client().post(
+                "/v1/auth/login/user", json={"email": self.company["email"], "password": PASSWORD, **body}
+            )
+        self.assertEqual(resp.status_code, 201, resp.get_data(as_text=True))
+        return decode_token(resp.get_json()["data"]["access_token"], allow_expired=True)
+
+    def test_user_login(self):
+        claims = self.login()
+        self.assertEqual(claims["user_gen"], 0)
+        self.assertFalse(is_revoked(claims, {}))
+        self.assertTrue(is_revoked(claims, {f"jwt:gen:user:{self.company['user_id']}": b"1"}))  # sessions revoked later
+
+    def test_company_login(self):
+        claims = self.login(company_id=self.company["company_id"])
+        self.assertEqual((claims["user_gen"], claims["company_gen"]), (0, 0))
+        self.assertEqual(claims["company_id"], self.company["company_id"])
+        self.assertFalse(is_revoked(claims, {}))
+        self.assertTrue(is_revoked(claims, {f"jwt:gen:company:{self.company['company_id']}": b"2"}))
+
+
+if __name__ == "__main__":
+    unittest.main()